@@ -1,13 +1,21 @@
-from fastapi import FastAPI, UploadFile, File, Form
-from fastapi.responses import HTMLResponse, FileResponse, JSONResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, UploadFile, File, Form, Header, BackgroundTasks
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from PIL import Image, ImageDraw, ImageFont
-import io, os, uuid, textwrap
-from fastapi import FastAPI, UploadFile, File, Form
-from fastapi.responses import FileResponse, JSONResponse
 from PIL import Image, ImageDraw, ImageFont, ImageColor
-import io, os, uuid
+import asyncio, collections, contextlib, hashlib, io, json, logging, os, re, time, uuid, textwrap, zipfile
+from bannerkit.decoded import DecodedCache, digest_id
+from bannerkit.flight import SingleFlight
+from bannerkit.fonts import font_cache_stats, scan_fonts, truetype
+from bannerkit.imaging import (OUTPUT_FORMATS, ImageTooLarge, UnsupportedImage, decode_image,
+                               encode_image, encode_output, long_edge_size, negotiate_format, pixel_bytes,
+                               settings_digest)
+from bannerkit.layers import LayerCache, blend_region, fill_blend, have_numpy, ink_layer, paste_ink
+from bannerkit.metrics import (INPUT_MEGAPIXELS, OUTPUT_BYTES, STAGE_SECONDS, Counter, metrics_router,
+                               server_timing, stage, timed)
+from bannerkit.outputs import OutputCache, content_keys, output_router
+from bannerkit.pool import RenderPool
+from bannerkit.startup import FirstRequestLog, init_codecs, mark_started, warmup_photo
+from bannerkit.uploads import UPLOADS_REJECTED, UploadLimits
 
 # --- eXp brand color presets ---
 # Alpha 180 ≈ nice translucent overlay
@@ -18,92 +26,211 @@ EXP_PRESETS = {
     "orange":     {"banner": (245, 130, 31, 180), "text": (0, 0, 0, 255)},        # #F5821F
 }
 
-app = FastAPI(title="Photo Banner Bot")
+# One-click labels in the form; their banner layers are prerendered at startup.
+PRESET_LABELS = [
+    "PRICE DROP",
+    "1/0 BUY DOWN STARTING @ 3.99%",
+    "OPEN HOUSE THIS SAT 11–2",
+    "BUILDER INCENTIVE: $15,000",
+    "NOW FHA/VA ELIGIBLE",
+]
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    """Warm-up before serving, teardown on exit; see the Startup section."""
+    await startup()
+    try:
+        yield
+    finally:
+        shutdown()
+
+app = FastAPI(title="Photo Banner Bot", lifespan=lifespan)
+log = logging.getLogger("uvicorn.error")  # printed by uvicorn's default logging config
 
 
 
 # ----- Config -----
-OUTPUT_DIR = "outputs"
-FONT_PATHS = [
-    "fonts/DejaVuSans-Bold.ttf",   # include this in your repo
-    "fonts/DejaVuSans.ttf",
+OUTPUT_DIR = os.environ.get("OUTPUT_DIR", "outputs")
+FONT_DIR = os.path.join(os.path.dirname(__file__), "fonts")
+FONT_FAMILY = os.environ.get("FONT_FAMILY", "GreycliffCF")
+FALLBACK_FONTS = [
     "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
-    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/System/Library/Fonts/Supplemental/Arial Bold.ttf",
 ]
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-# Static (optional for downloads)
-app.mount("/outputs", StaticFiles(directory=OUTPUT_DIR), name="outputs")
-
-app.add_middleware(
+MAX_LONG_EDGE = int(os.environ.get("MAX_LONG_EDGE", 2048))
+OUTPUT_FORMAT = os.environ.get("OUTPUT_FORMAT", "jpeg")       # jpeg | webp | png, when the client doesn't ask
+# Rendering runs in a pool so big uploads don't block the event loop (or /healthz);
+# RENDER_POOL, RENDER_WORKERS and the rest are read by bannerkit.pool.
+# Rendered outputs double as a cache; OUTPUT_MAX_MB and OUTPUT_MAX_AGE_DAYS trim the directory.
+OUTPUT_VARIANTS = os.environ.get("OUTPUT_VARIANTS", "1") == "1"  # /outputs/<key>.<other format> transcodes once
+# Shared by every instance, with OUTPUT_DIR as this instance's read-through cache.
+OUTPUT_STORE = os.environ.get("OUTPUT_STORE", "")        # optional: s3://bucket/prefix or a directory
+# Form previews: a downscaled copy of the photo is kept per token while it's being tuned.
+PREVIEW_LONG_EDGE = int(os.environ.get("PREVIEW_LONG_EDGE", 800))
+PREVIEW_TTL = int(os.environ.get("PREVIEW_TTL", 600))  # seconds since last use
+PREVIEW_CACHE_BYTES = int(float(os.environ.get("PREVIEW_CACHE_MB", 64)) * 1024 * 1024)
+# Decoded, resized photos kept so a re-render with new settings skips straight to compositing; 0 = off.
+DECODE_CACHE_BYTES = int(float(os.environ.get("DECODE_CACHE_MB", 128)) * 1024 * 1024)
+
+
+# ----- Metrics -----
+# Served at /metrics by bannerkit.metrics; render stages are timed in the pool
+# workers and observed here, so /metrics covers every worker.
+REQUESTS = Counter("banner_requests_total", "Render requests by endpoint, color preset, badge and cache outcome.")
+
+def preset_label(color_preset: str) -> str:
+    """Metric label for a color preset; anything else is "custom" to keep label values bounded."""
+    return color_preset if color_preset in EXP_PRESETS else "custom"
+
+# ----- Uploads -----
+# Size limits and image sniffing while the body streams in; see bannerkit.uploads.
+# Middleware added later wraps what came before: CORS goes last, so every
+# response (upload rejections included) carries its headers.
+app.add_middleware(FirstRequestLog)
+app.add_middleware(UploadLimits)
+app.add_middleware(  # outermost, so rejections carry CORS headers too
     CORSMiddleware,
     allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]
 )
 
-# ----- Helpers -----
-def load_font(preferred_size: int) -> ImageFont.FreeTypeFont:
-    """Loads Greycliff if available, else falls back to a system font."""
-    font_dir = os.path.join(os.path.dirname(__file__), "fonts")
+# ----- Font registry -----
+# Scanned once at import (see bannerkit.fonts); fallback resolved once instead of per call.
+FONT_FACES = scan_fonts(FONT_DIR)
+FALLBACK_FONT = next((p for p in FALLBACK_FONTS if os.path.exists(p)), None)
+
 
-    # Path to your Greycliff Bold font
-    greycliff_path = os.path.join(font_dir, "GreycliffCF-Bold.otf")
+# ----- Helpers -----
+def load_font(preferred_size: int, weight: str = "Bold") -> ImageFont.FreeTypeFont:
+    """Loads Greycliff (Bold unless asked otherwise) if available, else falls back to a system font.
 
-    # Try Greycliff first
-    if os.path.exists(greycliff_path):
+    Fonts come from the registry's LRU, so repeated sizes don't re-parse the file.
+    """
+    path = FONT_FACES.get((FONT_FAMILY, weight))
+    if path:
         try:
-            return ImageFont.truetype(greycliff_path, preferred_size)
+            return truetype(path, preferred_size)
         except Exception as e:
             print("Error loading Greycliff:", e)
 
-    # Fallback options (system fonts)
-    for candidate in [
-        "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
-        "/System/Library/Fonts/Supplemental/Arial Bold.ttf",
-    ]:
-        if os.path.exists(candidate):
-            return ImageFont.truetype(candidate, preferred_size)
+    if FALLBACK_FONT:
+        return truetype(FALLBACK_FONT, preferred_size)
 
     # Last resort fallback
     return ImageFont.load_default()
 
 
 def fit_text_to_box(draw: ImageDraw.ImageDraw, text: str, font_path_size: int, box_w: int, box_h: int, line_spacing: float = 1.0):
-    size = font_path_size
-    while size >= 10:
+    """Largest font size in [10, font_path_size] whose wrapped text fits box_w x box_h.
+
+    Words are measured once at the starting size and those widths are scaled to
+    wrap every candidate, so each try costs one measurement per line instead of a
+    full re-layout, and only O(log n) sizes are tried instead of stepping down
+    2px at a time. Lines are checked with real advances, so the result never
+    overflows the box horizontally (the old char-width guess could).
+    """
+    paragraphs = [raw.strip().split() for raw in text.split("\n")]
+    ref_size = max(10, font_path_size)
+    ref_font = load_font(ref_size)
+    ref_widths = {word: ref_font.getlength(word) for p in paragraphs for word in p}
+    ref_space = ref_font.getlength(" ")
+
+    def wrap(size, font):
+        """Greedy lines at size, or None if a single word is wider than the box."""
+        max_w = box_w * ref_size / size  # box width in reference-size units
+        lines = []
+        for words in paragraphs:
+            line, line_w = [], 0.0
+            for word in words:
+                word_w = ref_widths[word]
+                if line and line_w + ref_space + word_w > max_w:
+                    lines.append(" ".join(line))
+                    line, line_w = [], 0.0
+                line_w += (ref_space if line else 0) + word_w
+                line.append(word)
+            lines.append(" ".join(line))
+        if all(font.getlength(line) <= box_w for line in lines):
+            return lines
+        # Hinting made a line a pixel or so wider than the scaled widths said:
+        # wrap this size again with real advances rather than give up on it.
+        lines = []
+        for words in paragraphs:
+            line = []
+            for word in words:
+                if line and font.getlength(" ".join(line + [word])) > box_w:
+                    lines.append(" ".join(line))
+                    line = []
+                line.append(word)
+            lines.append(" ".join(line))
+        return lines if all(font.getlength(line) <= box_w for line in lines) else None
+
+    def layout_if_fits(size):
         font = load_font(size)
-        max_chars = max(1, int(box_w / (size * 0.55)))
-        wrapped = []
-        for raw in text.split("\n"):
-            wrapped.extend(textwrap.wrap(raw.strip(), width=max_chars) or [""])
+        lines = wrap(size, font)
+        if lines is None:
+            return None
         total_h = 0
-        for line in wrapped:
-            w, h = draw.textbbox((0, 0), line, font=font)[2:]
+        for line in lines:
+            h = draw.textbbox((0, 0), line, font=font)[3]
             total_h += h
             total_h += int(h * (line_spacing - 1))
-        if total_h <= box_h:
-            return font, wrapped
-        size -= 2
+        return (font, lines) if total_h <= box_h else None
+
+    # The widest word must fit on a line, which caps the size without any layout
+    # (+1px: scaled widths are a hair off either way); short labels usually fit
+    # right at that cap. Otherwise gallop down from it (1, 2, 4... px) until
+    # something fits, then bisect the bracket.
+    widest = max(ref_widths.values(), default=0)
+    hi = min(font_path_size, int(box_w * ref_size / widest) + 1) if widest else font_path_size
+    lo, step, best = hi, 1, None
+    while best is None and lo >= 10:
+        best = layout_if_fits(lo)
+        if best is None:
+            hi = lo - 1
+            lo = max(10, lo - step) if lo > 10 else 9
+            step *= 2
+    lo += 1
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        fitted = layout_if_fits(mid)
+        if fitted:
+            best, lo = fitted, mid + 1
+        else:
+            hi = mid - 1
+    if best:
+        return best
     return load_font(10), textwrap.wrap(text, width=max(1, int(box_w / 6))) or [""]
 
-def add_left_banner(img: Image.Image, text: str, width_ratio: float = 0.22,
-                    bg_rgba=(0,0,0,180), text_fill=(255,255,255,255), padding_ratio=0.06):
-    w, h = img.size
-    banner_w = max(40, int(w * width_ratio))
-    banner_x0, banner_y0 = 0, 0
-    banner_x1, banner_y1 = banner_w, h
-
-    overlay = Image.new("RGBA", img.size, (0,0,0,0))
-    odraw = ImageDraw.Draw(overlay)
-    odraw.rectangle([banner_x0, banner_y0, banner_x1, banner_y1], fill=bg_rgba)
-    img = Image.alpha_composite(img.convert("RGBA"), overlay)
-
+# ----- Layer cache -----
+# Fitting, wrapping and rasterizing a label depend on the label and the photo
+# size but not on colors, so the text is kept as an L-mode mask (cropped to its
+# ink) and tinted at paste time. Photos are resized to MAX_LONG_EDGE, so a few
+# sizes cover nearly every request; the presets are built before the first one.
+PREWARM_ASPECTS = [(3, 2), (2, 3), (4, 3), (3, 4)]
+layers = LayerCache()  # LAYER_CACHE_MB per render worker; see bannerkit.layers
+
+def prewarm_layers():
+    """Build the preset labels' banner and badge layers at the usual photo sizes."""
+    with layers.uncounted():
+        for aspect in PREWARM_ASPECTS:
+            w, h = long_edge_size((aspect[0] * 1000, aspect[1] * 1000), MAX_LONG_EDGE)
+            for label in PRESET_LABELS:
+                left_banner_layer(w, h, label, max(40, int(w * 0.22)), 0.06)
+                badge_layer(w, h, label, "top-right")
+
+def left_banner_layer(w: int, h: int, text: str, banner_w: int, padding_ratio: float) -> dict:
+    return layers.get(("left_banner", w, h, text, banner_w, padding_ratio),
+                      lambda: _build_left_banner_layer(w, h, text, banner_w, padding_ratio))
+
+def _build_left_banner_layer(w, h, text, banner_w, padding_ratio):
+    # rectangle() is inclusive of x1, so the strip is banner_w + 1 wide
+    mask = Image.new("L", (min(w, banner_w + 1), h), 0)
     pad = int(banner_w * padding_ratio)
-    text_x0 = banner_x0 + pad
-    text_y0 = banner_y0 + pad
+    text_x0 = pad
+    text_y0 = pad
     text_w = banner_w - (2 * pad)
     text_h = h - (2 * pad)
 
-    draw = ImageDraw.Draw(img)
+    draw = ImageDraw.Draw(mask)
     font, lines = fit_text_to_box(draw, text, font_path_size=int(banner_w * 0.28), box_w=text_w, box_h=text_h, line_spacing=1.05)
 
     line_heights = []
@@ -120,14 +247,302 @@ def add_left_banner(img: Image.Image, text: str, width_ratio: float = 0.22,
         lbbox = draw.textbbox((0, 0), line, font=font)
         lw = lbbox[2] - lbbox[0]
         line_x = text_x0 + max(0, (text_w - lw) // 2)
-        draw.text((line_x, current_y), line, font=font, fill=text_fill)
+        draw.text((line_x, current_y), line, font=font, fill=255)
         current_y += line_heights[i] + int(line_heights[i] * 0.05)
+    return ink_layer(mask)
+
+def badge_layer(W: int, H: int, text: str, corner: str) -> dict:
+    return layers.get(("badge", W, H, text, corner), lambda: _build_badge_layer(W, H, text, corner))
+
+def _build_badge_layer(W, H, text, corner):
+    margin = int(min(W, H) * 0.03)
+    size = max(12, int(min(W, H) * 0.045))
+    text_w = load_font(size).getlength(text)
+    if text_w > W * 0.45:
+        size = max(12, int(size * W * 0.45 / text_w))
+    font = load_font(size)
+
+    l, t, r, b = font.getbbox(text)
+    pad_x, pad_y = int((b - t) * 0.9), int((b - t) * 0.45)
+    cap_w, cap_h = (r - l) + 2 * pad_x, (b - t) + 2 * pad_y
+    x0 = margin if corner == "top-left" else W - margin - cap_w
+    y0 = margin
+
+    # Blend just the capsule's bounding box
+    box = (max(0, x0), y0, min(W, x0 + cap_w + 1), min(H, y0 + cap_h + 1))
+    mask = Image.new("L", (box[2] - box[0], box[3] - box[1]), 0)
+    ImageDraw.Draw(mask).text((x0 - box[0] + pad_x - l, pad_y - t), text, font=font, fill=255)
+    return ink_layer(mask, box=box, capsule=(x0 - box[0], 0, x0 - box[0] + cap_w, cap_h))
+
+# ----- Compositing -----
+def add_left_banner(img: Image.Image, text: str, width_ratio: float = 0.22,
+                    bg_rgba=(0,0,0,180), text_fill=(255,255,255,255), padding_ratio=0.06):
+    """Draws the banner onto img in place and returns it.
 
-    return img.convert("RGB")
+    Only the banner strip is cropped, blended and pasted back; the rest of the
+    frame is untouched and keeps its mode (RGB in, RGB out). With NumPy, RGB
+    photos are blended in one vectorized pass instead of alpha_composite.
+    """
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGB")
+    w, h = img.size
+    banner_w = max(40, int(w * width_ratio))
+    layer = left_banner_layer(w, h, text, banner_w, padding_ratio)
+
+    # rectangle() is inclusive of x1, so the strip is banner_w + 1 wide
+    region = img.crop((0, 0, min(w, banner_w + 1), h))
+    if img.mode == "RGB" and have_numpy():
+        region = blend_region(region, fill_blend(bg_rgba))
+    else:
+        region = Image.alpha_composite(region.convert("RGBA"), Image.new("RGBA", region.size, bg_rgba))
+    paste_ink(region, layer, text_fill)
+
+    img.paste(region if region.mode == img.mode else region.convert(img.mode), (0, 0))
+    return img
+
+def draw_banner_with_autofit(img: Image.Image, banner_pct: float, banner_rgba, text_rgba, message: str):
+    """Left banner sized as a percentage of the photo width, text fitted to it."""
+    return add_left_banner(img, message, width_ratio=banner_pct / 100.0,
+                           bg_rgba=banner_rgba, text_fill=text_rgba)
+
+def draw_capsule_badge(base: Image.Image, text: str, badge_rgba, text_rgba, corner: str = "top-right"):
+    """Pill-shaped label in a top corner, drawn onto base in place; the capsule auto-sizes to the text."""
+    img = base if base.mode in ("RGB", "RGBA") else base.convert("RGB")
+    W, H = img.size
+    layer = badge_layer(W, H, text, corner)
+    box, capsule = layer["box"], layer["capsule"]
+
+    region = img.crop(box).convert("RGBA")
+    overlay = Image.new("RGBA", region.size, (0,0,0,0))
+    ImageDraw.Draw(overlay).rounded_rectangle(capsule, radius=capsule[3] // 2, fill=badge_rgba)
+    region = Image.alpha_composite(region, overlay)
+    paste_ink(region, layer, text_rgba)
+    img.paste(region if img.mode == "RGBA" else region.convert(img.mode), box[:2])
+    return img
 
 def sanitize_text(s: str) -> str:
     return " ".join((s or "").strip().split())
 
+def parse_rgba(s, default):
+    try:
+        parts = [int(x.strip()) for x in s.split(",")]
+        if len(parts) == 4:
+            return tuple(parts)
+    except Exception:
+        pass
+    return default
+
+def resolve_generate_params(text="", width_pct="22", opacity="180", bg_rgba="0,0,0,180",
+                            text_rgba="255,255,255,255", color_preset="", enable_badge="off",
+                            badge_text="", badge_corner="top-right", format="", quality="", max_bytes="") -> dict:
+    """Form fields -> fully-resolved render settings (also the render cache key)."""
+    # --- parse form fields ---
+    banner_pct = float(width_pct or "22")
+    alpha = int(opacity or "180")
+
+    banner_rgba = parse_rgba(bg_rgba, (0, 0, 0, alpha))
+    if banner_rgba[3] != alpha:
+        banner_rgba = (banner_rgba[0], banner_rgba[1], banner_rgba[2], alpha)
+    text_color = parse_rgba(text_rgba, (255, 255, 255, 255))
+
+    # --- eXp preset override ---
+    preset = color_preset.strip()
+    if preset in EXP_PRESETS:
+        banner_rgba = EXP_PRESETS[preset]["banner"]
+        text_color = EXP_PRESETS[preset]["text"]
+
+    # --- capsule badge (optional) ---
+    badge = badge_text.strip() if enable_badge == "on" else ""
+    badge_alpha = min(230, banner_rgba[3] + 40)
+
+    return {
+        "banner_pct": banner_pct,
+        "banner_rgba": banner_rgba,
+        "text_rgba": text_color,
+        "message": text.strip() or "PRICE DROP",
+        "badge_text": badge,
+        "badge_rgba": (banner_rgba[0], banner_rgba[1], banner_rgba[2], badge_alpha),
+        "badge_corner": badge_corner or "top-right",
+        "long_edge": MAX_LONG_EDGE,
+        "format": negotiate_format(format, "", OUTPUT_FORMAT),
+        "quality": _int_in(quality, 1, 100),
+        "max_bytes": _int_in(max_bytes, 1, None),
+    }
+
+def _int_in(value, lo, hi):
+    """int(value) if it's a number in [lo, hi], else None (blank form fields)."""
+    try:
+        n = int(str(value).strip())
+    except ValueError:
+        return None
+    return n if n >= lo and (hi is None or n <= hi) else None
+
+def spec_fields(spec) -> dict:
+    """A /generate_batch spec -> /generate form fields; TypeError unless it's an object of strings and numbers."""
+    if not isinstance(spec, dict) or not all(isinstance(v, (str, int, float)) and not isinstance(v, bool)
+                                             for v in spec.values()):
+        raise TypeError("spec must be an object of /generate fields")
+    return {name: str(value) for name, value in spec.items()}
+
+def slugify(s: str) -> str:
+    s = s.lower().strip()
+    s = re.sub(r"[^a-z0-9]+", "-", s)
+    return re.sub(r"-+", "-", s).strip("-") or "banner"
+
+# ----- Rendering -----
+# Decoding and encoding are bannerkit.imaging; these run in the render pool.
+def compose_generate(img: Image.Image, params: dict) -> Image.Image:
+    """Banner + optional badge, drawn onto img."""
+    with stage("composite"):
+        result = draw_banner_with_autofit(
+            img=img,
+            banner_pct=params["banner_pct"],
+            banner_rgba=params["banner_rgba"],
+            text_rgba=params["text_rgba"],
+            message=params["message"],
+        )
+        if params["badge_text"]:
+            result = draw_capsule_badge(
+                base=result,
+                text=params["badge_text"],
+                badge_rgba=params["badge_rgba"],
+                text_rgba=params["text_rgba"],
+                corner=params["badge_corner"],
+            )
+    return result
+
+def render_generate(raw: bytes, params: dict, keep_base: bool = False):
+    """Decode, banner, badge and encode one upload -> (bytes, quality, decode stats, base). Runs in the render pool.
+
+    With keep_base, base is a copy of the decoded photo from before the banner
+    went on, for the decoded cache; otherwise None.
+    """
+    img, decode_stats = decode_image(raw, params["long_edge"], "RGB")
+    base = img.copy() if keep_base else None
+    data, quality = encode_output(compose_generate(img, params), params)
+    return data, quality, decode_stats, base
+
+def render_decoded(img: Image.Image, params: dict, decode_stats: dict):
+    """render_generate for a photo from the decoded cache; nothing is decoded, so decode_ms is 0."""
+    data, quality = encode_output(compose_generate(img.copy(), params), params)
+    return data, quality, {**decode_stats, "decode_ms": 0.0}, None
+
+def render_variant(img: Image.Image, params: dict) -> bytes:
+    """Banner a copy of an already-decoded photo. Runs in the render pool."""
+    return encode_output(compose_generate(img.copy(), params), params)[0]
+
+# ----- Render pool -----
+# See bannerkit.pool. Each worker process shares the layer counters and builds
+# the preset layers before its first render.
+def init_render_worker(layer_counts):
+    """Runs once in each pool process: share the layer counters, import NumPy, build the preset layers, warm up."""
+    layers.counts = layer_counts
+    have_numpy()
+    prewarm_layers()
+    warm_up()
+
+render_pool = RenderPool(init_render_worker, (layers.counts,))
+
+# ----- Single flight -----
+# Identical uploads arriving together share one render; see bannerkit.flight.
+single_flight = SingleFlight(render_pool.run)
+
+# ----- Render cache -----
+# Outputs are stored under a hash of the upload bytes plus the fully-resolved
+# render settings, so a repeat submission is served from disk without rendering.
+# OUTPUT_DIR is swept by size and age, and with OUTPUT_STORE set it's a
+# read-through cache of a store every instance shares; see bannerkit.outputs.
+RENDER_VERSION = 2  # bump when rendering changes so stale outputs aren't reused
+# Server settings that change the bytes too: encoder settings, the font files in
+# use and the long edge. Part of every key, so changing one doesn't serve old renders.
+RENDER_SETTINGS = settings_digest([path for (family, _), path in FONT_FACES.items() if family == FONT_FAMILY]
+                                  + [FALLBACK_FONT], family=FONT_FAMILY, long_edge=MAX_LONG_EDGE)
+outputs = OutputCache(OUTPUT_DIR, OUTPUT_STORE)
+
+def render_keys(raw: bytes, params_list: list, digest=None) -> list:
+    """Cache key per settings dict; the upload is hashed once however many there are.
+
+    digest, if given, is hashlib.sha256 of the upload, so raw isn't needed.
+    """
+    return content_keys(raw, params_list, digest, v=RENDER_VERSION, s=RENDER_SETTINGS)
+
+def render_key(raw: bytes, params: dict) -> str:
+    return render_keys(raw, [params])[0]
+
+# ----- Previews -----
+# The form decodes the photo once at PREVIEW_LONG_EDGE, keeps it under a token and
+# re-renders that small copy as settings change; /generate only runs on submit.
+# Only touched from the event loop. Least recently used copies go first, so
+# expired ones are always at the front.
+PREVIEW_QUALITY = 80
+_previews = collections.OrderedDict()  # token -> (image, expires)
+_preview_bytes = 0
+
+def put_preview(img: Image.Image) -> str:
+    global _preview_bytes
+    now = time.time()
+    token = uuid.uuid4().hex[:16]
+    _previews[token] = (img, now + PREVIEW_TTL)
+    _preview_bytes += pixel_bytes(img)
+    while len(_previews) > 1:
+        oldest, (old, expires) = next(iter(_previews.items()))
+        if expires > now and _preview_bytes <= PREVIEW_CACHE_BYTES:
+            break
+        del _previews[oldest]
+        _preview_bytes -= pixel_bytes(old)
+    return token
+
+def get_preview(token: str):
+    """The photo kept for token (and its TTL restarted), or None once it has expired or been evicted."""
+    entry = _previews.get(token)
+    if entry is None or entry[1] < time.time():
+        return None
+    _previews[token] = (entry[0], time.time() + PREVIEW_TTL)
+    _previews.move_to_end(token)
+    return entry[0]
+
+def render_preview(img: Image.Image, params: dict) -> bytes:
+    return encode_image(compose_generate(img.copy(), params), "jpeg", PREVIEW_QUALITY)[0]
+
+def preview_stats() -> dict:
+    return {"photos": len(_previews), "bytes": _preview_bytes, "max_bytes": PREVIEW_CACHE_BYTES}
+
+# ----- Decoded photos -----
+# Agents often send the same photo again with only the text, colors or badge
+# changed. The decoded, resized photo is kept under the upload's hash (sent back
+# as X-Photo-Hash), so that re-render goes straight to compositing, and a client
+# can send photo_hash instead of the photo while it's still here.
+decoded = DecodedCache(DECODE_CACHE_BYTES)
+
+# ----- Startup -----
+# Free-plan instances sleep when idle, so cold starts are common. Startup only
+# registers the codecs and starts the pool; the workers build their layers and
+# render a small banner in every format in the background, so /healthz answers
+# at once and the first upload finds fonts, layers and encoders ready. Startup
+# time and each endpoint's first request are logged.
+_warming = None  # asyncio.Task running render_pool.warm
+
+def warm_up():
+    """Decode, banner and encode a small photo with and without a badge in every format, without counting layer lookups."""
+    init_codecs()
+    photo = warmup_photo()
+    with layers.uncounted():
+        for fmt in OUTPUT_FORMATS:
+            for badge in ("", PRESET_LABELS[0]):
+                render_generate(photo, resolve_generate_params(enable_badge="on", badge_text=badge, format=fmt))
+
+async def startup():
+    global _warming
+    t0 = time.perf_counter()
+    init_codecs()
+    _warming = asyncio.create_task(render_pool.warm())
+    log.info("startup: %.0f ms", (mark_started() - t0) * 1000)
+
+def shutdown():
+    if _warming is not None:
+        _warming.cancel()
+    render_pool.shutdown()
+
 # ----- Routes -----
 @app.get("/", response_class=HTMLResponse)
 def index():
@@ -156,7 +571,39 @@ def index():
     const preset = document.getElementById('preset').value;
     if (!preset) return;
     document.getElementById('text').value = preset;
+    schedulePreview();
+  }
+
+  // Live preview: the photo goes up once, after that only the settings are sent.
+  let previewToken = null, previewTimer = null, previewUrl = null, previewSeq = 0;
+  function schedulePreview() {
+    clearTimeout(previewTimer);
+    previewTimer = setTimeout(updatePreview, 150);
+  }
+  async function updatePreview() {
+    const form = document.getElementById('banner-form');
+    if (!form.photo.files.length) return;
+    const seq = ++previewSeq;
+    const data = new FormData(form);
+    if (previewToken) { data.delete('photo'); data.set('token', previewToken); }
+    const resp = await fetch('/preview', { method: 'POST', body: data });
+    if (resp.status === 404 && previewToken) { previewToken = null; return updatePreview(); }
+    const note = document.getElementById('preview-note');
+    if (!resp.ok) { note.textContent = (await resp.json()).error || 'Preview failed'; return; }
+    previewToken = resp.headers.get('X-Preview-Token');
+    const blob = await resp.blob();
+    if (seq !== previewSeq) return;  // a newer preview is on its way
+    if (previewUrl) URL.revokeObjectURL(previewUrl);
+    previewUrl = URL.createObjectURL(blob);
+    document.getElementById('preview-img').src = previewUrl;
+    note.textContent = 'Preview (low-res). Generate Banner renders the full-size photo.';
   }
+  document.addEventListener('DOMContentLoaded', () => {
+    const form = document.getElementById('banner-form');
+    form.photo.addEventListener('change', () => { previewToken = null; });
+    form.addEventListener('input', schedulePreview);
+    form.addEventListener('change', schedulePreview);
+  });
 </script>
 </head>
 <body>
@@ -164,7 +611,7 @@ def index():
     <h1>Photo Banner Bot</h1>
     <p class="note">Upload a listing photo, pick a preset or type custom copy, and get a left-side banner that fits perfectly.</p>
 
-    <form action="/generate" method="post" enctype="multipart/form-data" target="_blank">
+    <form id="banner-form" action="/generate" method="post" enctype="multipart/form-data" target="_blank">
       <label>Photo (JPG/PNG)</label>
       <input type="file" name="photo" accept="image/*" required />
 
@@ -173,11 +620,7 @@ def index():
           <label>Preset (one-click)</label>
           <select id="preset" onchange="setPreset()">
             <option value="">— Select a preset —</option>
-            <option>PRICE DROP</option>
-            <option>1/0 BUY DOWN STARTING @ 3.99%</option>
-            <option>OPEN HOUSE THIS SAT 11–2</option>
-            <option>BUILDER INCENTIVE: $15,000</option>
-            <option>NOW FHA/VA ELIGIBLE</option>
+            <!--PRESET_OPTIONS-->
           </select>
         </div>
         <div>
@@ -244,18 +687,21 @@ def index():
         <button type="submit">Generate Banner</button>
       </div>
     </form>
+    <div class="preview">
+      <img id="preview-img" alt="" style="max-width: 100%; border-radius: 8px;" />
+      <p id="preview-note" class="note">Pick a photo to see a live preview.</p>
+    </div>
     <p class="note preview">Result opens in a new tab and is saved under <code>/outputs</code>.</p>
   </div>
 </body>
 </html>
     """
-    return HTMLResponse(content=html)
-
-@app.post("/generate")
+    options = "\n            ".join(f"<option>{label}</option>" for label in PRESET_LABELS)
+    return HTMLResponse(content=html.replace("<!--PRESET_OPTIONS-->", options))
 
 @app.post("/generate")
 async def generate(
-    photo: UploadFile = File(...),
+    photo: UploadFile = File(None),
     text: str = Form(""),
     width_pct: str = Form("22"),
     opacity: str = Form("180"),
@@ -266,88 +712,234 @@ async def generate(
     enable_badge: str = Form("off"),
     badge_text: str = Form(""),
     badge_corner: str = Form("top-right"),
+    persist: str = Form("on"),  # "off": don't keep a copy under /outputs (no render cache either)
+    format: str = Form(""),     # jpeg | webp | png; blank = negotiate from Accept
+    quality: str = Form(""),
+    max_bytes: str = Form(""),  # JPEG/WebP: highest quality that fits, e.g. an MLS upload cap
+    photo_hash: str = Form(""),  # instead of photo: the X-Photo-Hash of a recent upload (404 once it's been dropped)
+    accept: str = Header(""),
+    background_tasks: BackgroundTasks = None,
 ):
-
+    timings = {}
+    preset = preset_label(color_preset)
     try:
-        from io import BytesIO
-        import re
-
-        # Load image
-        raw = await photo.read()
-        img = Image.open(BytesIO(raw)).convert("RGBA")
-
-        # --- parse form fields ---
-        banner_pct = float(width_pct or "22")
-        alpha = int(opacity or "180")
-
-        def parse_rgba(s, default):
-            try:
-                parts = [int(x.strip()) for x in s.split(",")]
-                if len(parts) == 4:
-                    return tuple(parts)
-            except Exception:
-                pass
-            return default
-
-        banner_rgba = parse_rgba(bg_rgba, (0, 0, 0, alpha))
-        if banner_rgba[3] != alpha:
-            banner_rgba = (banner_rgba[0], banner_rgba[1], banner_rgba[2], alpha)
-        text_color = parse_rgba(text_rgba, (255, 255, 255, 255))
-
-        # --- eXp preset override ---
-        preset = color_preset.strip()
-        if preset in EXP_PRESETS:
-            banner_rgba = EXP_PRESETS[preset]["banner"]
-            text_color = EXP_PRESETS[preset]["text"]
-
-        # --- draw left banner with autofit ---
-        message = text.strip() or "PRICE DROP"
-        result = draw_banner_with_autofit(
-            img=img,
-            banner_pct=banner_pct,
-            banner_rgba=banner_rgba,
-            text_rgba=text_color,
-            message=message,
-        )
-
-        # --- capsule badge (optional) ---
-        if enable_badge == "on" and badge_text.strip():
-            badge_alpha = min(230, banner_rgba[3] + 40)
-            badge_fill = (banner_rgba[0], banner_rgba[1], banner_rgba[2], badge_alpha)
-            result = draw_capsule_badge(
-                base=result,
-                text=badge_text.strip(),
-                badge_rgba=badge_fill,
-                text_rgba=text_color,
-                corner=badge_corner or "top-right",
-            )
-
-        # --- save final image ---
-        OUTPUT_DIR = "outputs"
-        os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-        def _slug(s):
-            s = s.lower().strip()
-            s = re.sub(r"[^a-z0-9]+", "-", s)
-            return re.sub(r"-+", "-", s).strip("-") or "banner"
-
-        base_name = os.path.splitext(photo.filename or "photo")[0]
-        label_src = badge_text if (enable_badge == "on" and badge_text) else message
-        out_name = f"banner-{_slug(label_src)[:30]}-{_slug(base_name)}.jpg"
-        out_path = os.path.join(OUTPUT_DIR, out_name)
-
-        result_rgb = result.convert("RGB")
-        result_rgb.save(out_path, "JPEG", quality=92, optimize=True)
-
-        return FileResponse(out_path, media_type="image/jpeg", filename=out_name)
-
+        params = resolve_generate_params(text, width_pct, opacity, bg_rgba, text_rgba,
+                                         color_preset, enable_badge, badge_text, badge_corner,
+                                         negotiate_format(format, accept, OUTPUT_FORMAT), quality, max_bytes)
+        _, ext, media_type = OUTPUT_FORMATS[params["format"]]
+
+        # Load image, or find the one photo_hash names among the recently decoded
+        raw, entry = None, None
+        if photo is not None:
+            with timed("read", timings):
+                raw = await photo.read()
+            with timed("hash", timings):
+                digest = await asyncio.to_thread(hashlib.sha256, raw)
+            photo_id = digest_id(digest)
+        elif photo_hash:
+            photo_id = photo_hash.strip().lower()
+            entry = decoded.get(photo_id, params["long_edge"])
+            if entry is None:
+                return JSONResponse({"error": "Photo not in memory any more, send it again"}, status_code=404)
+            digest = entry[1]
+        else:
+            return JSONResponse({"error": "No photo"}, status_code=400)
+
+        base_name = os.path.splitext(photo.filename or "photo")[0] if photo is not None else "photo"
+        label_src = params["badge_text"] or params["message"]
+        out_name = f"banner-{slugify(label_src)[:30]}-{slugify(base_name)}{ext}"
+
+        # --- same photo + same settings: serve the earlier render ---
+        key = render_keys(raw, [params], digest)[0]
+        out_path = await outputs.lookup(key + ext)
+        badge = "on" if params["badge_text"] else "off"
+        if out_path:
+            REQUESTS.inc(endpoint="generate", preset=preset, badge=badge, cache="hit")
+            return FileResponse(out_path, media_type=media_type, filename=out_name,
+                                headers={"X-Render-Cache": "hit", "X-Photo-Hash": photo_id, "Vary": "Accept",
+                                         **server_timing(timings)})
+
+        # --- render off the event loop, or join an identical render already running ---
+        if not single_flight.in_flight(key) and render_pool.busy():
+            return render_pool.busy_response()
+        entry = entry or decoded.get(photo_id, params["long_edge"])
+        if entry:
+            render = (render_decoded, entry[0], params, entry[2])
+        else:
+            render = (render_generate, raw, params, DECODE_CACHE_BYTES > 0)
+        (data, used_quality, decode_stats, base), coalesced = await single_flight(key, *render, timings=timings)
+        if base is not None:
+            decoded.put(photo_id, params["long_edge"], base, digest, decode_stats)
+        REQUESTS.inc(endpoint="generate", preset=preset, badge=badge,
+                     cache="coalesced" if coalesced else "miss")
+
+        # --- send the bytes straight back; save under /outputs after the response ---
+        if persist != "off":
+            background_tasks.add_task(outputs.save, key + ext, data)
+
+        src_w, src_h = decode_stats["source"]
+        headers = {
+            "Content-Disposition": f'attachment; filename="{out_name}"',
+            "Vary": "Accept",
+            "X-Render-Cache": "coalesced" if coalesced else "miss",
+            "X-Photo-Hash": photo_id,
+            "X-Source-Size": f"{src_w}x{src_h}",
+            "X-Decode-Ms": str(decode_stats["decode_ms"]),
+            "X-Decode-Peak-Pixel-Bytes": str(decode_stats["peak_pixel_bytes"]),
+            **server_timing(timings),
+        }
+        if used_quality is not None:  # PNG has no quality
+            headers["X-Quality"] = str(used_quality)
+        return Response(data, media_type=media_type, headers=headers)
+
+    except ImageTooLarge as e:
+        UPLOADS_REJECTED.inc(reason="too_many_pixels")
+        return JSONResponse({"error": str(e)}, status_code=413)
+    except UnsupportedImage:
+        return JSONResponse({"error": "Unsupported image"}, status_code=400)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=500)
 
+@app.post("/generate_batch")
+async def generate_batch(
+    photos: list[UploadFile] = File(...),
+    specs: str = Form(""),
+    text: str = Form(""),
+    format: str = Form("json"),
+    accept: str = Header(""),
+):
+    """Several variants of one or more photos; each photo is decoded once.
 
+    `specs` is a JSON list of objects taking the same fields as /generate; when
+    empty, every eXp colorway is rendered with `text`. Returns a JSON manifest,
+    or a ZIP when `format=zip` or the client accepts application/zip.
+    """
+    try:
+        raw_specs = json.loads(specs) if specs.strip() else [{"text": text, "color_preset": name} for name in EXP_PRESETS]
+        if not isinstance(raw_specs, list):
+            raise TypeError("specs must be a list")
+        raw_specs = [spec_fields(spec) for spec in raw_specs]
+        resolved = [resolve_generate_params(**spec) for spec in raw_specs]
+    except (ValueError, TypeError):
+        return JSONResponse({"error": "specs must be a JSON list of /generate field objects"}, status_code=400)
+    if not resolved:
+        return JSONResponse({"error": "No specs"}, status_code=400)
+    # Every photo x spec is a render in the pool, so the whole batch has to fit in the queue.
+    renders = len(photos) * len(resolved)
+    limit = render_pool.queue_limit
+    if renders > limit:
+        return JSONResponse({"error": f"Batch too large: {renders} renders, at most {limit} per request"},
+                            status_code=413)
+    if render_pool.busy(renders):
+        return render_pool.busy_response()
+
+    async def one_photo(upload: UploadFile):
+        raw = await upload.read()
+        digest = await asyncio.to_thread(hashlib.sha256, raw)
+        keys = render_keys(raw, resolved, digest)
+        exts = [OUTPUT_FORMATS[params["format"]][1] for params in resolved]
+        todo = [i for i, (key, ext) in enumerate(zip(keys, exts)) if not await outputs.lookup(key + ext)]
+        entries = [{"spec": params, "id": key + ext, "url": f"/outputs/{key}{ext}", "cached": i not in todo}
+                   for i, (params, key, ext) in enumerate(zip(resolved, keys, exts))]
+        for i, (raw_spec, params) in enumerate(zip(raw_specs, resolved)):
+            REQUESTS.inc(endpoint="generate_batch", preset=preset_label(raw_spec.get("color_preset", "")),
+                         badge="on" if params["badge_text"] else "off", cache="miss" if i in todo else "hit")
+        decode_stats = None
+        if todo:
+            # One decode per photo (none if it's in the decoded cache); the base is shared by every variant.
+            entry = decoded.get(digest_id(digest), MAX_LONG_EDGE)
+            if entry:
+                img, decode_stats = entry[0], {**entry[2], "decode_ms": 0.0}
+            else:
+                img, decode_stats = await render_pool.run(decode_image, raw, MAX_LONG_EDGE, "RGB")
+                decoded.put(digest_id(digest), MAX_LONG_EDGE, img, digest, decode_stats)
+            rendered = await asyncio.gather(*(render_pool.run(render_variant, img, resolved[i]) for i in todo))
+            for i, data in zip(todo, rendered):
+                await outputs.save(keys[i] + exts[i], data)
+        return {"filename": upload.filename, "photo_hash": digest_id(digest), "decode": decode_stats,
+                "outputs": entries}
 
+    try:
+        results = await asyncio.gather(*(one_photo(p) for p in photos))
+    except ImageTooLarge as e:
+        UPLOADS_REJECTED.inc(reason="too_many_pixels")
+        return JSONResponse({"error": str(e)}, status_code=413)
+    except UnsupportedImage:
+        return JSONResponse({"error": "Unsupported image"}, status_code=400)
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
+    if format != "zip" and "application/zip" not in accept:
+        return {"photos": results}
+
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as zf:  # encoded images don't compress further
+        for n, result in enumerate(results, 1):
+            stem = slugify(os.path.splitext(os.path.basename(result["filename"] or ""))[0])
+            for i, entry in enumerate(result["outputs"], 1):
+                label = slugify(entry["spec"]["badge_text"] or entry["spec"]["message"])[:30]
+                ext = os.path.splitext(entry["id"])[1]
+                zf.write(os.path.join(OUTPUT_DIR, entry["id"]), f"{n:02d}-{stem}/{i:02d}-{label}{ext}")
+        zf.writestr("manifest.json", json.dumps({"photos": results}, indent=2))
+    return Response(buf.getvalue(), media_type="application/zip",
+                    headers={"Content-Disposition": 'attachment; filename="banners.zip"'})
+
 # Health check for Render
 @app.get("/healthz")
 def healthz():
     return {"ok": True}
+
+@app.post("/preview")
+async def preview(
+    photo: UploadFile = File(None),
+    token: str = Form(""),
+    text: str = Form(""),
+    width_pct: str = Form("22"),
+    opacity: str = Form("180"),
+    bg_rgba: str = Form("0,0,0,180"),
+    text_rgba: str = Form("255,255,255,255"),
+    color_preset: str = Form(""),
+    enable_badge: str = Form("off"),
+    badge_text: str = Form(""),
+    badge_corner: str = Form("top-right"),
+):
+    """Low-res JPEG of the form's current settings, for tuning before the full render.
+
+    Send the photo once; the response's X-Preview-Token then stands in for it.
+    An expired token gets 404 and the photo has to be sent again.
+    """
+    img = get_preview(token) if token else None
+    if img is None:
+        if photo is None:
+            return JSONResponse({"error": "Preview expired, send the photo again"}, status_code=404)
+        if render_pool.busy():
+            return render_pool.busy_response()
+        raw = await photo.read()
+        try:
+            img, _ = await render_pool.run(decode_image, raw, PREVIEW_LONG_EDGE, "RGB")
+        except ImageTooLarge as e:
+            UPLOADS_REJECTED.inc(reason="too_many_pixels")
+            return JSONResponse({"error": str(e)}, status_code=413)
+        except UnsupportedImage:
+            return JSONResponse({"error": "Unsupported image"}, status_code=400)
+        token = put_preview(img)
+    try:
+        params = resolve_generate_params(text, width_pct, opacity, bg_rgba, text_rgba,
+                                         color_preset, enable_badge, badge_text, badge_corner)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    data = await asyncio.to_thread(render_preview, img, params)
+    return Response(data, media_type="image/jpeg", headers={"X-Preview-Token": token, "Cache-Control": "no-store"})
+
+METRICS = [
+    STAGE_SECONDS, REQUESTS, INPUT_MEGAPIXELS, OUTPUT_BYTES, UPLOADS_REJECTED,
+    *render_pool.gauges(),
+]
+
+app.include_router(metrics_router(METRICS))
+app.include_router(output_router(outputs, single_flight, render_pool, OUTPUT_VARIANTS))
+
+@app.get("/stats")
+def stats():
+    return {"fonts": font_cache_stats(), "layers": layers.stats(), "render_cache": outputs.stats(),
+            "single_flight": single_flight.stats(), "previews": preview_stats(), "decoded": decoded.stats()}
@@ -1,19 +1,79 @@
-from fastapi import FastAPI, UploadFile, File, Form, Header
-from fastapi.responses import FileResponse, JSONResponse, HTMLResponse
+from fastapi import FastAPI, UploadFile, File, Form, Header, BackgroundTasks, Request
+from fastapi.responses import FileResponse, JSONResponse, HTMLResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from PIL import Image, ImageDraw, ImageFont
-import io, os, uuid
+import asyncio, collections, contextlib, hashlib, io, ipaddress, json, logging, math, os, shutil, sqlite3, sys, threading, time, uuid, zipfile
 from fastapi.staticfiles import StaticFiles
-app = FastAPI(title="Photo Banner Bot")
+
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # bannerkit, at the repo root
+from bannerkit.decoded import DecodedCache, digest_id
+from bannerkit.flight import SingleFlight
+from bannerkit.fonts import font_cache_stats, scan_fonts, truetype
+from bannerkit.imaging import (OUTPUT_FORMATS, ImageTooLarge, UnsupportedImage,
+                               decode_image, encode_output, long_edge_size, negotiate_format, settings_digest)
+from bannerkit.layers import LayerCache, blend_layer, blend_region, have_numpy, ink_layer, paste_ink
+from bannerkit.metrics import (INPUT_MEGAPIXELS, OUTPUT_BYTES, STAGE_SECONDS, Counter, Gauge,
+                               metrics_router, server_timing, stage, timed)
+from bannerkit.outputs import OUTPUT_MAX_AGE, OutputCache, content_keys, output_router
+from bannerkit.pool import BULK, INTERACTIVE, RENDER_RETRY_AFTER, RENDER_WORKERS, RenderPool
+from bannerkit.startup import FirstRequestLog, init_codecs, mark_started, warmup_photo
+from bannerkit.uploads import UPLOADS_REJECTED, UploadLimits
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    """Warm-up and job recovery before serving, teardown on exit; see the Startup section."""
+    await startup()
+    try:
+        yield
+    finally:
+        await shutdown()
+
+
+app = FastAPI(title="Photo Banner Bot", lifespan=lifespan)
 app.mount("/static", StaticFiles(directory="static"), name="static")
+log = logging.getLogger("uvicorn.error")  # printed by uvicorn's default logging config
 # --- Settings ---
+# Limits both apps share (MAX_UPLOAD_MB, MAX_INPUT_MEGAPIXELS, OUTPUT_MAX_MB, ...) are read in bannerkit.
 OUTPUT_DIR = os.environ.get("OUTPUT_DIR", "/tmp/outputs")
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+OUTPUT_VARIANTS = os.environ.get("OUTPUT_VARIANTS", "1") == "1"  # /outputs/<key>.<other format> transcodes once
+OUTPUT_STORE = os.environ.get("OUTPUT_STORE", "")        # optional shared store: s3://bucket/prefix or a directory
 MAX_W = int(os.environ.get("MAX_LONG_EDGE", 2048))
-API_KEY = os.environ.get("API_KEY", "")           # optional: if set, required for API calls
-INVITE_CODE = os.environ.get("INVITE_CODE", "")     # optional: if set, required in the HTML form
+OUTPUT_FORMAT = os.environ.get("OUTPUT_FORMAT", "png")         # png | jpeg | webp, when the client doesn't ask
+API_KEY = os.environ.get("API_KEY", "")           # optional: if set, required for API calls; comma-separate several
+INVITE_CODE = os.environ.get("INVITE_CODE", "")     # optional: if set, required in the HTML form; likewise
+API_KEYS = {key.strip() for key in API_KEY.split(",") if key.strip()}
+INVITE_CODES = {code.strip() for code in INVITE_CODE.split(",") if code.strip()}
+TRUSTED_PROXIES = os.environ.get("TRUSTED_PROXIES", "127.0.0.1")  # proxy IPs/CIDRs whose X-Forwarded-For is believed
+RATE_LIMIT_MP_PER_MIN = float(os.environ.get("RATE_LIMIT_MP_PER_MIN", 600))  # input megapixels per caller; 0 = off
+RATE_LIMIT_BURST_MP = float(os.environ.get("RATE_LIMIT_BURST_MP", 240))      # bucket size
+RATE_LIMIT_CONCURRENT = int(os.environ.get("RATE_LIMIT_CONCURRENT", 2))      # renders at once per caller; 0 = off
+FONT_DIR = os.environ.get("FONT_DIR", "fonts")      # optional brand faces, e.g. GreycliffCF-Heavy.otf
+# RENDER_POOL, RENDER_WORKERS, ... are read by bannerkit.pool, LAYER_CACHE_MB by bannerkit.layers.
+BLEND_CACHE_BYTES = int(float(os.environ.get("BLEND_CACHE_MB", 32)) * 1024 * 1024)  # premultiplied layers, per worker
+DECODE_CACHE_BYTES = int(float(os.environ.get("DECODE_CACHE_MB", 128)) * 1024 * 1024)  # decoded photos; 0 = off
+JOB_DIR = os.environ.get("JOB_DIR", os.path.join(OUTPUT_DIR, "jobs"))  # job database + spooled inputs
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", RENDER_WORKERS))       # job photos rendered at once
+
+# --- Metrics ---
+# Served at /metrics by bannerkit.metrics; render stages are timed in the pool
+# workers and observed here, so /metrics covers every worker.
+REQUESTS = Counter("banner_requests_total", "Render requests by endpoint, style, preset, brand and cache outcome.")
 
-# Allow Canva/localhost etc.
+
+def count_request(endpoint: str, spec: dict, cache: str):
+    REQUESTS.inc(endpoint=endpoint, style=spec["style"], preset=spec["preset"], brand=spec["brand"] or "none",
+                 cache=cache)
+
+
+# --- Uploads ---
+# Size limits and image sniffing while the body streams in; see bannerkit.uploads.
+# Middleware added later wraps what came before: CORS goes last, so every
+# response (upload rejections included) carries its headers.
+app.add_middleware(FirstRequestLog)
+app.add_middleware(UploadLimits)
+# Allow Canva/localhost etc. (outermost, so rejections carry CORS headers too)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -22,33 +82,33 @@ app.add_middleware(
     allow_headers=["*"]
 )
 
+
+# --- Fonts ---
+# Faces are resolved once at startup and parsed fonts are shared per (face, size),
+# so layout loops don't hit the disk or re-parse the same file; see bannerkit.fonts.
+FONT_FACES = scan_fonts(FONT_DIR)
+DEFAULT_FONT = next((p for p in [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf",
+] if os.path.exists(p)), None)
+
+
 # --- Helpers ---
 
-def load_font(size: int) -> ImageFont.FreeTypeFont:
-    candidates = [
-        "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
-        "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf",
-    ]
-    for path in candidates:
-        if os.path.exists(path):
-            return ImageFont.truetype(path, size)
+def load_font(size: int, face: str = "") -> ImageFont.FreeTypeFont:
+    """Cached font; `face` picks a registered face like "GreycliffCF-Heavy", else the default sans."""
+    path = FONT_FACES.get(tuple(face.split("-", 1))) if face else None
+    path = path or DEFAULT_FONT
+    if path:
+        return truetype(path, size)
     return ImageFont.load_default()
 
 
 def resize_long_edge(img: Image.Image, long_edge: int) -> Image.Image:
-    w, h = img.size
-    if max(w, h) <= long_edge:
+    size = long_edge_size(img.size, long_edge)
+    if size == img.size:
         return img
-    if w >= h:
-        nh = int(h * (long_edge / w))
-        return img.resize((long_edge, nh), Image.LANCZOS)
-    else:
-        nw = int(w * (long_edge / h))
-        return img.resize((nw, long_edge), Image.LANCZOS)
-
-
-def ensure_rgba(img: Image.Image) -> Image.Image:
-    return img.convert("RGBA") if img.mode != "RGBA" else img
+    return img.resize(size, Image.LANCZOS)
 
 
 def text_wrap(draw: ImageDraw.ImageDraw, text: str, font: ImageFont.FreeTypeFont, max_w: int):
@@ -67,62 +127,160 @@ def text_wrap(draw: ImageDraw.ImageDraw, text: str, font: ImageFont.FreeTypeFont
     return lines
 
 
-def add_left_strip(img: Image.Image, text: str, *, strip_rel_width=0.32, 
-                    padding=24, font_size_rel=0.05, 
-                    strip_color=(0, 0, 0, 180), text_color=(255, 255, 255, 255),
-                    corner_radius_rel=0.02):
-    """Classic vertical rectangle on the LEFT; auto-wrap text; rounded inner corner."""
-    img = ensure_rgba(img)
-    W, H = img.size
-    strip_w = int(W * strip_rel_width)
-    radius = int(min(W, H) * corner_radius_rel)
+def _paste_region(img: Image.Image, region: Image.Image, xy) -> Image.Image:
+    """Paste a blended RGBA region back without converting the rest of the frame."""
+    img.paste(region if img.mode == "RGBA" else region.convert(img.mode), xy)
+    return img
 
-    overlay = Image.new("RGBA", img.size, (0, 0, 0, 0))
-    o = ImageDraw.Draw(overlay)
-    rect = (0, 0, strip_w, H)
-    o.rounded_rectangle(rect, radius=radius, fill=strip_color)
 
-    font = load_font(max(14, int(H * font_size_rel)))
-    draw = ImageDraw.Draw(overlay)
+# --- Layer cache ---
+# Wrapping and rasterizing a label depend on the label and the photo size but not
+# on colors, so the text is kept as an L-mode mask (cropped to its ink) and tinted
+# at paste time; the strip/ribbon shape itself is a single cheap fill. Photos are
+# resized to MAX_W, so a few sizes cover nearly every request, and the preset and
+# brand labels are built before the first one. Those labels' premultiplied blend
+# layers (several MB each) get a cache of their own, so they never push the
+# small text masks out.
+PREWARM_ASPECTS = [(3, 2), (2, 3), (4, 3), (3, 4)]
+MIN_FONT_PX = 14  # labels are never set smaller, however small the photo
+layers = LayerCache()  # LAYER_CACHE_MB per render worker; see bannerkit.layers
+blends = LayerCache(BLEND_CACHE_BYTES, size=lambda blend: blend["nbytes"], stage_name=None)
+
+
+def preset_label(text: str) -> bool:
+    """True for a preset or brand label: the ones repeated often enough to keep a blend layer for."""
+    return any(text == choice.get("label") for choice in (*PRESETS.values(), *BRANDS.values()))
+
+
+def composite(img: Image.Image, box: tuple, key: tuple, build_overlay, reuse: bool = False) -> Image.Image:
+    """Alpha-composite the overlay from build_overlay() onto img's box, in place.
+
+    With reuse (preset and brand labels), RGB photos are blended with NumPy
+    against the overlay's premultiplied layer, cached under key, so same-size
+    photos in a batch or job share it. Building that layer costs more than one
+    alpha_composite, so one-off labels, other modes and installs without NumPy
+    take Pillow's path.
+    """
+    if reuse and img.mode == "RGB" and have_numpy():
+        blend = blends.get(key, lambda: blend_layer(build_overlay()))
+        img.paste(blend_region(img.crop(box), blend), box[:2])
+        return img
+    region = Image.alpha_composite(img.crop(box).convert("RGBA"), build_overlay())
+    return _paste_region(img, region, box[:2])
+
+
+def prewarm_layers():
+    """Build the preset and brand labels' layers at the usual photo sizes."""
+    labels = [(p["label"], p["style"]) for p in PRESETS.values()]
+    labels += [(b["label"], b["style"]) for b in BRANDS.values() if b.get("label")]
+    with layers.uncounted():
+        for aspect in PREWARM_ASPECTS:
+            w, h = long_edge_size((aspect[0] * 1000, aspect[1] * 1000), MAX_W)
+            for label, style in labels:
+                (left_strip_layer if style == "left_strip" else bottom_ribbon_layer)(w, h, label)
+
+
+def left_strip_layer(W: int, H: int, text: str, strip_rel_width=0.32, padding=24, font_size_rel=0.05) -> dict:
+    key = ("left_strip", W, H, text, strip_rel_width, padding, font_size_rel)
+    return layers.get(key, lambda: _build_left_strip_layer(W, H, text, strip_rel_width, padding, font_size_rel))
+
+
+def _build_left_strip_layer(W, H, text, strip_rel_width, padding, font_size_rel):
+    strip_w = int(W * strip_rel_width)
+    font = load_font(max(MIN_FONT_PX, int(H * font_size_rel)))
     max_text_w = strip_w - 2 * padding
-    lines = text_wrap(draw, text, font, max_text_w)
+    lines = text_wrap(ImageDraw.Draw(Image.new("L", (1, 1))), text, font, max_text_w)
+    widths = [font.getlength(line) for line in lines]
 
+    # A word wider than the strip still gets drawn in full, so size the region to the text too.
+    region_w = min(W, max([strip_w + 1] + [int(padding + (max_text_w + w) // 2) + 1 for w in widths]))
+    mask = Image.new("L", (region_w, H), 0)
+    o = ImageDraw.Draw(mask)
     line_h = font.getbbox("Ay")[3] - font.getbbox("Ay")[1]
     total_h = len(lines) * line_h + (len(lines) - 1) * int(line_h * 0.25)
     y = (H - total_h) // 2
-    for line in lines:
-        w = draw.textlength(line, font=font)
-        draw.text((padding + (max_text_w - w) // 2, y), line, font=font, fill=text_color)
+    for line, w in zip(lines, widths):
+        o.text((padding + (max_text_w - w) // 2, y), line, font=font, fill=255)
         y += int(line_h * 1.25)
+    return ink_layer(mask, region_w=region_w)
 
-    return Image.alpha_composite(img, overlay)
 
+def bottom_ribbon_layer(W: int, H: int, text: str, ribbon_rel_height=0.16, padding=24, font_size_rel=0.06) -> dict:
+    key = ("bottom_ribbon", W, H, text, ribbon_rel_height, padding, font_size_rel)
+    return layers.get(key, lambda: _build_bottom_ribbon_layer(W, H, text, ribbon_rel_height, padding, font_size_rel))
 
-def add_bottom_ribbon(img: Image.Image, text: str, *, ribbon_rel_height=0.16, padding=24,
-                      font_size_rel=0.06, ribbon_color=(0,0,0,170), text_color=(255,255,255,255)):
-    img = ensure_rgba(img)
-    W, H = img.size
+
+def _build_bottom_ribbon_layer(W, H, text, ribbon_rel_height, padding, font_size_rel):
     ribbon_h = int(H * ribbon_rel_height)
     y0 = H - ribbon_h
 
-    overlay = Image.new("RGBA", img.size, (0, 0, 0, 0))
-    o = ImageDraw.Draw(overlay)
-    o.rectangle((0, y0, W, H), fill=ribbon_color)
-
-    font = load_font(max(14, int(H * font_size_rel)))
-    draw = ImageDraw.Draw(overlay)
+    font = load_font(max(MIN_FONT_PX, int(H * font_size_rel)))
     max_text_w = W - 2 * padding
-    lines = text_wrap(draw, text, font, max_text_w)
+    lines = text_wrap(ImageDraw.Draw(Image.new("L", (1, 1))), text, font, max_text_w)
 
     line_h = font.getbbox("Ay")[3] - font.getbbox("Ay")[1]
     total_h = len(lines) * line_h + (len(lines) - 1) * int(line_h * 0.25)
     y = y0 + (ribbon_h - total_h)//2
+
+    # Long labels can wrap above the ribbon; start the region at the first line if so.
+    top = max(0, min(y0, y))
+    mask = Image.new("L", (W, H - top), 0)
+    o = ImageDraw.Draw(mask)
     for line in lines:
-        w = draw.textlength(line, font=font)
-        draw.text(((W - w)//2, y), line, font=font, fill=text_color)
+        w = o.textlength(line, font=font)
+        o.text(((W - w)//2, y - top), line, font=font, fill=255)
         y += int(line_h * 1.25)
+    return ink_layer(mask, top=top, y0=y0)
+
 
-    return Image.alpha_composite(img, overlay)
+def add_left_strip(img: Image.Image, text: str, *, strip_rel_width=0.32, 
+                    padding=24, font_size_rel=0.05, 
+                    strip_color=(0, 0, 0, 180), text_color=(255, 255, 255, 255),
+                    corner_radius_rel=0.02):
+    """Classic vertical rectangle on the LEFT; auto-wrap text; rounded inner corner.
+
+    Draws onto img in place: only the strip is cropped, blended and pasted back,
+    so the rest of the frame is untouched and keeps its mode.
+    """
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGB")
+    W, H = img.size
+    strip_w = int(W * strip_rel_width)
+    radius = int(min(W, H) * corner_radius_rel)
+    layer = left_strip_layer(W, H, text, strip_rel_width, padding, font_size_rel)
+
+    region_w = layer["region_w"]
+
+    def overlay():
+        o = Image.new("RGBA", (region_w, H), (0, 0, 0, 0))
+        ImageDraw.Draw(o).rounded_rectangle((0, 0, strip_w, H), radius=radius, fill=strip_color)
+        paste_ink(o, layer, text_color)
+        return o
+
+    key = ("blend", "left_strip", W, H, text, strip_rel_width, padding, font_size_rel, radius,
+           tuple(strip_color), tuple(text_color))
+    return composite(img, (0, 0, region_w, H), key, overlay, reuse=preset_label(text))
+
+
+def add_bottom_ribbon(img: Image.Image, text: str, *, ribbon_rel_height=0.16, padding=24,
+                      font_size_rel=0.06, ribbon_color=(0,0,0,170), text_color=(255,255,255,255)):
+    """Full-width ribbon along the bottom, drawn onto img in place (ribbon rows only)."""
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGB")
+    W, H = img.size
+    layer = bottom_ribbon_layer(W, H, text, ribbon_rel_height, padding, font_size_rel)
+
+    top = layer["top"]
+
+    def overlay():
+        o = Image.new("RGBA", (W, H - top), (0, 0, 0, 0))
+        ImageDraw.Draw(o).rectangle((0, layer["y0"] - top, W, H - top), fill=ribbon_color)
+        paste_ink(o, layer, text_color)
+        return o
+
+    key = ("blend", "bottom_ribbon", W, H, text, ribbon_rel_height, padding, font_size_rel,
+           tuple(ribbon_color), tuple(text_color))
+    return composite(img, (0, top, W, H), key, overlay, reuse=preset_label(text))
 
 # --- Brands & Presets ---
 BRANDS = {
@@ -140,6 +298,567 @@ PRESETS = {
     5: {"label": "OPEN HOUSE THIS WEEKEND", "style": "left_strip"},
 }
 
+STYLES = ("left_strip", "bottom_ribbon")
+LABEL_FONT_REL = {"left_strip": 0.05, "bottom_ribbon": 0.06}  # each style's default font_size_rel
+MAX_SIZES = 6  # derivatives per /make_banner request
+
+
+def resolve_spec(preset: int, text: str, style: str, brand: str, max_px,
+                 fmt: str = "", quality=None, max_bytes=None) -> dict:
+    """Turn form fields into concrete render settings: label, style, colors, long edge, encoding."""
+    chosen = PRESETS.get(preset)
+    if text.strip():
+        label = text.strip()
+    else:
+        label = (chosen["label"] if chosen else "")
+
+    if style == "auto":
+        style = (chosen["style"] if chosen else "left_strip")
+
+    # Brand overrides
+    strip_color = None
+    text_color = None
+    if brand and brand.lower() in BRANDS:
+        b = BRANDS[brand.lower()]
+        label = label or b.get("label", label)
+        style = b.get("style", style)
+        strip_color = b.get("strip_color")
+        text_color = b.get("text_color")
+
+    default_strip = (0,0,0,170) if style == "bottom_ribbon" else (0,0,0,180)
+    return {"label": label, "style": style,
+            "preset": preset if chosen else 0,
+            "brand": brand.lower() if brand and brand.lower() in BRANDS else "",
+            "strip_color": strip_color or default_strip,
+            "text_color": text_color or (255,255,255,255),
+            "max_px": max_px or MAX_W,
+            "format": negotiate_format(fmt, "", OUTPUT_FORMAT),
+            "quality": min(100, max(1, int(quality))) if quality else None,
+            "max_bytes": max(1, int(max_bytes)) if max_bytes else None}
+
+
+def resolve_specs(specs: str, max_px) -> list:
+    """A JSON list of spec objects (every preset when blank) -> resolved specs; ValueError says what's wrong."""
+    try:
+        raw_specs = json.loads(specs) if specs.strip() else [{"preset": p} for p in PRESETS]
+        resolved = [resolve_spec(int(r.get("preset", 0) or 0), r.get("text", ""), r.get("style", "auto"),
+                                 r.get("brand", ""), max_px, r.get("format", ""), r.get("quality"),
+                                 r.get("max_bytes")) for r in raw_specs]
+    except (ValueError, TypeError, AttributeError):
+        raise ValueError("specs must be a JSON list of objects")
+    if not resolved:
+        raise ValueError("No specs")
+    if any(spec["style"] not in STYLES for spec in resolved):
+        raise ValueError("Unknown style")
+    return resolved
+
+
+def parse_sizes(sizes: str) -> list:
+    """"2048, 1024, 320" -> distinct long edges, largest first; ValueError says what's wrong."""
+    try:
+        parsed = sorted({int(size) for size in sizes.split(",") if size.strip()}, reverse=True)
+    except ValueError:
+        raise ValueError("sizes must be a comma-separated list of long-edge pixel sizes")
+    if not parsed or parsed[-1] < 16 or len(parsed) > MAX_SIZES:
+        raise ValueError(f"sizes takes 1 to {MAX_SIZES} long edges of at least 16px")
+    return parsed
+
+
+def label_font_px(spec: dict, height: int) -> int:
+    """Font size the spec's style sets its label in on a photo this tall."""
+    return max(MIN_FONT_PX, int(height * LABEL_FONT_REL[spec["style"]]))
+
+
+def apply_style(img: Image.Image, spec: dict) -> Image.Image:
+    with stage("composite"):
+        if spec["style"] == "left_strip":
+            return add_left_strip(img, spec["label"], strip_color=spec["strip_color"], text_color=spec["text_color"])
+        return add_bottom_ribbon(img, spec["label"], ribbon_color=spec["strip_color"], text_color=spec["text_color"])
+
+
+# --- Rendering ---
+# Decoding and encoding are bannerkit.imaging; these run in the render pool.
+def render_make_banner(content: bytes, spec: dict, keep_base: bool = False):
+    """Decode, banner and encode one upload -> (bytes, quality, width, height, decode stats, base).
+
+    With keep_base, base is a copy of the decoded photo from before the banner
+    went on, for the decoded cache; otherwise None. Runs in the render pool.
+    """
+    img, decode_stats = decode_image(content, spec["max_px"])
+    base = img.copy() if keep_base else None
+    out = apply_style(img, spec)
+    data, quality = encode_output(out, spec)
+    return data, quality, out.width, out.height, decode_stats, base
+
+
+def render_decoded(img: Image.Image, spec: dict, decode_stats: dict):
+    """render_make_banner for a photo from the decoded cache; nothing is decoded, so decode_ms is 0.
+
+    A copy kept at a larger long edge is reduced to spec's first, to the size a
+    decode at max_px gives.
+    """
+    target = long_edge_size(decode_stats["source"], spec["max_px"])
+    if img.size != target:
+        with stage("resize"):
+            img = img.resize(target, Image.LANCZOS)
+        decode_stats = {**decode_stats, "decoded": target}
+    out = apply_style(img.copy(), spec)
+    data, quality = encode_output(out, spec)
+    return data, quality, out.width, out.height, {**decode_stats, "decode_ms": 0.0}, None
+
+
+def render_variant(img: Image.Image, spec: dict):
+    """Banner a copy of an already-decoded photo -> (bytes, width, height). Runs in the render pool."""
+    out = apply_style(img.copy(), spec)
+    return encode_output(out, spec)[0], out.width, out.height
+
+
+def render_derivatives(content: bytes, spec: dict, sizes: list):
+    """One upload at every long edge in sizes (largest first) -> ([(bytes, quality, width, height, refit)], decode stats).
+
+    The photo is decoded and bannered once, at the largest size; each smaller
+    size is reduced from the one before, so every step works on an already
+    small image. Where that would shrink the label below MIN_FONT_PX, the
+    banner is laid out again on the photo at that size instead (refit).
+    Runs in the render pool.
+    """
+    photo, decode_stats = decode_image(content, sizes[0])
+    out = apply_style(photo.copy(), spec)
+    font_px = label_font_px(spec, out.height)
+    results = [(*encode_output(out, spec), out.width, out.height, False)]
+    for size in sizes[1:]:
+        target = long_edge_size(out.size, size)
+        if target == out.size:  # the photo is already smaller than this
+            results.append(results[-1])
+            continue
+        scaled_px = font_px * target[1] / out.height
+        refit = scaled_px < MIN_FONT_PX
+        with stage("resize"):
+            # reducing_gap=1: box-reduce by the whole factor, LANCZOS only the remainder;
+            # ~5x faster than a full LANCZOS pass and within a fraction of a level of it.
+            if refit:
+                photo = photo.resize(target, Image.LANCZOS, reducing_gap=1.0)
+            else:
+                out = out.resize(target, Image.LANCZOS, reducing_gap=1.0)
+        if refit:
+            out = apply_style(photo.copy(), spec)
+            font_px = label_font_px(spec, out.height)
+        else:
+            font_px = scaled_px
+        results.append((*encode_output(out, spec), out.width, out.height, refit))
+    return results, decode_stats
+
+# --- Render pool ---
+# CPU-bound work runs in bannerkit.pool's RenderPool, so one big upload doesn't
+# stall every other request; form/API requests go ahead of queued job photos.
+
+def init_render_worker(layer_counts):
+    """Runs once in each pool process: share the layer counters, import NumPy, build the preset layers, warm up."""
+    layers.counts = layer_counts
+    have_numpy()
+    prewarm_layers()
+    warm_up()
+
+
+render_pool = RenderPool(init_render_worker, (layers.counts,))
+
+
+# --- Admission control ---
+# Each caller has a token bucket of input megapixels that refills at
+# RATE_LIMIT_MP_PER_MIN, plus a cap on its renders in progress, so one bulk
+# client can't starve the rest. A caller is an API key from API_KEY, or an
+# invite session (invite code + client address) for form users, or else the
+# client address. Only validated keys and codes name a bucket, so made-up ones
+# can't buy a fresh one; the address comes from X-Forwarded-For only when the
+# connection is from TRUSTED_PROXIES. A request bigger than the bucket is let
+# through when the bucket is full and leaves it in debt, which later requests
+# wait out.
+MAX_TRACKED_CALLERS = 10000
+RATE_LIMITED = Counter("banner_rate_limited_total", "Requests refused with 429, by reason and caller kind.")
+_buckets = {}                               # caller -> (tokens, monotonic time of last refill)
+_caller_renders = collections.Counter()     # caller -> renders in progress; event loop only
+_trusted_proxies = [ipaddress.ip_network(net.strip(), strict=False) for net in TRUSTED_PROXIES.split(",")
+                    if net.strip()]
+
+
+def _trusted_proxy(host: str) -> bool:
+    try:
+        addr = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(addr in net for net in _trusted_proxies)
+
+
+def client_address(request: Request) -> str:
+    """The client's address: X-Forwarded-For is read from the right, one hop per trusted proxy."""
+    host = request.client.host if request.client else "unknown"
+    hops = [hop.strip() for hop in ",".join(request.headers.getlist("x-forwarded-for")).split(",") if hop.strip()]
+    while hops and _trusted_proxy(host):
+        host = hops.pop()
+    return host
+
+
+def _hashed(secret: str) -> str:
+    return hashlib.sha256(secret.encode()).hexdigest()[:16]
+
+
+def caller_id(request: Request, x_api_key: str, invite: str = "") -> str:
+    if x_api_key and x_api_key in API_KEYS:
+        return "key:" + _hashed(x_api_key)
+    if invite and invite in INVITE_CODES:
+        return f"invite:{_hashed(invite)}:{client_address(request)}"
+    return "ip:" + client_address(request)
+
+
+def upload_megapixels(fp) -> float:
+    """Megapixels from the image header; 1 when there's no readable header (decoding will refuse it)."""
+    try:
+        with Image.open(fp) as img:
+            w, h = img.size
+    except Exception:
+        return 1.0
+    finally:
+        fp.seek(0)
+    return max(1.0, w * h / 1e6)
+
+
+def _refill(caller: str, now: float) -> float:
+    tokens, last = _buckets.get(caller, (RATE_LIMIT_BURST_MP, now))
+    return min(RATE_LIMIT_BURST_MP, tokens + (now - last) * RATE_LIMIT_MP_PER_MIN / 60)
+
+
+def _prune_buckets(now: float):
+    for caller in [c for c in _buckets if _refill(c, now) >= RATE_LIMIT_BURST_MP]:
+        del _buckets[caller]
+
+
+def rate_limited(caller: str, reason: str, retry_after: int) -> JSONResponse:
+    RATE_LIMITED.inc(reason=reason, caller=caller.split(":", 1)[0])
+    error = "Rate limit exceeded" if reason == "rate" else "Too many renders in progress for this caller"
+    return JSONResponse({"error": error, "retry_after": retry_after}, status_code=429,
+                        headers={"Retry-After": str(retry_after)})
+
+
+def admit(caller: str, megapixels: float, concurrent: bool = True):
+    """Charge megapixels to the caller's bucket; a 429 response if it has to wait, else None."""
+    if concurrent and RATE_LIMIT_CONCURRENT and _caller_renders[caller] >= RATE_LIMIT_CONCURRENT:
+        return rate_limited(caller, "concurrency", RENDER_RETRY_AFTER)
+    if RATE_LIMIT_MP_PER_MIN <= 0:
+        return None
+    now = time.monotonic()
+    tokens = _refill(caller, now)
+    needed = min(megapixels, RATE_LIMIT_BURST_MP)
+    if tokens < needed:
+        _buckets[caller] = (tokens, now)
+        return rate_limited(caller, "rate", math.ceil((needed - tokens) * 60 / RATE_LIMIT_MP_PER_MIN))
+    _buckets[caller] = (tokens - megapixels, now)
+    if len(_buckets) > MAX_TRACKED_CALLERS:
+        _prune_buckets(now)
+    return None
+
+
+@contextlib.contextmanager
+def caller_render(caller: str):
+    _caller_renders[caller] += 1
+    try:
+        yield
+    finally:
+        _caller_renders[caller] -= 1
+        if not _caller_renders[caller]:
+            del _caller_renders[caller]
+
+
+def admission_stats() -> dict:
+    return {"callers_tracked": len(_buckets), "callers_rendering": len(_caller_renders)}
+
+
+# --- Single flight ---
+# Identical uploads arriving together share one render; see bannerkit.flight.
+single_flight = SingleFlight(render_pool.run)
+
+
+# --- Decoded photos ---
+# Agents often send the same photo again with only the text, preset or brand
+# changed. The decoded, resized photo is kept under the upload's hash (sent back
+# as photo_hash / X-Photo-Hash), so that re-render goes straight to compositing,
+# and a client can send photo_hash instead of the file while it's still here.
+# Job photos aren't kept.
+decoded = DecodedCache(DECODE_CACHE_BYTES)
+
+
+# --- Render cache ---
+# Outputs are named by a hash of the upload bytes plus the resolved render spec,
+# so re-posts and retries are answered from disk. OUTPUT_DIR is swept by size and
+# age, and with OUTPUT_STORE set it's a read-through cache of a store every
+# instance shares; see bannerkit.outputs.
+RENDER_VERSION = 1  # bump when rendering changes so stale outputs aren't reused
+# Server settings that change the bytes too (encoder settings, the faces in FONT_DIR
+# and the default font, the long edge); part of every key.
+RENDER_SETTINGS = settings_digest(list(FONT_FACES.values()) + [DEFAULT_FONT], long_edge=MAX_W)
+outputs = OutputCache(OUTPUT_DIR, OUTPUT_STORE)
+
+
+def render_keys(content: bytes, specs: list, digest=None) -> list:
+    """Cache key per spec; the upload is hashed once however many specs there are.
+
+    digest, if given, is hashlib.sha256 of the upload, so content isn't needed.
+    """
+    # preset/brand only label metrics; the rest of the spec defines the pixels.
+    fields = [{k: v for k, v in spec.items() if k not in ("preset", "brand")} for spec in specs]
+    return content_keys(content, fields, digest, v=RENDER_VERSION, s=RENDER_SETTINGS)
+
+
+def render_key(content: bytes, spec: dict) -> str:
+    return render_keys(content, [spec])[0]
+
+
+def output_sizes(paths: list) -> list:
+    """(width, height) of stored outputs, read from their headers. Blocking."""
+    sizes = []
+    for path in paths:
+        with Image.open(path) as done:
+            sizes.append(done.size)
+    return sizes
+
+
+async def render_photo(content: bytes, filename: str, specs: list, max_px, priority: int = INTERACTIVE,
+                       endpoint: str = "make_banners") -> dict:
+    """Every spec for one photo, decoded once; cached outputs are reused -> manifest entry."""
+    with timed("hash"):
+        digest = await asyncio.to_thread(hashlib.sha256, content)
+    keys = render_keys(content, specs, digest)
+    out_ids = [key + OUTPUT_FORMATS[spec["format"]][1] for key, spec in zip(keys, specs)]
+    todo = [i for i, out_id in enumerate(out_ids) if not await outputs.lookup(out_id)]
+    for i, spec in enumerate(specs):
+        count_request(endpoint, spec, "miss" if i in todo else "hit")
+    entries = [{"spec": spec, "id": out_id, "url": f"/outputs/{out_id}", "cached": True}
+               for spec, out_id in zip(specs, out_ids)]
+    decode_stats = None
+    if todo:
+        # One decode per photo (none if it's in the decoded cache); the base is shared by every variant.
+        long_edge = max_px or MAX_W
+        entry = decoded.get(digest_id(digest), long_edge)
+        if entry:
+            img, decode_stats = entry[0], {**entry[2], "decode_ms": 0.0}
+        else:
+            img, decode_stats = await render_pool.run(decode_image, content, long_edge, priority=priority)
+            if priority == INTERACTIVE:
+                decoded.put(digest_id(digest), long_edge, img, digest, decode_stats)
+        rendered = await asyncio.gather(*(render_pool.run(render_variant, img, specs[i], priority=priority)
+                                          for i in todo))
+        for i, (data, width, height) in zip(todo, rendered):
+            await outputs.save(out_ids[i], data)
+            entries[i].update(cached=False, width=width, height=height)
+    cached = [entry for entry in entries if "width" not in entry]
+    if cached:
+        sizes = await asyncio.to_thread(output_sizes, [os.path.join(outputs.dir, entry["id"]) for entry in cached])
+        for entry, (width, height) in zip(cached, sizes):
+            entry["width"], entry["height"] = width, height
+    return {"filename": filename, "photo_hash": digest_id(digest), "decode": decode_stats, "outputs": entries}
+
+# --- Jobs ---
+# Bulk imports submit photos + specs to POST /jobs, get an id back at once and
+# poll GET /jobs/{id}. Inputs are spooled under JOB_DIR and job state lives in
+# SQLite next to them, so a restart picks up where it left off: photos that
+# were mid-render go back in the queue. Job photos render at BULK priority.
+JOB_MAX_WAIT = 60  # seconds a long poll may hold the connection
+JOB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    created REAL NOT NULL,
+    specs TEXT NOT NULL,
+    max_px INTEGER
+);
+CREATE TABLE IF NOT EXISTS job_photos (
+    job_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    filename TEXT,
+    status TEXT NOT NULL DEFAULT 'queued',  -- queued | running | done | error
+    result TEXT,
+    error TEXT,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE INDEX IF NOT EXISTS job_photos_status ON job_photos (status);
+"""
+_jobs_db = None
+_jobs_lock = threading.Lock()
+_job_queued = None    # asyncio.Event, set when photos are queued
+_job_progress = None  # asyncio.Event, set (and replaced) whenever a job photo finishes
+_job_runners = []
+
+
+def jobs_db() -> sqlite3.Connection:
+    global _jobs_db
+    if _jobs_db is None:
+        os.makedirs(JOB_DIR, exist_ok=True)
+        _jobs_db = sqlite3.connect(os.path.join(JOB_DIR, "jobs.sqlite3"), check_same_thread=False,
+                                   isolation_level=None)
+        _jobs_db.execute("PRAGMA journal_mode=WAL")
+        _jobs_db.executescript(JOB_SCHEMA)
+    return _jobs_db
+
+
+def job_input_path(job_id: str, idx: int) -> str:
+    return os.path.join(JOB_DIR, job_id, f"{idx:05d}")
+
+
+def spool_job(job_id: str, uploads: list, specs: str, max_px):
+    """Copy the uploads under JOB_DIR, then queue them in one transaction."""
+    os.makedirs(os.path.join(JOB_DIR, job_id))
+    for idx, upload in enumerate(uploads):
+        upload.file.seek(0)
+        with open(job_input_path(job_id, idx), "wb") as f:
+            shutil.copyfileobj(upload.file, f)
+    with _jobs_lock:
+        db = jobs_db()
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("INSERT INTO jobs (id, created, specs, max_px) VALUES (?, ?, ?, ?)",
+                       (job_id, time.time(), specs, max_px))
+            db.executemany("INSERT INTO job_photos (job_id, idx, filename) VALUES (?, ?, ?)",
+                           [(job_id, idx, upload.filename) for idx, upload in enumerate(uploads)])
+
+
+def claim_job_photo():
+    """Mark the oldest queued photo running -> (job_id, idx, filename, specs, max_px), or None."""
+    with _jobs_lock:
+        db = jobs_db()
+        with db:
+            db.execute("BEGIN IMMEDIATE")  # other app processes sharing JOB_DIR wait here
+            row = db.execute("""SELECT p.job_id, p.idx, p.filename, j.specs, j.max_px FROM job_photos p
+                                JOIN jobs j ON j.id = p.job_id WHERE p.status = 'queued'
+                                ORDER BY j.created, p.idx LIMIT 1""").fetchone()
+            if row:
+                db.execute("UPDATE job_photos SET status = 'running' WHERE job_id = ? AND idx = ?", row[:2])
+    return row
+
+
+def finish_job_photo(job_id: str, idx: int, result: dict = None, error: str = None):
+    with _jobs_lock:
+        jobs_db().execute("UPDATE job_photos SET status = ?, result = ?, error = ? WHERE job_id = ? AND idx = ?",
+                          ("error" if error else "done", json.dumps(result) if result else None, error,
+                           job_id, idx))
+    try:
+        os.remove(job_input_path(job_id, idx))
+        os.rmdir(os.path.dirname(job_input_path(job_id, idx)))  # only succeeds once the last input is gone
+    except OSError:
+        pass
+
+
+def load_job(job_id: str):
+    with _jobs_lock:
+        db = jobs_db()
+        job = db.execute("SELECT created FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if job is None:
+            return None
+        rows = db.execute("SELECT filename, status, result, error FROM job_photos WHERE job_id = ? ORDER BY idx",
+                          (job_id,)).fetchall()
+    counts = collections.Counter(status for _, status, _, _ in rows)
+    if counts["queued"] + counts["running"] == 0:
+        status = "done"
+    else:
+        status = "running" if counts["running"] or counts["done"] or counts["error"] else "queued"
+    photos = []
+    for filename, photo_status, result, error in rows:
+        photo = json.loads(result) if result else {"filename": filename}
+        photo["status"] = photo_status
+        if error:
+            photo["error"] = error
+        photos.append(photo)
+    return {"id": job_id, "status": status, "created": job[0], "total": len(rows),
+            "done": counts["done"], "failed": counts["error"], "photos": photos}
+
+
+def recover_jobs():
+    """At startup: requeue photos a previous process was rendering; drop jobs older than OUTPUT_MAX_AGE."""
+    cutoff = time.time() - OUTPUT_MAX_AGE
+    with _jobs_lock:
+        db = jobs_db()
+        with db:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("UPDATE job_photos SET status = 'queued' WHERE status = 'running'")
+            expired = [row[0] for row in db.execute("SELECT id FROM jobs WHERE created < ?", (cutoff,))]
+            db.executemany("DELETE FROM job_photos WHERE job_id = ?", [(j,) for j in expired])
+            db.executemany("DELETE FROM jobs WHERE id = ?", [(j,) for j in expired])
+    for job_id in expired:
+        shutil.rmtree(os.path.join(JOB_DIR, job_id), ignore_errors=True)
+
+
+async def job_runner():
+    """Claim the oldest queued photo, render it at BULK priority, record the result; repeat."""
+    global _job_progress
+    while True:
+        _job_queued.clear()
+        claimed = await asyncio.to_thread(claim_job_photo)
+        if claimed is None:
+            await _job_queued.wait()
+            continue
+        job_id, idx, filename, specs, max_px = claimed
+        result, error = None, None
+        try:
+            with timed("read"), open(job_input_path(job_id, idx), "rb") as f:
+                content = f.read()
+            result = await render_photo(content, filename, resolve_specs(specs, max_px), max_px, priority=BULK,
+                                        endpoint="jobs")
+        except UnsupportedImage:
+            error = "Unsupported image"
+        except Exception as e:  # one bad photo shouldn't stall the job
+            error = str(e) or type(e).__name__
+        await asyncio.to_thread(finish_job_photo, job_id, idx, result, error)
+        _job_progress.set()
+        _job_progress = asyncio.Event()
+
+
+async def start_job_runners():
+    global _job_queued, _job_progress
+    await asyncio.to_thread(recover_jobs)
+    _job_queued, _job_progress = asyncio.Event(), asyncio.Event()
+    _job_queued.set()
+    _job_runners.extend(asyncio.create_task(job_runner()) for _ in range(JOB_WORKERS))
+
+
+async def stop_job_runners():
+    # Photos cut off mid-render stay "running" and are requeued on the next start.
+    for task in _job_runners:
+        task.cancel()
+    _job_runners.clear()
+
+
+# --- Startup ---
+# Free-plan instances sleep when idle, so cold starts are common. Startup only
+# registers the codecs, recovers jobs and starts the pool; the workers build
+# their layers and render a small banner in every style and format in the
+# background, so /healthz answers at once and the first upload finds fonts,
+# layers and encoders ready. Startup time and each endpoint's first request
+# are logged.
+_warming = None     # asyncio.Task running render_pool.warm
+
+
+def warm_up():
+    """Decode, banner and encode a small photo in every style and format, without counting layer lookups."""
+    init_codecs()
+    photo = warmup_photo()
+    with layers.uncounted():
+        for fmt in OUTPUT_FORMATS:
+            for style in STYLES:
+                render_make_banner(photo, resolve_spec(1, "", style, "", None, fmt, None, None))
+
+
+async def startup():
+    global _warming
+    t0 = time.perf_counter()
+    init_codecs()
+    await start_job_runners()
+    _warming = asyncio.create_task(render_pool.warm())
+    log.info("startup: %.0f ms", (mark_started() - t0) * 1000)
+
+
+async def shutdown():
+    if _warming is not None:
+        _warming.cancel()
+    await stop_job_runners()
+    render_pool.shutdown()
+
 @app.get("/")
 def index():
     # Tiny UI for manual uploads / quick tests with Invite Code
@@ -179,71 +898,306 @@ def healthz():
 def presets():
     return {"brands": list(BRANDS.keys()), "presets": PRESETS}
 
+@app.get("/stats")
+def stats():
+    return {"fonts": font_cache_stats(), "layers": layers.stats(), "render_cache": outputs.stats(),
+            "single_flight": single_flight.stats(), "admission": admission_stats(), "decoded": decoded.stats()}
+
+def queued_job_photos() -> int:
+    with _jobs_lock:
+        return jobs_db().execute("SELECT COUNT(*) FROM job_photos WHERE status = 'queued'").fetchone()[0]
+
+
+METRICS = [
+    STAGE_SECONDS, REQUESTS, INPUT_MEGAPIXELS, OUTPUT_BYTES, UPLOADS_REJECTED, RATE_LIMITED,
+    *render_pool.gauges(),
+    Gauge("banner_job_photos_queued", "Job photos not yet picked up.", queued_job_photos),
+]
+app.include_router(metrics_router(METRICS))
+
+async def make_derivatives(content: bytes, spec: dict, sizes: list, caller: str, timings: dict) -> JSONResponse:
+    """/make_banner with `sizes`: every size from one decode and one banner render, cached per size."""
+    # A size below the largest depends on the sizes above it too, so those are part of its key.
+    specs = [{**spec, "max_px": size, **({"chain": sizes[:i + 1]} if i else {})} for i, size in enumerate(sizes)]
+    ext = OUTPUT_FORMATS[spec["format"]][1]
+    with timed("hash", timings):
+        out_ids = [key + ext for key in await asyncio.to_thread(render_keys, content, specs)]
+    paths = [await outputs.lookup(out_id) for out_id in out_ids]
+    entries = [{"max_px": size, "id": out_id, "url": f"/outputs/{out_id}", "cached": bool(path), "refit": None}
+               for size, out_id, path in zip(sizes, out_ids, paths)]
+    decode_stats, coalesced = None, False
+    if all(paths):
+        count_request("make_banner", spec, "hit")
+    else:
+        flight = f"{out_ids[0]}:{','.join(map(str, sizes))}"
+        if not single_flight.in_flight(flight):
+            if render_pool.busy():
+                return render_pool.busy_response()
+            refused = admit(caller, upload_megapixels(io.BytesIO(content)))
+            if refused:
+                return refused
+        try:
+            with caller_render(caller):
+                (rendered, decode_stats), coalesced = await single_flight(flight, render_derivatives, content, spec,
+                                                                          sizes, timings=timings)
+        except UnsupportedImage:
+            UPLOADS_REJECTED.inc(reason="not_image")
+            return JSONResponse({"error": "Unsupported image"}, status_code=400)
+        except ImageTooLarge as e:
+            UPLOADS_REJECTED.inc(reason="too_many_pixels")
+            return JSONResponse({"error": str(e)}, status_code=413)
+        count_request("make_banner", spec, "coalesced" if coalesced else "miss")
+        for entry, (data, used_quality, width, height, refit) in zip(entries, rendered):
+            await outputs.save(entry["id"], data, timings)
+            entry.update(width=width, height=height, bytes=len(data), quality=used_quality, refit=refit)
+    for entry, path in zip(entries, paths):
+        if entry["cached"]:
+            with Image.open(path) as done:
+                entry.update(width=done.width, height=done.height, bytes=os.path.getsize(path))
+    return JSONResponse({"outputs": entries, "format": spec["format"], "coalesced": coalesced,
+                         "decode": decode_stats}, headers=server_timing(timings))
+
 @app.post("/make_banner")
 async def make_banner(
-    file: UploadFile = File(...),
+    request: Request,
+    file: UploadFile = File(None),
     preset: int = Form(1),
     text: str = Form(""),
     style: str = Form("auto"),
     brand: str = Form(""),
     max_px: int = Form(None),
     x_api_key: str = Header(None),
-    invite: str = Form("")
+    invite: str = Form(""),
+    delivery: str = Form("url"),  # "url": JSON with a link to /outputs; "inline": the image itself
+    persist: str = Form("on"),    # inline only: "off" skips saving a copy under /outputs
+    format: str = Form(""),       # png | jpeg | webp; blank = negotiate from Accept
+    quality: int = Form(None),
+    max_bytes: int = Form(None),  # JPEG/WebP: highest quality that fits
+    sizes: str = Form(""),        # e.g. "2048,1024,320": every size from one render, as a JSON manifest
+    photo_hash: str = Form(""),   # instead of file: the photo_hash of a recent upload (404 once it's been dropped)
+    accept: str = Header(""),
+    background_tasks: BackgroundTasks = None,
 ):
     # Gatekeeping: API key for programmatic calls; invite code for form usage
-    if API_KEY and x_api_key != API_KEY:
+    if API_KEYS and x_api_key not in API_KEYS:
         return JSONResponse({"error": "Unauthorized"}, status_code=401)
-    if INVITE_CODE and invite != INVITE_CODE and not x_api_key:
+    if INVITE_CODES and invite not in INVITE_CODES and not x_api_key:
         return JSONResponse({"error": "Invite required"}, status_code=401)
 
-    content = await file.read()
+    spec = resolve_spec(preset, text, style, brand, max_px,
+                        negotiate_format(format, accept, OUTPUT_FORMAT), quality, max_bytes)
+    if spec["style"] not in STYLES:
+        return JSONResponse({"error": "Unknown style"}, status_code=400)
+    if sizes:
+        try:
+            size_list = parse_sizes(sizes)
+        except ValueError as e:
+            return JSONResponse({"error": str(e)}, status_code=400)
+    _, ext, media_type = OUTPUT_FORMATS[spec["format"]]
+    timings = {}
+    content, entry = None, None
+    if file is not None:
+        with timed("read", timings):
+            content = await file.read()
+    elif not photo_hash or sizes:
+        return JSONResponse({"error": "sizes needs the file itself" if photo_hash else "No file"}, status_code=400)
+    else:
+        photo_hash = photo_hash.strip().lower()
+        entry = decoded.find(photo_hash, spec["max_px"])  # a larger copy is reduced in the pool
+        if entry is None:
+            edges = decoded.long_edges(photo_hash)
+            if edges:
+                return JSONResponse({"error": f"Photo only in memory at max_px {', '.join(map(str, edges))}, below "
+                                              f"{spec['max_px']}; send it again or ask for a smaller max_px"},
+                                    status_code=404)
+            return JSONResponse({"error": "Photo not in memory any more, send it again"}, status_code=404)
+    if sizes:
+        return await make_derivatives(content, spec, size_list, caller_id(request, x_api_key, invite), timings)
+    if content is not None:
+        with timed("hash", timings):
+            digest = await asyncio.to_thread(hashlib.sha256, content)
+    else:
+        digest = entry[1]
+    photo_id = digest_id(digest)
+    out_id = render_keys(content, [spec], digest)[0] + ext
+    out_path = await outputs.lookup(out_id)
+    if out_path:
+        count_request("make_banner", spec, "hit")
+    if out_path and delivery == "inline":
+        return FileResponse(out_path, media_type=media_type,
+                            headers={"X-Output-Url": f"/outputs/{out_id}", "X-Render-Cache": "hit",
+                                     "X-Photo-Hash": photo_id, "Vary": "Accept", **server_timing(timings)})
+    if out_path:
+        (width, height), = await asyncio.to_thread(output_sizes, [out_path])
+        return JSONResponse({"id": out_id, "url": f"/outputs/{out_id}", "width": width, "height": height,
+                             "format": spec["format"], "bytes": os.path.getsize(out_path), "cached": True,
+                             "decode": None, "photo_hash": photo_id}, headers=server_timing(timings))
+
+    caller = caller_id(request, x_api_key, invite)
+    entry = entry or decoded.get(photo_id, spec["max_px"])
+    if not single_flight.in_flight(out_id):  # joining a render already running costs nothing
+        if render_pool.busy():
+            return render_pool.busy_response()
+        if entry:
+            megapixels = max(1.0, entry[0].width * entry[0].height / 1e6)  # no decode: charge the resized photo
+        else:
+            megapixels = upload_megapixels(io.BytesIO(content))
+        refused = admit(caller, megapixels)
+        if refused:
+            return refused
+    if entry:
+        render = (render_decoded, entry[0], spec, entry[2])
+    else:
+        render = (render_make_banner, content, spec, DECODE_CACHE_BYTES > 0)
     try:
-        img = Image.open(io.BytesIO(content)).convert("RGB")
-    except Exception:
+        with caller_render(caller):
+            rendered, coalesced = await single_flight(out_id, *render, timings=timings)
+        data, used_quality, width, height, decode_stats, base = rendered
+        if base is not None:
+            decoded.put(photo_id, spec["max_px"], base, digest, decode_stats)
+    except UnsupportedImage:
+        UPLOADS_REJECTED.inc(reason="not_image")
         return JSONResponse({"error": "Unsupported image"}, status_code=400)
+    except ImageTooLarge as e:
+        UPLOADS_REJECTED.inc(reason="too_many_pixels")
+        return JSONResponse({"error": str(e)}, status_code=413)
+    count_request("make_banner", spec, "coalesced" if coalesced else "miss")
 
-    img = resize_long_edge(img, max_px or MAX_W)
+    if delivery == "inline":
+        # Bytes go straight back; the copy under /outputs (if any) is written afterwards.
+        headers = {"X-Render-Cache": "coalesced" if coalesced else "miss", "X-Photo-Hash": photo_id,
+                   "X-Decode-Ms": str(decode_stats["decode_ms"]), "Vary": "Accept", **server_timing(timings)}
+        if used_quality:
+            headers["X-Quality"] = str(used_quality)
+        if persist != "off":
+            background_tasks.add_task(outputs.save, out_id, data)
+            headers["X-Output-Url"] = f"/outputs/{out_id}"
+        return Response(data, media_type=media_type, headers=headers)
 
-    # Resolve text/style from preset or brand
-    chosen = PRESETS.get(preset)
-    if text.strip():
-        label = text.strip()
-    else:
-        label = (chosen["label"] if chosen else "")
+    await outputs.save(out_id, data, timings)
 
-    if style == "auto":
-        style = (chosen["style"] if chosen else "left_strip")
+    return JSONResponse({"id": out_id, "url": f"/outputs/{out_id}", "width": width, "height": height,
+                         "format": spec["format"], "bytes": len(data), "quality": used_quality,
+                         "cached": False, "coalesced": coalesced, "decode": decode_stats, "photo_hash": photo_id},
+                        headers=server_timing(timings))
 
-    # Brand overrides
-    strip_color = None
-    text_color = None
-    if brand and brand.lower() in BRANDS:
-        b = BRANDS[brand.lower()]
-        label = label or b.get("label", label)
-        style = b.get("style", style)
-        strip_color = b.get("strip_color")
-        text_color = b.get("text_color")
+@app.post("/make_banners")
+async def make_banners(
+    request: Request,
+    files: list[UploadFile] = File(...),
+    specs: str = Form(""),
+    max_px: int = Form(None),
+    format: str = Form("json"),
+    accept: str = Header(""),
+    x_api_key: str = Header(None),
+    invite: str = Form("")
+):
+    """Several variants of one or more photos; each photo is decoded once.
 
-    if style == "left_strip":
-        out = add_left_strip(img, label,
-                             strip_color=strip_color or (0,0,0,180),
-                             text_color=text_color or (255,255,255,255))
-    elif style == "bottom_ribbon":
-        out = add_bottom_ribbon(img, label,
-                                ribbon_color=strip_color or (0,0,0,170),
-                                text_color=text_color or (255,255,255,255))
-    else:
-        return JSONResponse({"error": "Unknown style"}, status_code=400)
+    `specs` is a JSON list of {"preset", "text", "style", "brand", "format",
+    "quality", "max_bytes"} objects (all presets when empty). Returns a JSON
+    manifest, or a ZIP when `format=zip` or the client accepts application/zip.
+    """
+    if API_KEYS and x_api_key not in API_KEYS:
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+    if INVITE_CODES and invite not in INVITE_CODES and not x_api_key:
+        return JSONResponse({"error": "Invite required"}, status_code=401)
 
-    out_id = str(uuid.uuid4()) + ".png"
-    out_path = os.path.join(OUTPUT_DIR, out_id)
-    out.convert("RGB").save(out_path, quality=95)
+    try:
+        resolved = resolve_specs(specs, max_px)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    # Every photo x spec is a render in the pool, so the whole batch has to fit in the queue.
+    renders = len(files) * len(resolved)
+    limit = render_pool.queue_limit
+    if renders > limit:
+        return JSONResponse({"error": f"Batch too large: {renders} renders, at most {limit} per request; "
+                                      "use /jobs for bulk work"}, status_code=413)
+    if render_pool.busy(renders):
+        return render_pool.busy_response()
 
-    return {"id": out_id, "url": f"/outputs/{out_id}", "width": out.width, "height": out.height}
+    with timed("read"):
+        contents = [await f.read() for f in files]
+    caller = caller_id(request, x_api_key, invite)
+    refused = admit(caller, sum(upload_megapixels(io.BytesIO(content)) for content in contents))
+    if refused:
+        return refused
+    try:
+        with caller_render(caller):
+            photos = await asyncio.gather(*(render_photo(content, f.filename, resolved, max_px)
+                                            for content, f in zip(contents, files)))
+    except UnsupportedImage:
+        UPLOADS_REJECTED.inc(reason="not_image")
+        return JSONResponse({"error": "Unsupported image"}, status_code=400)
+    except ImageTooLarge as e:
+        UPLOADS_REJECTED.inc(reason="too_many_pixels")
+        return JSONResponse({"error": str(e)}, status_code=413)
 
-@app.get("/outputs/{file_id}")
-async def get_output(file_id: str):
-    path = os.path.join(OUTPUT_DIR, file_id)
-    if not os.path.exists(path):
+    if format != "zip" and "application/zip" not in accept:
+        return {"photos": photos}
+
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_STORED) as zf:  # encoded images are already compressed
+        for n, photo in enumerate(photos, 1):
+            stem = os.path.splitext(os.path.basename(photo["filename"] or ""))[0] or f"photo-{n}"
+            for i, entry in enumerate(photo["outputs"], 1):
+                ext = os.path.splitext(entry["id"])[1]
+                zf.write(os.path.join(outputs.dir, entry["id"]), f"{n:02d}-{stem}/{i:02d}-{entry['spec']['style']}{ext}")
+        zf.writestr("manifest.json", json.dumps({"photos": photos}, indent=2))
+    return Response(buf.getvalue(), media_type="application/zip",
+                    headers={"Content-Disposition": 'attachment; filename="banners.zip"'})
+
+@app.post("/jobs", status_code=202)
+async def create_job(
+    request: Request,
+    files: list[UploadFile] = File(...),
+    specs: str = Form(""),
+    max_px: int = Form(None),
+    x_api_key: str = Header(None),
+    invite: str = Form("")
+):
+    """Queue photos for rendering and return at once; poll GET /jobs/{id} for progress.
+
+    Takes the same `specs` and `max_px` as /make_banners.
+    """
+    if API_KEYS and x_api_key not in API_KEYS:
+        return JSONResponse({"error": "Unauthorized"}, status_code=401)
+    if INVITE_CODES and invite not in INVITE_CODES and not x_api_key:
+        return JSONResponse({"error": "Invite required"}, status_code=401)
+    try:
+        resolve_specs(specs, max_px)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    # Job photos render in the background at bulk priority, so only the bucket applies.
+    megapixels = await asyncio.to_thread(lambda: sum(upload_megapixels(f.file) for f in files))
+    refused = admit(caller_id(request, x_api_key, invite), megapixels, concurrent=False)
+    if refused:
+        return refused
+
+    job_id = uuid.uuid4().hex
+    await asyncio.to_thread(spool_job, job_id, files, specs, max_px)
+    _job_queued.set()
+    return {"id": job_id, "status": "queued", "total": len(files), "url": f"/jobs/{job_id}"}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, wait: float = 0):
+    """Progress and outputs so far. With `wait` (seconds, up to 60) an unfinished job
+    is held until its next photo finishes, so clients can long-poll instead of spinning."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + min(max(wait, 0), JOB_MAX_WAIT)
+    progress = _job_progress  # taken before reading, so nothing finishing in between is missed
+    job = await asyncio.to_thread(load_job, job_id)
+    if job is None:
         return JSONResponse({"error": "Not found"}, status_code=404)
-    return FileResponse(path)
+    seen = (job["done"], job["failed"])
+    while job["status"] != "done" and (job["done"], job["failed"]) == seen:
+        try:
+            await asyncio.wait_for(progress.wait(), deadline - loop.time())
+        except asyncio.TimeoutError:
+            break
+        progress = _job_progress
+        job = await asyncio.to_thread(load_job, job_id)
+    return job
+
+
+app.include_router(output_router(outputs, single_flight, render_pool, OUTPUT_VARIANTS))
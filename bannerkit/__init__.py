@@ -0,0 +1,9 @@
+"""Code shared by the eXp app (app.py) and banner-bot (banner-bot/app.py).
+
+Metrics, upload limits, decoding and encoding, the render pool, fonts and the
+label layer cache and blending, the output store, render cache and /outputs
+route, single-flight renders, the decoded-photo cache and startup helpers live
+here once, so a fix lands in both apps. Settings that both apps read from the
+same environment variables with the same defaults are read here; anything an
+app configures differently (output directory, default format, ...) is passed in.
+"""
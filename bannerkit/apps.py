@@ -0,0 +1,34 @@
+"""Loading the two apps outside uvicorn, for bulk.py and the scripts in bench/."""
+import importlib.util
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATHS = {
+    "generate": os.path.join(ROOT, "app.py"),                  # eXp /generate app
+    "banner_bot": os.path.join(ROOT, "banner-bot", "app.py"),  # /make_banner app
+}
+
+
+def load_app(name: str):
+    """Import one of the two apps under a unique module name (both files are `app.py`).
+
+    The import runs from the repo root, so static/ and outputs/ resolve the same
+    way whatever the caller's working directory; each app is loaded once per process.
+    """
+    module_name = f"{name}_app"
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    spec = importlib.util.spec_from_file_location(module_name, APP_PATHS[name])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    cwd = os.getcwd()
+    os.chdir(ROOT)
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[module_name]
+        raise
+    finally:
+        os.chdir(cwd)
+    return module
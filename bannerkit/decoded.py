@@ -0,0 +1,76 @@
+"""Decoded photos kept between requests.
+
+Agents often send the same photo again with only the text or colors changed.
+The decoded, resized photo is kept under the upload's hash (sent back as
+photo_hash / X-Photo-Hash) and long edge, so that re-render goes straight to
+compositing, and a client can send photo_hash instead of the photo while it's
+still here.
+"""
+import collections
+
+from PIL import Image
+
+from bannerkit.imaging import pixel_bytes
+
+
+def digest_id(digest) -> str:
+    """The photo_hash for an upload's hashlib.sha256."""
+    return digest.hexdigest()[:32]
+
+
+class DecodedCache:
+    """Up to max_bytes of decoded photos; least recently used go first. Only touched from the event loop."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.photos = collections.OrderedDict()  # (photo hash, long edge) -> (image, upload digest, decode stats)
+        self.bytes = 0
+        self.counts = {"hits": 0, "misses": 0, "evicted": 0}
+
+    def put(self, photo_id: str, long_edge: int, img: Image.Image, digest, decode_stats: dict):
+        key = (photo_id, long_edge)
+        if key in self.photos or pixel_bytes(img) > self.max_bytes:
+            return
+        self.photos[key] = (img, digest, decode_stats)
+        self.bytes += pixel_bytes(img)
+        while self.bytes > self.max_bytes:
+            _, (old, _, _) = self.photos.popitem(last=False)
+            self.bytes -= pixel_bytes(old)
+            self.counts["evicted"] += 1
+
+    def get(self, photo_id: str, long_edge: int):
+        """(image, upload digest, decode stats) for a photo decoded at long_edge, or None."""
+        entry = self.photos.get((photo_id, long_edge))
+        self.counts["hits" if entry else "misses"] += 1
+        if entry:
+            self.photos.move_to_end((photo_id, long_edge))
+        return entry
+
+    def find(self, photo_id: str, long_edge: int):
+        """get, or else the smallest copy of the photo that can be reduced to long_edge, or None.
+
+        A copy decoded at a larger long edge qualifies, and so does one that was
+        never reduced (the photo is smaller than the long edge it was kept at).
+        """
+        entry, best = self.photos.get((photo_id, long_edge)), None
+        if entry is None:
+            for key, candidate in self.photos.items():
+                img, _, decode_stats = candidate
+                if key[0] == photo_id and (key[1] > long_edge or img.size == tuple(decode_stats["source"])):
+                    if best is None or max(img.size) < max(self.photos[best][0].size):
+                        best = key
+            entry = self.photos.get(best)
+        self.counts["hits" if entry else "misses"] += 1
+        if entry:
+            self.photos.move_to_end(best or (photo_id, long_edge))
+        return entry
+
+    def long_edges(self, photo_id: str) -> list:
+        """The long edges a photo is kept at."""
+        return sorted(edge for pid, edge in self.photos if pid == photo_id)
+
+    def stats(self) -> dict:
+        hits, misses = self.counts["hits"], self.counts["misses"]
+        return {"photos": len(self.photos), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                "hits": hits, "misses": misses, "hit_rate": round(hits / (hits + misses), 3) if hits + misses else None,
+                "evicted": self.counts["evicted"]}
@@ -0,0 +1,52 @@
+"""Single-flight renders.
+
+Identical uploads often arrive within milliseconds of each other (CRM, browser,
+syndication). While a render for a key is running, later requests for the same
+key wait for it instead of starting their own. The render runs as its own task,
+so a caller disconnecting doesn't cancel it for the others.
+"""
+import asyncio
+import functools
+import time
+
+
+class SingleFlight:
+    """Coalesces calls to run (an app's RenderPool.run) by key. Only touched from the event loop."""
+
+    def __init__(self, run):
+        self.run = run
+        self.flights = {}  # key -> asyncio.Task
+        self.counts = {"renders": 0, "coalesced": 0, "renders_ms": 0.0, "coalesced_ms": 0.0}
+
+    def in_flight(self, key: str) -> bool:
+        return key in self.flights
+
+    def _done(self, key: str, task: asyncio.Task):
+        self.flights.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # callers re-raise it; don't log it as unretrieved
+
+    async def __call__(self, key: str, fn, *args, timings: dict = None):
+        """run(fn, *args), shared by every caller with the same key -> (result, coalesced).
+
+        Only the caller that starts the render gets its stage timings.
+        """
+        t0 = time.perf_counter()
+        task = self.flights.get(key)
+        coalesced = task is not None
+        if not coalesced:
+            task = asyncio.ensure_future(self.run(fn, *args, timings=timings))
+            self.flights[key] = task
+            task.add_done_callback(functools.partial(self._done, key))
+        try:
+            return await asyncio.shield(task), coalesced
+        finally:
+            stat = "coalesced" if coalesced else "renders"
+            self.counts[stat] += 1
+            self.counts[stat + "_ms"] += (time.perf_counter() - t0) * 1000
+
+    def stats(self) -> dict:
+        renders, coalesced = self.counts["renders"], self.counts["coalesced"]
+        return {"renders": renders, "coalesced": coalesced, "in_flight": len(self.flights),
+                "render_ms_avg": round(self.counts["renders_ms"] / renders, 1) if renders else None,
+                "coalesced_ms_avg": round(self.counts["coalesced_ms"] / coalesced, 1) if coalesced else None}
@@ -0,0 +1,41 @@
+"""Font files found at startup, and parsed fonts shared per (file, size).
+
+Faces are resolved once and FreeType fonts are kept in an LRU, so layout loops
+don't hit the disk or re-parse the same file.
+"""
+import functools
+import os
+
+from PIL import ImageFont
+
+FONT_CACHE_SIZE = int(os.environ.get("FONT_CACHE_SIZE", 128))  # (face, size) pairs kept parsed
+
+
+def scan_fonts(font_dir: str) -> dict:
+    """Index font files as {(family, weight): path}, e.g. ("GreycliffCF", "ExtraBold").
+
+    Only formats FreeType loads directly are indexed; .otf wins over .ttf.
+    """
+    faces = {}
+    if not os.path.isdir(font_dir):
+        return faces
+    for name in sorted(os.listdir(font_dir)):
+        stem, ext = os.path.splitext(name)
+        if ext.lower() not in (".otf", ".ttf") or "-" not in stem:
+            continue
+        key = tuple(stem.split("-", 1))
+        if key in faces and faces[key].lower().endswith(".otf"):
+            continue
+        faces[key] = os.path.join(font_dir, name)
+    return faces
+
+
+@functools.lru_cache(maxsize=FONT_CACHE_SIZE)
+def truetype(path: str, size: int) -> ImageFont.FreeTypeFont:
+    return ImageFont.truetype(path, size)
+
+
+def font_cache_stats(faces: dict) -> dict:
+    info = truetype.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "size": info.currsize, "maxsize": info.maxsize,
+            "faces": sorted("-".join(key) for key in faces)}
@@ -0,0 +1,180 @@
+"""Decoding uploads down to the render size, and encoding outputs."""
+import hashlib
+import io
+import json
+import os
+import time
+
+from PIL import Image
+
+from bannerkit.metrics import observe, stage
+
+MAX_INPUT_MEGAPIXELS = float(os.environ.get("MAX_INPUT_MEGAPIXELS", 100))  # refused from the header alone
+Image.MAX_IMAGE_PIXELS = int(MAX_INPUT_MEGAPIXELS * 1_000_000)  # keep Pillow's bomb guard in line
+JPEG_SUBSAMPLING = os.environ.get("JPEG_SUBSAMPLING", "4:2:0")  # "4:4:4" keeps colored text edges crisper
+MIN_QUALITY = int(os.environ.get("MIN_QUALITY", 40))          # floor for max_bytes searches
+
+# name -> (Pillow format, file extension, media type)
+OUTPUT_FORMATS = {
+    "jpeg": ("JPEG", ".jpg", "image/jpeg"),
+    "webp": ("WEBP", ".webp", "image/webp"),
+    "png": ("PNG", ".png", "image/png"),
+}
+FORMAT_BY_EXT = {ext: fmt for fmt, (_, ext, _) in OUTPUT_FORMATS.items()}
+DEFAULT_QUALITY = {"jpeg": 92, "webp": 90}
+
+
+class UnsupportedImage(Exception):
+    pass
+
+
+class ImageTooLarge(Exception):
+    pass
+
+
+def long_edge_size(size, long_edge: int):
+    """(w, h) scaled so the long edge is at most long_edge, aspect kept."""
+    w, h = size
+    if max(w, h) <= long_edge:
+        return w, h
+    if w >= h:
+        return long_edge, max(1, int(h * (long_edge / w)))
+    return max(1, int(w * (long_edge / h))), long_edge
+
+
+def pixel_bytes(img: Image.Image) -> int:
+    # Pillow keeps 1 byte per pixel for L/P/1, 4 for everything else we see here.
+    return img.width * img.height * (1 if img.mode in ("1", "L", "P") else 4)
+
+
+def decode_image(raw: bytes, long_edge: int, mode: str = "RGB"):
+    """Decode an upload straight down to at most long_edge, returning (image, stats).
+
+    Oversized dimensions are refused from the header before any pixels are
+    decoded (ImageTooLarge); anything Pillow can't read is UnsupportedImage.
+    JPEGs decode at a reduced DCT scale (draft) to within 2x of the target and
+    other formats are box-reduced to within 2x, so the final LANCZOS pass never
+    runs on the full-size frame.
+    """
+    t0 = time.perf_counter()
+    with stage("decode"):
+        try:
+            img = Image.open(io.BytesIO(raw))
+        except Image.DecompressionBombError as e:
+            raise ImageTooLarge(str(e))
+        except Exception:
+            raise UnsupportedImage()
+        source = img.size
+        observe("input_megapixels", source[0] * source[1] / 1e6)
+        if source[0] * source[1] > MAX_INPUT_MEGAPIXELS * 1_000_000:
+            raise ImageTooLarge(f"{source[0]}x{source[1]} exceeds {MAX_INPUT_MEGAPIXELS:g} megapixels")
+        target = long_edge_size(source, long_edge)
+        if target != source:
+            img.draft(mode, target)
+        try:
+            img.load()
+        except Exception:
+            raise UnsupportedImage()
+    peak = pixel_bytes(img)
+    with stage("resize"):
+        # Resample before converting so the conversion runs on the small frame;
+        # palette/bilevel images have to be converted first.
+        if img.mode not in ("RGB", "RGBA", "L") and img.mode != mode:
+            converted = img.convert(mode)
+            peak = max(peak, pixel_bytes(img) + pixel_bytes(converted))
+            img = converted
+        if img.size != target:
+            resized = img.resize(target, Image.LANCZOS, reducing_gap=2.0)
+            peak = max(peak, pixel_bytes(img) + pixel_bytes(resized))
+            img = resized
+        if img.mode != mode:
+            converted = img.convert(mode)
+            peak = max(peak, pixel_bytes(img) + pixel_bytes(converted))
+            img = converted
+    return img, {
+        "decode_ms": round((time.perf_counter() - t0) * 1000, 1),
+        "source": source,
+        "decoded": img.size,
+        "peak_pixel_bytes": peak,
+    }
+
+
+def negotiate_format(requested: str, accept: str, default: str) -> str:
+    """The `format` field if valid, else the best image type in Accept, else default.
+
+    Browser navigations list text/html next to image types; those keep the default
+    so the HTML forms still download what they always have.
+    """
+    requested = (requested or "").strip().lower()
+    requested = "jpeg" if requested == "jpg" else requested
+    if requested in OUTPUT_FORMATS:
+        return requested
+    if not accept or "text/html" in accept:
+        return default
+    best, best_q = default, 0.0
+    for item in accept.split(","):
+        media_type, *options = [part.strip() for part in item.split(";")]
+        q = 1.0
+        for option in options:
+            if option.startswith("q="):
+                try:
+                    q = float(option[2:])
+                except ValueError:
+                    q = 0.0
+        for name, (_, _, mt) in OUTPUT_FORMATS.items():
+            if media_type == mt and q > best_q:
+                best, best_q = name, q
+    return best
+
+
+def encode_image(img: Image.Image, fmt: str, quality=None, max_bytes=None):
+    """Encode img -> (bytes, quality used).
+
+    JPEGs are progressive with JPEG_SUBSAMPLING. With max_bytes, JPEG/WebP quality
+    is binary-searched for the highest setting under the budget, down to
+    MIN_QUALITY (returned even if still over). PNG is lossless and ignores both.
+    """
+    def save(q):
+        buf = io.BytesIO()
+        if fmt == "jpeg":
+            img.save(buf, "JPEG", quality=q, optimize=True, progressive=True, subsampling=JPEG_SUBSAMPLING)
+        elif fmt == "webp":
+            img.save(buf, "WEBP", quality=q, method=4)
+        else:
+            img.save(buf, "PNG")
+        return buf.getvalue()
+
+    quality = quality or DEFAULT_QUALITY.get(fmt)
+    data = save(quality)
+    if fmt == "png" or not max_bytes or len(data) <= max_bytes:
+        return data, quality
+    best, smallest = None, (data, quality)
+    lo, hi = MIN_QUALITY, quality - 1
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        data = save(mid)
+        if len(data) <= max_bytes:
+            best, lo = (data, mid), mid + 1
+        else:
+            smallest, hi = (data, mid), mid - 1
+    return best or smallest
+
+
+def encode_output(img: Image.Image, settings: dict):
+    """encode_image with a render's format, quality and max_bytes, timed and observed."""
+    with stage("encode"):
+        data, quality = encode_image(img, settings["format"], settings["quality"], settings["max_bytes"])
+    observe("output_bytes", len(data), format=settings["format"])
+    return data, quality
+
+
+def settings_digest(fonts, **settings) -> str:
+    """Short hash of the server settings that change rendered bytes, for render keys.
+
+    fonts are the files renders can draw with, counted by path and size so a
+    replaced file changes the hash too; settings are the app's own (long edge, ...).
+    """
+    files = {path: os.path.getsize(path) if os.path.exists(path) else None for path in fonts if path}
+    blob = json.dumps({"subsampling": JPEG_SUBSAMPLING, "min_quality": MIN_QUALITY, "fonts": files, **settings},
+                      sort_keys=True)
+    return hashlib.sha256(blob.encode()).hexdigest()[:16]
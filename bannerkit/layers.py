@@ -0,0 +1,143 @@
+"""Label layers cached in each render worker, and blending them onto photos.
+
+Fitting, wrapping and rasterizing a label depend on the label and the photo
+size but not on colors, so the text is kept as an L-mode mask (cropped to its
+ink) and tinted at paste time. Photos are resized to one long edge, so a few
+sizes cover nearly every request; each app builds its preset labels before the
+first one.
+
+Where NumPy is installed, banners are blended in uint16 fixed point against a
+premultiplied layer, to the same pixels as Pillow's alpha_composite. NumPy is
+imported by the render workers, not at app import: the server process never
+blends in process-pool mode.
+"""
+import collections
+import contextlib
+import multiprocessing
+import os
+import threading
+
+from PIL import Image
+
+from bannerkit.metrics import stage
+
+LAYER_CACHE_BYTES = int(float(os.environ.get("LAYER_CACHE_MB", 32)) * 1024 * 1024)  # per render worker
+np = None
+_numpy_tried = False
+
+
+def have_numpy() -> bool:
+    """Import NumPy on first use; False where it isn't installed (Pillow's alpha_composite then)."""
+    global np, _numpy_tried
+    if not _numpy_tried:
+        _numpy_tried = True
+        try:
+            import numpy as np
+        except ImportError:
+            pass
+    return np is not None
+
+
+def mask_bytes(layer: dict) -> int:
+    return layer["mask"].width * layer["mask"].height
+
+
+class LayerCache:
+    """Up to max_bytes of layers per worker (size(layer) each); least recently used go first.
+
+    Hits, misses and evictions are counted in an array shared with the pool
+    processes, so the server's /stats covers every worker. Builds are timed as
+    the stage named stage_name, if any.
+    """
+
+    def __init__(self, max_bytes: int = LAYER_CACHE_BYTES, size=mask_bytes, stage_name: str = "layout"):
+        self.max_bytes, self.size, self.stage_name = max_bytes, size, stage_name
+        self.layers = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.bytes = 0
+        self.counts = multiprocessing.Array("q", 3)  # hits, misses, evicted
+        self.counting = True
+
+    def _count(self, i: int):
+        if self.counting:
+            with self.counts.get_lock():
+                self.counts[i] += 1
+
+    def get(self, key: tuple, build):
+        """The layer for key, calling build() on a miss."""
+        with self.lock:
+            layer = self.layers.get(key)
+            if layer is not None:
+                self.layers.move_to_end(key)
+        if layer is not None:
+            self._count(0)
+            return layer
+        self._count(1)
+        with stage(self.stage_name) if self.stage_name else contextlib.nullcontext():
+            layer = build()
+        with self.lock:
+            if key not in self.layers:
+                self.layers[key] = layer
+                self.bytes += self.size(layer)
+            while self.bytes > self.max_bytes and len(self.layers) > 1:
+                _, old = self.layers.popitem(last=False)
+                self.bytes -= self.size(old)
+                self._count(2)
+        return layer
+
+    @contextlib.contextmanager
+    def uncounted(self):
+        """Prewarm builds aren't cache misses."""
+        self.counting = False
+        try:
+            yield
+        finally:
+            self.counting = True
+
+    def stats(self) -> dict:
+        hits, misses, evicted = self.counts[:]
+        lookups = hits + misses
+        return {"hits": hits, "misses": misses,
+                "hit_rate": round(hits / lookups, 3) if lookups else None,
+                "evicted": evicted, "max_bytes_per_worker": self.max_bytes}
+
+
+def ink_layer(mask: Image.Image, **geometry) -> dict:
+    """Crop a full-region text mask to its ink; "xy" is where the crop goes back."""
+    bbox = mask.getbbox() or (0, 0, 0, 0)
+    return {"mask": mask.crop(bbox), "xy": bbox[:2], **geometry}
+
+
+def paste_ink(target: Image.Image, layer: dict, fill):
+    """Tint a layer's text mask onto target; same pixels as drawing the text there."""
+    mask = layer["mask"]
+    if mask.width and mask.height:
+        x, y = layer["xy"]
+        target.paste(fill, (x, y, x + mask.width, y + mask.height), mask)
+
+
+def fill_blend(rgba) -> dict:
+    """A uniform RGBA fill premultiplied for blend_region: color * alpha (+128 for rounding), and 255 - alpha."""
+    r, g, b, a = rgba
+    return {"pre": np.array([r * a + 128, g * a + 128, b * a + 128], np.uint16), "inv": np.uint16(255 - a)}
+
+
+def blend_layer(overlay: Image.Image) -> dict:
+    """An RGBA overlay premultiplied for blend_region, likewise per pixel."""
+    o = np.asarray(overlay)
+    alpha = o[..., 3:4]
+    pre = o[..., :3].astype(np.uint16)
+    pre *= alpha
+    pre += 128
+    inv = 255 - alpha
+    return {"pre": pre, "inv": inv, "nbytes": pre.nbytes + inv.nbytes}
+
+
+def blend_region(region: Image.Image, blend: dict) -> Image.Image:
+    """alpha_composite of an opaque RGB region and a fill_blend/blend_layer, to the same pixel."""
+    px = np.asarray(region).astype(np.uint16)
+    px *= blend["inv"]
+    px += blend["pre"]
+    px += px >> 8  # (x + (x >> 8)) >> 8 == x / 255, as in Pillow
+    px >>= 8
+    return Image.fromarray(px.astype(np.uint8), "RGB")
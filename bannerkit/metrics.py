@@ -0,0 +1,165 @@
+"""Prometheus text format at /metrics, hand-rolled so there's no extra dependency.
+
+Render stages are timed inside the pool workers (thread-local, so thread pools
+work too) and shipped back with each result; everything is observed in the
+main process, so /metrics covers every worker.
+"""
+import contextlib
+import os
+import threading
+import time
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "0") == "1"  # per-stage breakdown header on render responses
+
+
+def _label_str(labels) -> str:
+    if not labels:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in labels) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name, self.help, self.series = name, help, {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for key, value in sorted(self.series.items()):
+            yield f"{self.name}{_label_str(key)} {value}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets):
+        self.name, self.help, self.buckets, self.series = name, help, tuple(buckets), {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            counts = self.series.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for key, counts in sorted(self.series.items()):
+            for bound, n in zip(self.buckets + ("+Inf",), counts[:-2] + [counts[-1]]):
+                yield f"{self.name}_bucket{_label_str(key + (('le', bound),))} {n}"
+            yield f"{self.name}_sum{_label_str(key)} {counts[-2]}"
+            yield f"{self.name}_count{_label_str(key)} {counts[-1]}"
+
+
+class Gauge:
+    def __init__(self, name: str, help: str, read):
+        self.name, self.help, self.read = name, help, read
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} gauge"
+        yield f"{self.name} {self.read()}"
+
+
+STAGE_SECONDS = Histogram("banner_stage_seconds", "Time spent per pipeline stage.",
+                          (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10))
+INPUT_MEGAPIXELS = Histogram("banner_input_megapixels", "Uploaded image size before resizing.",
+                             (0.5, 1, 2, 4, 8, 12, 16, 24, 36, 50, 100))
+OUTPUT_BYTES = Histogram("banner_output_bytes", "Encoded output size.",
+                         (50e3, 100e3, 250e3, 500e3, 1e6, 2e6, 5e6, 10e6))
+WORKER_OBSERVATIONS = {"input_megapixels": INPUT_MEGAPIXELS, "output_bytes": OUTPUT_BYTES}
+_worker_obs = threading.local()
+
+
+@contextlib.contextmanager
+def stage(name: str):
+    """Time a render stage inside a pool worker; nested stages count only toward themselves."""
+    stages = getattr(_worker_obs, "stages", None)
+    if stages is None:
+        yield
+        return
+    outer_nested, _worker_obs.nested = _worker_obs.nested, 0.0
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - t0) * 1000
+        stages[name] = stages.get(name, 0.0) + elapsed - _worker_obs.nested
+        _worker_obs.nested = outer_nested + elapsed
+
+
+def observe(metric: str, value: float, **labels):
+    """Record a WORKER_OBSERVATIONS value from inside a pool worker."""
+    values = getattr(_worker_obs, "values", None)
+    if values is not None:
+        values.append((metric, value, labels))
+
+
+def instrumented(submitted: float, fn, *args):
+    """Pool entry point: fn(*args) -> (result, {"stages": ms by stage, "values": [...]})."""
+    _worker_obs.stages = {"queue": max(0.0, (time.time() - submitted) * 1000)}
+    _worker_obs.values, _worker_obs.nested = [], 0.0
+    try:
+        return fn(*args), {"stages": _worker_obs.stages, "values": _worker_obs.values}
+    finally:
+        _worker_obs.stages = _worker_obs.values = None
+
+
+def record_stages(stages: dict, timings: dict = None):
+    """Observe stage times (ms) and add them to a request's Server-Timing breakdown."""
+    for name, ms in stages.items():
+        STAGE_SECONDS.observe(ms / 1000, stage=name)
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + ms
+
+
+def record_worker(obs: dict, timings: dict = None):
+    """Observe what instrumented() brought back from a pool worker."""
+    record_stages(obs["stages"], timings)
+    for metric, value, labels in obs["values"]:
+        WORKER_OBSERVATIONS[metric].observe(value, **labels)
+
+
+@contextlib.contextmanager
+def timed(name: str, timings: dict = None):
+    """Time a stage on the event loop side (upload read, hashing, ...)."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stages({name: (time.perf_counter() - t0) * 1000}, timings)
+
+
+def server_timing(timings: dict) -> dict:
+    if not SERVER_TIMING or not timings:
+        return {}
+    return {"Server-Timing": ", ".join(f"{name};dur={ms:.1f}" for name, ms in timings.items())}
+
+
+def metrics_response(metrics: list) -> PlainTextResponse:
+    lines = [line for metric in metrics for line in metric.render()]
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+
+def metrics_router(app_metrics: list) -> APIRouter:
+    """GET /metrics for an app's metrics."""
+    router = APIRouter()
+
+    @router.get("/metrics")
+    def metrics():
+        return metrics_response(app_metrics)
+
+    return router
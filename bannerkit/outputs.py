@@ -0,0 +1,313 @@
+"""Rendered outputs: an LRU-swept directory, an optional shared store, and serving.
+
+Outputs are named by a hash of the upload bytes plus the resolved render
+settings (<32 hex chars>.<ext>), so a repeat submission is served from disk
+without rendering. A file's mtime is its last use; sweeps drop expired files,
+then the least recently used until the directory is back under a low-water
+mark below OUTPUT_MAX_BYTES, so a directory at its cap isn't rescanned on every
+new output. Writes and sweeps run in threads, off the event loop.
+
+With a store configured, every new output is also written to a store all
+instances share (an S3 bucket, or a directory on a shared disk), and a local
+miss is pulled from it; the output directory then acts as a read-through
+cache. Names are content hashes, so objects never change once written and
+nothing has to be invalidated. The store itself isn't swept: give the bucket a
+lifecycle rule.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+
+from fastapi import APIRouter
+from fastapi.responses import FileResponse, JSONResponse, Response
+from PIL import Image
+
+from bannerkit.imaging import FORMAT_BY_EXT, OUTPUT_FORMATS, encode_image
+from bannerkit.metrics import timed
+
+OUTPUT_MAX_BYTES = int(float(os.environ.get("OUTPUT_MAX_MB", 512)) * 1024 * 1024)  # output dir size cap
+OUTPUT_MAX_AGE = int(float(os.environ.get("OUTPUT_MAX_AGE_DAYS", 7)) * 86400)      # and max age
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL", "")  # S3-compatible service (MinIO, R2, ...) instead of AWS
+SWEEP_INTERVAL = 300  # seconds between sweeps while under the size limit
+SWEEP_LOW_WATER = 0.9  # a sweep over the size limit trims to this fraction of it
+OUTPUT_CACHE_CONTROL = "public, max-age=31536000, immutable"
+OUTPUT_ID = re.compile(r"([0-9a-f]{32})(\.[a-z]+)")
+log = logging.getLogger("uvicorn.error")
+
+
+def content_keys(content: bytes, fields_list: list, digest=None, **salt) -> list:
+    """Output name stem per fields dict; the upload is hashed once however many there are.
+
+    digest, if given, is hashlib.sha256 of the upload, so content isn't needed.
+    salt (render version, server settings) goes into every key.
+    """
+    base = digest or hashlib.sha256(content)
+    keys = []
+    for fields in fields_list:
+        h = base.copy()
+        h.update(json.dumps({**salt, **fields}, sort_keys=True).encode())
+        keys.append(h.hexdigest()[:32])
+    return keys
+
+
+class DirStore:
+    """Outputs in a directory shared between instances, e.g. a network disk."""
+
+    def __init__(self, root: str):
+        self.url = self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def get(self, name: str):
+        try:
+            with open(os.path.join(self.root, name), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, name: str, data: bytes):
+        path = os.path.join(self.root, name)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+
+class S3Store:
+    """Outputs in an S3 bucket, or any S3-compatible service at S3_ENDPOINT_URL. Needs boto3."""
+
+    def __init__(self, url: str):
+        import boto3  # optional: only installed where OUTPUT_STORE is s3://
+        self.url = url
+        self.bucket, _, prefix = url[len("s3://"):].partition("/")
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.client = boto3.client("s3", endpoint_url=S3_ENDPOINT_URL or None)  # credentials: the usual AWS_* env
+
+    def get(self, name: str):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self.prefix + name)["Body"].read()
+        except self.client.exceptions.NoSuchKey:
+            return None
+        except self.client.exceptions.ClientError as e:
+            # Some S3-compatible services answer a missing key with a bare 404 instead of NoSuchKey.
+            error = e.response.get("Error", {})
+            if error.get("Code") in ("NoSuchKey", "404", "NotFound") or \
+                    e.response.get("ResponseMetadata", {}).get("HTTPStatusCode") == 404:
+                return None
+            raise
+
+    def put(self, name: str, data: bytes):
+        fmt = FORMAT_BY_EXT.get(os.path.splitext(name)[1])
+        self.client.put_object(Bucket=self.bucket, Key=self.prefix + name, Body=data,
+                               ContentType=OUTPUT_FORMATS[fmt][2] if fmt else "application/octet-stream",
+                               CacheControl=OUTPUT_CACHE_CONTROL)
+
+
+def open_store(url: str):
+    if not url:
+        return None
+    if url.startswith("s3://"):
+        return S3Store(url)
+    return DirStore(url[len("file://"):] if url.startswith("file://") else url)
+
+
+class OutputCache:
+    """An app's output directory, plus the shared store at store_url if there is one."""
+
+    def __init__(self, output_dir: str, store_url: str = ""):
+        self.dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
+        self.store = open_store(store_url)
+        self.counts = {"hits": 0, "misses": 0, "evicted": 0, "bytes": None, "files": 0, "last_sweep": 0.0,
+                       "pulled": 0, "store_errors": 0}
+        self.lock = threading.Lock()  # counts are updated from write, pull, push and sweep threads
+        self.sweeping = False
+
+    def _count(self, name: str):
+        with self.lock:
+            self.counts[name] += 1
+
+    def local(self, out_id: str):
+        """Path of an output in the directory, or None. Refreshes the file's LRU position."""
+        if not OUTPUT_ID.fullmatch(out_id):
+            return None
+        path = os.path.join(self.dir, out_id)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def write(self, out_id: str, data: bytes) -> bool:
+        """Save an output to the directory; False if it was already there. Blocking."""
+        path = os.path.join(self.dir, out_id)
+        if os.path.exists(path):
+            return False  # keys are content hashes, so it already holds these bytes (e.g. coalesced requests)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)  # readers never see a half-written file
+        with self.lock:
+            if self.counts["bytes"] is not None:
+                self.counts["bytes"] += len(data)
+                self.counts["files"] += 1
+        return True
+
+    def pull(self, out_id: str):
+        """Copy an output from the store into the directory -> its path, or None. Blocking."""
+        try:
+            data = self.store.get(out_id)
+        except Exception as e:  # an unreachable store is a miss, not a failed request
+            self._count("store_errors")
+            log.warning("output store: get %s failed: %s", out_id, e)
+            return None
+        if data is None:
+            return None
+        self.write(out_id, data)
+        self._count("pulled")
+        return os.path.join(self.dir, out_id)
+
+    def push(self, out_id: str, data: bytes):
+        try:
+            self.store.put(out_id, data)
+        except Exception as e:  # the local copy still serves this instance
+            self._count("store_errors")
+            log.warning("output store: put %s failed: %s", out_id, e)
+
+    async def fetch(self, out_id: str):
+        """Local path of an output, pulled from the store if only the store has it; None if neither does."""
+        path = self.local(out_id)
+        if path is None and self.store is not None and OUTPUT_ID.fullmatch(out_id):
+            path = await asyncio.to_thread(self.pull, out_id)
+        return path
+
+    async def lookup(self, out_id: str):
+        """fetch for render lookups, counted as render cache hits and misses."""
+        path = await self.fetch(out_id)
+        self.counts["hits" if path else "misses"] += 1
+        return path
+
+    async def save(self, out_id: str, data: bytes, timings: dict = None) -> str:
+        """Keep a new output locally and in the store, so every instance can serve and reuse it."""
+        with timed("store", timings):
+            if await asyncio.to_thread(self.write, out_id, data) and self.store is not None:
+                await asyncio.to_thread(self.push, out_id, data)
+        if self.sweep_due() and not self.sweeping:
+            self.sweeping = True  # one sweep at a time; outputs saved meanwhile are counted by the next
+            try:
+                await asyncio.to_thread(self.sweep)
+            finally:
+                self.sweeping = False
+        return os.path.join(self.dir, out_id)
+
+    def sweep_due(self) -> bool:
+        over = self.counts["bytes"] is None or self.counts["bytes"] > OUTPUT_MAX_BYTES
+        return over or time.time() - self.counts["last_sweep"] > SWEEP_INTERVAL
+
+    def sweep(self, force: bool = False):
+        """Drop expired outputs, then the least recently used down to the low-water mark. Blocking."""
+        if not (force or self.sweep_due()):
+            return
+        now = time.time()
+        files = []
+        with os.scandir(self.dir) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    st = entry.stat()
+                    files.append((st.st_mtime, st.st_size, entry.path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        kept, evicted = len(files), 0
+        limit = OUTPUT_MAX_BYTES * SWEEP_LOW_WATER if total > OUTPUT_MAX_BYTES else OUTPUT_MAX_BYTES
+        for mtime, size, path in files:
+            if now - mtime <= OUTPUT_MAX_AGE and total <= limit:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            kept -= 1
+            evicted += 1
+        with self.lock:
+            self.counts["evicted"] += evicted
+            self.counts.update(bytes=total, files=kept, last_sweep=now)
+
+    def stats(self) -> dict:
+        self.sweep()
+        c = self.counts
+        lookups = c["hits"] + c["misses"]
+        return {"hits": c["hits"], "misses": c["misses"],
+                "hit_rate": round(c["hits"] / lookups, 3) if lookups else None,
+                "evicted": c["evicted"], "files": c["files"], "bytes_on_disk": c["bytes"],
+                "max_bytes": OUTPUT_MAX_BYTES, "store": self.store.url if self.store else None,
+                "pulled": c["pulled"], "store_errors": c["store_errors"]}
+
+    async def variant_source(self, file_id: str):
+        """Path of the same render in another format, if file_id names a format variant of one."""
+        m = OUTPUT_ID.fullmatch(file_id)
+        if not m or m.group(2) not in FORMAT_BY_EXT:
+            return None
+        for _, ext, _ in OUTPUT_FORMATS.values():
+            path = await self.fetch(m.group(1) + ext) if ext != m.group(2) else None
+            if path:
+                return path
+        return None
+
+
+# Output names are render keys, so a file's bytes never change: they're served
+# with a strong ETag (the name), a year-long immutable Cache-Control, 304s for
+# If-None-Match and byte ranges.
+def _etag_matches(header: str, etag: str) -> bool:
+    return any(tag.strip() in ("*", etag, "W/" + etag) for tag in header.split(","))
+
+
+class OutputResponse(FileResponse):
+    def __init__(self, path: str, file_id: str):
+        self.etag = f'"{file_id}"'
+        fmt = FORMAT_BY_EXT.get(os.path.splitext(file_id)[1])
+        super().__init__(path, media_type=OUTPUT_FORMATS[fmt][2] if fmt else None,
+                         headers={"ETag": self.etag, "Cache-Control": OUTPUT_CACHE_CONTROL})
+
+    async def __call__(self, scope, receive, send):
+        headers = dict(scope["headers"])
+        if _etag_matches(headers.get(b"if-none-match", b"").decode("latin-1"), self.etag):
+            await Response(status_code=304, headers={"ETag": self.etag, "Cache-Control": OUTPUT_CACHE_CONTROL})(
+                scope, receive, send)
+            return
+        if headers.get(b"if-range", b"").decode("latin-1") == self.etag:
+            # Starlette compares If-Range with its own mtime-based ETag; ours never goes stale.
+            scope = {**scope, "headers": [(k, v) for k, v in scope["headers"] if k != b"if-range"]}
+        await super().__call__(scope, receive, send)
+
+
+def transcode_output(path: str, fmt: str) -> bytes:
+    """Re-encode a stored output in another format. Runs in the render pool."""
+    with Image.open(path) as img:
+        return encode_image(img.convert("RGB"), fmt)[0]
+
+
+def output_router(outputs: OutputCache, single_flight, pool, variants: bool = True) -> APIRouter:
+    """GET/HEAD /outputs/{file_id}. With variants, another format of a stored render is transcoded once."""
+    router = APIRouter()
+
+    @router.api_route("/outputs/{file_id}", methods=["GET", "HEAD"])
+    async def get_output(file_id: str):
+        path = await outputs.fetch(file_id)
+        if path is None:
+            source = await outputs.variant_source(file_id) if variants else None
+            if source is None:
+                return JSONResponse({"error": "Not found"}, status_code=404)
+            if not single_flight.in_flight(file_id) and pool.busy():
+                return pool.busy_response()
+            data, _ = await single_flight(file_id, transcode_output, source,
+                                          FORMAT_BY_EXT[os.path.splitext(file_id)[1]])
+            path = await outputs.save(file_id, data)
+        return OutputResponse(path, file_id)
+
+    return router
@@ -0,0 +1,132 @@
+"""The render pool: CPU-bound work off the event loop, bounded and prioritized.
+
+Decoding, compositing and encoding run in RENDER_WORKERS processes (or threads)
+so one big upload doesn't stall every other request. A render holds one of
+RENDER_WORKERS slots while it's in the pool and waiters are served by priority,
+so form/API requests go ahead of queued bulk work (banner-bot's job photos) and
+only ever wait for the renders already running. Interactive renders past
+RENDER_QUEUE_LIMIT are refused with a 503 instead of queueing without bound.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from fastapi.responses import JSONResponse
+
+from bannerkit.metrics import Gauge, instrumented, record_worker
+
+RENDER_POOL = os.environ.get("RENDER_POOL", "process")      # "process" or "thread"
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", min(4, os.cpu_count() or 1)))
+RENDER_QUEUE_LIMIT = int(os.environ.get("RENDER_QUEUE_LIMIT", RENDER_WORKERS * 4))  # running + waiting
+RENDER_RETRY_AFTER = int(os.environ.get("RENDER_RETRY_AFTER", 5))  # seconds, sent with 503s
+INTERACTIVE, BULK = 0, 1
+log = logging.getLogger("uvicorn.error")
+
+
+class RenderPool:
+    """An app's render pool. Only touched from the event loop.
+
+    initializer(*initargs) runs once in each worker process (the app's layer
+    prewarm and warm-up); in thread mode warm() runs it once, in a thread.
+    """
+
+    def __init__(self, initializer, initargs=()):
+        self.initializer, self.initargs = initializer, initargs
+        self.executor = None
+        self.queue_limit = RENDER_QUEUE_LIMIT
+        self.in_flight = 0  # interactive renders running or waiting
+        self.slots_free = RENDER_WORKERS
+        self.waiters = []   # heap of (priority, seq, future)
+        self.seq = itertools.count()
+
+    def get_executor(self):
+        if self.executor is None:
+            if RENDER_POOL == "thread":
+                self.executor = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix="render")
+            else:
+                self.executor = ProcessPoolExecutor(max_workers=RENDER_WORKERS, initializer=self.initializer,
+                                                    initargs=self.initargs)
+        return self.executor
+
+    def busy(self, renders: int = 1) -> bool:
+        """True if `renders` more interactive renders would take the pool past its queue limit."""
+        return self.in_flight + renders > self.queue_limit
+
+    @staticmethod
+    def busy_response() -> JSONResponse:
+        return JSONResponse({"error": "Too many renders in progress, retry shortly"}, status_code=503,
+                            headers={"Retry-After": str(RENDER_RETRY_AFTER)})
+
+    async def _acquire_slot(self, priority: int):
+        if self.slots_free:
+            self.slots_free -= 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.seq), waiter))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release_slot()  # handed a slot just as we were cancelled
+            raise
+
+    def _release_slot(self):
+        while self.waiters:
+            _, _, waiter = heapq.heappop(self.waiters)
+            if not waiter.done():  # skip waiters that were cancelled
+                waiter.set_result(None)
+                return
+        self.slots_free += 1
+
+    async def run(self, fn, *args, priority: int = INTERACTIVE, timings: dict = None):
+        """Run fn(*args) in the pool; interactive callers check busy() first.
+
+        Stage times come back with the result and are observed here (and added to
+        timings, if given, for Server-Timing). "queue" includes waiting for a slot.
+        """
+        interactive = priority == INTERACTIVE
+        if interactive:
+            self.in_flight += 1
+        submitted = time.time()
+        try:
+            await self._acquire_slot(priority)
+            try:
+                result, obs = await asyncio.get_running_loop().run_in_executor(
+                    self.get_executor(), instrumented, submitted, fn, *args)
+            finally:
+                self._release_slot()
+        finally:
+            if interactive:
+                self.in_flight -= 1
+        record_worker(obs, timings)
+        return result
+
+    async def warm(self):
+        """Start the workers (and their initializer) now rather than on the first upload."""
+        t0 = time.perf_counter()
+        if RENDER_POOL == "thread":
+            await asyncio.to_thread(self.initializer, *self.initargs)
+        else:
+            await asyncio.gather(*(asyncio.wrap_future(self.get_executor().submit(int))
+                                   for _ in range(RENDER_WORKERS)))
+        log.info("render pool warm: %d %s workers in %.0f ms", RENDER_WORKERS, RENDER_POOL,
+                 (time.perf_counter() - t0) * 1000)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None  # a later startup (e.g. another TestClient) starts a fresh pool
+
+    def gauges(self) -> list:
+        """The pool's /metrics gauges."""
+        return [
+            Gauge("banner_renders_in_flight", "Interactive renders running or waiting for a pool slot.",
+                  lambda: self.in_flight),
+            Gauge("banner_render_slot_waiters", "Renders (interactive and bulk) waiting for a pool slot.",
+                  lambda: len(self.waiters)),
+            Gauge("banner_render_queue_limit", "RENDER_QUEUE_LIMIT.", lambda: self.queue_limit),
+        ]
@@ -0,0 +1,51 @@
+"""Cold-start helpers: codec registration, a warm-up photo and first-request logging."""
+import io
+import logging
+import time
+
+from PIL import Image
+
+WARMUP_SIZE = (640, 427)
+log = logging.getLogger("uvicorn.error")
+_started = None  # perf_counter when the app's startup finished
+
+
+def init_codecs():
+    """Register the JPEG/PNG/WebP plugins now; Image.open would otherwise load them on first use."""
+    Image.preinit()
+    from PIL import WebPImagePlugin  # not part of preinit; without it a WebP upload loads every plugin
+
+
+def warmup_photo() -> bytes:
+    """A small gradient JPEG for the render workers to decode, banner and encode at startup."""
+    buf = io.BytesIO()
+    Image.radial_gradient("L").resize(WARMUP_SIZE).convert("RGB").save(buf, "JPEG")
+    return buf.getvalue()
+
+
+def mark_started() -> float:
+    """Record the end of startup, for FirstRequestLog; returns it."""
+    global _started
+    _started = time.perf_counter()
+    return _started
+
+
+class FirstRequestLog:
+    """ASGI middleware logging each endpoint's first request: the one that pays for anything still cold."""
+
+    def __init__(self, app):
+        self.app = app
+        self.seen = set()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            name = getattr(scope.get("endpoint"), "__name__", None)  # set by the router on a match
+            if name and name not in self.seen:
+                self.seen.add(name)
+                log.info("first %s request: %.0f ms, %.1f s after startup", name,
+                         (time.perf_counter() - t0) * 1000, t0 - _started if _started else 0.0)
@@ -0,0 +1,150 @@
+"""Upload limits, applied while a multipart body streams in.
+
+Bodies are checked before FastAPI parses the form: requests over
+MAX_REQUEST_BYTES (by Content-Length, or as counted) and file parts over
+MAX_UPLOAD_BYTES get 413, and each file's first SNIFF_BYTES are sniffed (magic
+bytes + Pillow header parse) so non-images get 415 and images over
+MAX_INPUT_MEGAPIXELS get 413 without receiving the rest.
+"""
+import io
+import os
+import re
+
+from fastapi.responses import JSONResponse
+from PIL import Image
+
+from bannerkit.imaging import MAX_INPUT_MEGAPIXELS
+from bannerkit.metrics import Counter
+
+MAX_UPLOAD_BYTES = int(float(os.environ.get("MAX_UPLOAD_MB", 30)) * 1024 * 1024)     # per uploaded file
+MAX_REQUEST_BYTES = int(float(os.environ.get("MAX_REQUEST_MB", 200)) * 1024 * 1024)  # whole multipart body
+SNIFF_BYTES = 64 * 1024
+IMAGE_MAGIC = (b"\xff\xd8\xff", b"\x89PNG\r\n\x1a\n", b"GIF87a", b"GIF89a", b"BM", b"II*\x00", b"MM\x00*")
+UPLOADS_REJECTED = Counter("banner_uploads_rejected_total", "Uploads refused, by reason.")
+
+
+class UploadRejected(Exception):
+    pass
+
+
+def sniff_upload(head: bytes):
+    """None if the start of a file looks like an acceptable image, else (status, reason, message)."""
+    known = head.startswith(IMAGE_MAGIC) or (head[:4] == b"RIFF" and head[8:12] == b"WEBP")
+    try:
+        with Image.open(io.BytesIO(head)) as img:
+            w, h = img.size
+    except Image.DecompressionBombError as e:
+        return 413, "too_many_pixels", str(e)
+    except Exception:
+        # A known format can still need more than SNIFF_BYTES (e.g. a JPEG with a big EXIF block); decoding decides.
+        return None if known else (415, "not_image", "Unsupported image")
+    if w * h > MAX_INPUT_MEGAPIXELS * 1_000_000:
+        return 413, "too_many_pixels", f"{w}x{h} exceeds {MAX_INPUT_MEGAPIXELS:g} megapixels"
+    return None
+
+
+class MultipartSniffer:
+    """Follows a multipart body chunk by chunk, keeping only the first SNIFF_BYTES of each file part."""
+
+    def __init__(self, boundary: bytes):
+        self.delimiter = b"\r\n--" + boundary
+        self.buf = b"\r\n"  # the first boundary has no leading CRLF
+        self.state = "preamble"  # preamble | headers | part | epilogue
+        self.is_file, self.size, self.head = False, 0, None
+
+    def feed(self, chunk: bytes):
+        """None, or (status, reason, message) as soon as the body breaks a limit."""
+        self.buf += chunk
+        while True:
+            if self.state == "epilogue":
+                self.buf = b""
+                return None
+            if self.state == "headers":
+                end = self.buf.find(b"\r\n\r\n")
+                if end < 0:
+                    if self.buf.startswith(b"--"):
+                        self.state = "epilogue"
+                        continue
+                    return None
+                self.is_file = b'filename="' in self.buf[:end].lower()
+                self.size, self.head = 0, bytearray()
+                self.buf = self.buf[end + 4:]
+                self.state = "part"
+            i = self.buf.find(self.delimiter)
+            if i < 0:
+                keep = len(self.delimiter) - 1  # may hold the start of a delimiter
+                if len(self.buf) > keep:
+                    data, self.buf = self.buf[:-keep], self.buf[-keep:]
+                    if self.state == "part":
+                        return self._data(data)
+                return None
+            if self.state == "part":
+                rejected = self._data(self.buf[:i]) or self._sniff()
+                if rejected:
+                    return rejected
+            self.buf = self.buf[i + len(self.delimiter):]
+            self.state = "headers"
+
+    def _data(self, data: bytes):
+        if not self.is_file:
+            return None
+        self.size += len(data)
+        if self.size > MAX_UPLOAD_BYTES:
+            return 413, "too_large", f"Files over {MAX_UPLOAD_BYTES // (1024 * 1024)}MB aren't accepted"
+        if self.head is not None and len(self.head) < SNIFF_BYTES:
+            self.head += data[:SNIFF_BYTES - len(self.head)]
+            if len(self.head) == SNIFF_BYTES:
+                return self._sniff()
+        return None
+
+    def _sniff(self):
+        head, self.head = self.head, None
+        return sniff_upload(bytes(head)) if self.is_file and head else None
+
+
+class UploadLimits:
+    """ASGI middleware applying the limits above to multipart POSTs."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        headers = dict(scope.get("headers") or ()) if scope["type"] == "http" else {}
+        content_type = headers.get(b"content-type", b"").decode("latin-1")
+        if scope.get("method") != "POST" or not content_type.lower().startswith("multipart/form-data"):
+            return await self.app(scope, receive, send)
+        if int(headers.get(b"content-length", 0) or 0) > MAX_REQUEST_BYTES:
+            return await self.reject(scope, receive, send, (413, "too_large", "Request body too large"))
+        boundary = re.search(r'boundary="?([^";]+)"?', content_type)
+        sniffer = MultipartSniffer(boundary.group(1).encode("latin-1")) if boundary else None
+        received, rejected = 0, None
+
+        async def guarded_receive():
+            nonlocal received, rejected
+            message = await receive()
+            if message["type"] == "http.request" and not rejected:
+                body = message.get("body", b"")
+                received += len(body)
+                if received > MAX_REQUEST_BYTES:
+                    rejected = 413, "too_large", "Request body too large"
+                elif sniffer:
+                    rejected = sniffer.feed(body)
+                if rejected:
+                    raise UploadRejected()
+            return message
+
+        async def guarded_send(message):
+            if not rejected:  # the form parser's own error response is replaced by ours
+                await send(message)
+
+        try:
+            await self.app(scope, guarded_receive, guarded_send)
+        except UploadRejected:
+            pass
+        if rejected:
+            await self.reject(scope, receive, send, rejected)
+
+    async def reject(self, scope, receive, send, rejected):
+        status, reason, message = rejected
+        UPLOADS_REJECTED.inc(reason=reason)
+        await JSONResponse({"error": message}, status_code=status, headers={"Connection": "close"})(scope, receive, send)
@@ -0,0 +1,112 @@
+"""Throughput benchmark: NumPy banner blending vs Pillow's alpha_composite on same-size batches.
+
+    python bench/bench_blend.py [--batch 24] [--repeat 3]
+
+Each case banners --batch photos of one size, the way a job or /generate_batch
+does: "pillow" is the per-image alpha_composite path (the apps without NumPy),
+"numpy" the per-image vectorized blend against the cached premultiplied layer,
+and "stacked" blends the whole batch as one (N, H, W, 3) array in a single pass,
+for reference. Throughput counts compositing only (photos are decoded up
+front); "max diff" is the largest per-channel difference from the pillow output.
+"""
+import argparse
+import time
+
+import numpy as np
+from PIL import Image, ImageChops
+
+from common import load_app
+
+from bannerkit import layers
+
+SIZES = [(2048, 1365), (1365, 2048)]
+LABEL = "1/0 BUY DOWN STARTING @ 3.99%"
+STYLES = {
+    "left_strip": ("banner_bot", lambda app, img: app.add_left_strip(img, LABEL)),
+    "bottom_ribbon": ("banner_bot", lambda app, img: app.add_bottom_ribbon(img, LABEL)),
+    "add_left_banner": ("generate", lambda app, img: app.add_left_banner(img, LABEL)),
+}
+
+
+def synthetic_photo(size, seed):
+    # Gradient plus noise so the diff check means something.
+    base = Image.radial_gradient("L").resize(size)
+    noise = Image.effect_noise(size, 24 + seed * 8)
+    return Image.merge("RGB", (base, Image.blend(base, noise, 0.3), noise))
+
+
+def per_image(app, fn, photos, numpy_on):
+    layers.have_numpy()  # imported on first use; do it before switching it off
+    layers.np = np if numpy_on else None
+    try:
+        fn(app, photos[0].copy())  # layers and fonts built outside the timing
+        copies = [img.copy() for img in photos]
+        t0 = time.perf_counter()
+        outs = [fn(app, img) for img in copies]
+        return outs, time.perf_counter() - t0
+    finally:
+        layers.np = np
+
+
+def stacked(app, style, photos):
+    """The batch blended as one array: banner-bot styles only (add_left_banner's text is pasted after its fill)."""
+    W, H = photos[0].size
+    layers.np = np
+    if style == "left_strip":
+        layer = app.left_strip_layer(W, H, LABEL)
+        box = (0, 0, layer["region_w"], H)
+    else:
+        layer = app.bottom_ribbon_layer(W, H, LABEL)
+        box = (0, layer["top"], W, H)
+    STYLES[style][1](app, photos[0].copy())  # caches the blend layer
+    blend = next(v for k, v in app.blends.layers.items() if k[:2] == ("blend", style) and k[2:4] == (W, H))
+    t0 = time.perf_counter()
+    stack = np.stack([np.asarray(img.crop(box)) for img in photos]).astype(np.uint16)
+    stack *= blend["inv"]
+    stack += blend["pre"]
+    stack += stack >> 8
+    stack >>= 8
+    stack = stack.astype(np.uint8)
+    outs = []
+    for img, px in zip(photos, stack):
+        out = img.copy()
+        out.paste(Image.fromarray(px, "RGB"), box[:2])
+        outs.append(out)
+    return outs, time.perf_counter() - t0
+
+
+def max_diff(a, b):
+    return max(max(hi for _, hi in ImageChops.difference(x, y).getextrema()) for x, y in zip(a, b))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch", type=int, default=24)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'style':<16} {'size':>9} | {'pillow img/s':>12} | {'numpy img/s':>11} {'speedup':>7} {'diff':>4} | "
+          f"{'stacked img/s':>13} {'diff':>4}")
+    for style, (app_name, fn) in STYLES.items():
+        app = load_app(app_name)
+        for size in SIZES:
+            photos = [synthetic_photo(size, n % 4) for n in range(args.batch)]
+            best = {}
+            for _ in range(args.repeat):
+                for name, run in (("pillow", lambda: per_image(app, fn, photos, False)),
+                                  ("numpy", lambda: per_image(app, fn, photos, True)),
+                                  ("stacked", lambda: stacked(app, style, photos) if app_name == "banner_bot"
+                                   else (None, None))):
+                    outs, elapsed = run()
+                    if elapsed is not None and elapsed < best.get(name, (None, float("inf")))[1]:
+                        best[name] = (outs, elapsed)
+            rate = {name: args.batch / elapsed for name, (_, elapsed) in best.items()}
+            ref = best["pillow"][0]
+            cells = f"{rate['numpy']:>11.1f} {rate['numpy'] / rate['pillow']:>6.2f}x {max_diff(ref, best['numpy'][0]):>4}"
+            stack = (f"{rate['stacked']:>13.1f} {max_diff(ref, best['stacked'][0]):>4}" if "stacked" in rate
+                     else f"{'-':>13} {'-':>4}")
+            print(f"{style:<16} {size[0]:>4}x{size[1]:<4} | {rate['pillow']:>12.1f} | {cells} | {stack}")
+
+
+if __name__ == "__main__":
+    main()
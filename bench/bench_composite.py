@@ -0,0 +1,165 @@
+"""Memory benchmark: region-only compositing vs the old full-frame overlays.
+
+    python bench/bench_composite.py [--sizes 12 24]
+
+Every case runs in a fresh process. "blocks" counts the Pillow arena blocks
+(up to 16MB each) allocated or reused while compositing, "peak MB" is how far
+peak RSS rose above the decoded photo (Linux: VmHWM, reset via clear_refs),
+and "max diff" is the largest per-channel difference from the old output.
+"""
+import argparse
+import multiprocessing
+import time
+
+from PIL import Image, ImageChops, ImageDraw
+
+from common import load_app
+
+SIZES = {12: (4240, 2832), 24: (6000, 4000)}  # megapixels -> 3:2 photo
+LABEL = "1/0 BUY DOWN STARTING @ 3.99%"
+
+
+# --- The compositing paths as they were, kept here for comparison ---
+
+def legacy_add_left_banner(app, img, text, width_ratio=0.22, bg_rgba=(0, 0, 0, 180),
+                           text_fill=(255, 255, 255, 255), padding_ratio=0.06):
+    w, h = img.size
+    banner_w = max(40, int(w * width_ratio))
+    overlay = Image.new("RGBA", img.size, (0, 0, 0, 0))
+    ImageDraw.Draw(overlay).rectangle([0, 0, banner_w, h], fill=bg_rgba)
+    img = Image.alpha_composite(img.convert("RGBA"), overlay)
+    pad = int(banner_w * padding_ratio)
+    text_w, text_h = banner_w - 2 * pad, h - 2 * pad
+    draw = ImageDraw.Draw(img)
+    font, lines = app.fit_text_to_box(draw, text, font_path_size=int(banner_w * 0.28),
+                                      box_w=text_w, box_h=text_h, line_spacing=1.05)
+    line_heights = []
+    total_h = 0
+    for line in lines:
+        bbox = draw.textbbox((0, 0), line, font=font)
+        line_heights.append(bbox[3] - bbox[1])
+        total_h += bbox[3] - bbox[1]
+    total_h += int((len(lines) - 1) * (line_heights[0] * 0.05))
+    current_y = pad + max(0, (text_h - total_h) // 2)
+    for i, line in enumerate(lines):
+        lbbox = draw.textbbox((0, 0), line, font=font)
+        line_x = pad + max(0, (text_w - (lbbox[2] - lbbox[0])) // 2)
+        draw.text((line_x, current_y), line, font=font, fill=text_fill)
+        current_y += line_heights[i] + int(line_heights[i] * 0.05)
+    return img.convert("RGB")
+
+
+def legacy_overlay_style(app, img, text, left):
+    img = img.convert("RGBA")
+    W, H = img.size
+    overlay = Image.new("RGBA", img.size, (0, 0, 0, 0))
+    o = ImageDraw.Draw(overlay)
+    if left:
+        strip_w, padding = int(W * 0.32), 24
+        o.rounded_rectangle((0, 0, strip_w, H), radius=int(min(W, H) * 0.02), fill=(0, 0, 0, 180))
+        font = app.load_font(max(14, int(H * 0.05)))
+        max_text_w, x0, y0, box_h = strip_w - 2 * padding, padding, 0, H
+    else:
+        ribbon_h, padding = int(H * 0.16), 24
+        o.rectangle((0, H - ribbon_h, W, H), fill=(0, 0, 0, 170))
+        font = app.load_font(max(14, int(H * 0.06)))
+        max_text_w, x0, y0, box_h = W - 2 * padding, padding, H - ribbon_h, ribbon_h
+    lines = app.text_wrap(o, text, font, max_text_w)
+    line_h = font.getbbox("Ay")[3] - font.getbbox("Ay")[1]
+    total_h = len(lines) * line_h + (len(lines) - 1) * int(line_h * 0.25)
+    y = y0 + (box_h - total_h) // 2
+    for line in lines:
+        w = o.textlength(line, font=font)
+        x = x0 + (max_text_w - w) // 2 if left else (W - w) // 2
+        o.text((x, y), line, font=font, fill=(255, 255, 255, 255))
+        y += int(line_h * 1.25)
+    return Image.alpha_composite(img, overlay).convert("RGB")
+
+
+CASES = {
+    "add_left_banner": (
+        "generate",
+        lambda app, img: legacy_add_left_banner(app, img, LABEL),
+        lambda app, img: app.add_left_banner(img, LABEL),
+    ),
+    "add_left_strip": (
+        "banner_bot",
+        lambda app, img: legacy_overlay_style(app, img, LABEL, left=True),
+        lambda app, img: app.add_left_strip(img, LABEL),
+    ),
+    "add_bottom_ribbon": (
+        "banner_bot",
+        lambda app, img: legacy_overlay_style(app, img, LABEL, left=False),
+        lambda app, img: app.add_bottom_ribbon(img, LABEL),
+    ),
+}
+
+
+def photo(size):
+    # A gradient rather than a flat fill so the diff check means something.
+    return Image.radial_gradient("L").resize(size).convert("RGB")
+
+
+def peak_rss_kb():
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1])
+
+
+def reset_peak_rss():
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+
+
+def _measure(case, variant, size, conn):
+    app_name, legacy, current = CASES[case]
+    app = load_app(app_name)
+    fn = legacy if variant == "old" else current
+    fn(app, photo((640, 427)))  # load fonts before measuring
+    img = photo(size)
+    reset_peak_rss()
+    before_rss = peak_rss_kb()
+    before = Image.core.get_stats()
+    t0 = time.perf_counter()
+    out = fn(app, img)
+    elapsed = time.perf_counter() - t0
+    after = Image.core.get_stats()
+    blocks = sum(after[k] - before[k] for k in ("allocated_blocks", "reused_blocks"))
+    rss_kb = peak_rss_kb() - before_rss
+    conn.send((elapsed, blocks, rss_kb, out.tobytes() if variant == "old" else None))
+    conn.close()
+
+
+def measure(case, variant, size):
+    parent, child = multiprocessing.Pipe()
+    proc = multiprocessing.get_context("spawn").Process(target=_measure, args=(case, variant, size, child))
+    proc.start()
+    result = parent.recv()
+    proc.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=sorted(SIZES), choices=sorted(SIZES))
+    args = parser.parse_args()
+
+    print(f"{'case':<18} {'MP':>3} | {'old ms':>7} {'blocks':>6} {'peak MB':>7} | "
+          f"{'new ms':>7} {'blocks':>6} {'peak MB':>7} | {'max diff':>8}")
+    for case in CASES:
+        for mp in args.sizes:
+            size = SIZES[mp]
+            old_t, old_n, old_rss, old_bytes = measure(case, "old", size)
+            new_t, new_n, new_rss, _ = measure(case, "new", size)
+            # Recompute the new output here to diff it against the old bytes.
+            app_name, _, current = CASES[case]
+            new_img = current(load_app(app_name), photo(size))
+            old_img = Image.frombytes("RGB", size, old_bytes)
+            diff = max(hi for _, hi in ImageChops.difference(old_img, new_img.convert("RGB")).getextrema())
+            print(f"{case:<18} {mp:>3} | {old_t * 1000:>7.1f} {old_n:>6} {old_rss / 1024:>7.1f} | "
+                  f"{new_t * 1000:>7.1f} {new_n:>6} {new_rss / 1024:>7.1f} | {diff:>8}")
+
+
+if __name__ == "__main__":
+    main()
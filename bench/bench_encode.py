@@ -0,0 +1,82 @@
+"""Encode benchmark: output size and time per format on a fixed photo set.
+
+    python bench/bench_encode.py [--repeat 3] [--max-kb 300]
+
+Each photo gets a left strip from banner-bot and is encoded with
+bannerkit's encode_image as PNG, progressive JPEG and WebP at the default qualities;
+"old png" is the pre-encoder PNG save for reference. The last columns show
+the quality the max_bytes search settles on for a --max-kb budget.
+"""
+import argparse
+import io
+import os
+import time
+
+from PIL import Image
+
+from common import ROOT, load_app
+
+from bannerkit.imaging import encode_image
+
+app = load_app("banner_bot")
+
+LABEL = "1/0 BUY DOWN STARTING @ 3.99%"
+REPO_IMAGES = ["static/example-banner.png", "static/img/dayton-cartoon.png"]
+
+
+def synthetic_photo(size, seed):
+    # Gradient plus sensor-like noise; flat fills compress unrealistically well.
+    base = Image.radial_gradient("L").resize(size)
+    noise = Image.effect_noise(size, 24 + seed * 8)
+    return Image.merge("RGB", (base, Image.blend(base, noise, 0.3), noise))
+
+
+def photo_set():
+    photos = []
+    for rel in REPO_IMAGES:
+        with Image.open(os.path.join(ROOT, rel)) as img:
+            photos.append((os.path.basename(rel), img.convert("RGB")))
+    for n, size in enumerate([(2048, 1365), (1365, 2048)]):
+        photos.append((f"synthetic {size[0]}x{size[1]}", synthetic_photo(size, n)))
+    return photos
+
+
+def timed(fn, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return result, (time.perf_counter() - t0) / repeat * 1000
+
+
+def legacy_png(img):
+    buf = io.BytesIO()
+    img.save(buf, "PNG", quality=95)
+    return buf.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--max-kb", type=int, default=300)
+    args = parser.parse_args()
+    max_bytes = args.max_kb * 1024
+
+    print(f"{'photo':<24} {'old png':>12} | {'png':>12} {'jpeg':>12} {'webp':>12} | "
+          f"{'jpeg@max':>10} {'webp@max':>10}")
+    for name, img in photo_set():
+        out = app.add_left_strip(app.resize_long_edge(img, app.MAX_W), LABEL)
+        old, old_ms = timed(lambda: legacy_png(out), args.repeat)
+        cells = []
+        for fmt in ("png", "jpeg", "webp"):
+            (data, _), ms = timed(lambda: encode_image(out, fmt), args.repeat)
+            cells.append(f"{len(data) // 1024:>5}K {ms:>5.0f}ms")
+        fits = []
+        for fmt in ("jpeg", "webp"):
+            data, quality = encode_image(out, fmt, max_bytes=max_bytes)
+            fits.append(f"q{quality:<3} {len(data) // 1024:>4}K")
+        print(f"{name[:24]:<24} {len(old) // 1024:>5}K {old_ms:>5.0f}ms | {' '.join(cells)} | "
+              f"{fits[0]:>10} {fits[1]:>10}")
+
+
+if __name__ == "__main__":
+    main()
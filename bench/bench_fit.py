@@ -0,0 +1,94 @@
+"""Micro-benchmark: fit_text_to_box (binary search) vs the old 2px linear descent.
+
+    python bench/bench_fit.py [--repeat 20]
+
+For each photo width the banner geometry matches add_left_banner's defaults.
+"sizes tried" counts load_font calls, i.e. candidate sizes laid out; "overflow"
+is set when a returned line is wider than the text box.
+"""
+import argparse
+import textwrap
+import time
+
+from PIL import Image, ImageDraw
+
+from common import load_app
+
+app = load_app("generate")
+
+LABELS = [
+    "PRICE DROP",
+    "1/0 BUY DOWN STARTING @ 3.99%",
+    "BUILDER INCENTIVE: $15,000 TOWARDS CLOSING COSTS OR RATE BUY DOWN ON ALL QUICK MOVE-IN HOMES",
+]
+PHOTO_WIDTHS = [1024, 2048, 4000, 6000]
+
+
+def legacy_fit_text_to_box(draw, text, font_path_size, box_w, box_h, line_spacing=1.0):
+    """fit_text_to_box as it was before the solver, kept here for comparison."""
+    size = font_path_size
+    while size >= 10:
+        font = app.load_font(size)
+        max_chars = max(1, int(box_w / (size * 0.55)))
+        wrapped = []
+        for raw in text.split("\n"):
+            wrapped.extend(textwrap.wrap(raw.strip(), width=max_chars) or [""])
+        total_h = 0
+        for line in wrapped:
+            w, h = draw.textbbox((0, 0), line, font=font)[2:]
+            total_h += h
+            total_h += int(h * (line_spacing - 1))
+        if total_h <= box_h:
+            return font, wrapped
+        size -= 2
+    return app.load_font(10), textwrap.wrap(text, width=max(1, int(box_w / 6))) or [""]
+
+
+def run(fit, draw, label, photo_w, repeat):
+    photo_h = photo_w * 2 // 3
+    banner_w = max(40, int(photo_w * 0.22))
+    pad = int(banner_w * 0.06)
+    box_w, box_h = banner_w - 2 * pad, photo_h - 2 * pad
+
+    calls = 0
+    real_load_font = app.load_font
+
+    def counting_load_font(*args, **kwargs):
+        nonlocal calls
+        calls += 1
+        return real_load_font(*args, **kwargs)
+
+    app.load_font = counting_load_font
+    try:
+        fit(draw, label, int(banner_w * 0.28), box_w, box_h, 1.05)  # warm the font cache
+        calls = 0
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            font, lines = fit(draw, label, int(banner_w * 0.28), box_w, box_h, 1.05)
+        elapsed = (time.perf_counter() - t0) / repeat
+    finally:
+        app.load_font = real_load_font
+    overflow = any(font.getlength(line) > box_w for line in lines)
+    return {"size": font.size, "lines": len(lines), "tried": calls // repeat,
+            "ms": elapsed * 1000, "overflow": overflow}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    draw = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+    print(f"{'photo w':>7} {'label':<12} | {'old size':>8} {'tried':>5} {'ms':>7} {'ovf':>3}"
+          f" | {'new size':>8} {'tried':>5} {'ms':>7} {'ovf':>3}")
+    for photo_w in PHOTO_WIDTHS:
+        for label in LABELS:
+            old = run(legacy_fit_text_to_box, draw, label, photo_w, args.repeat)
+            new = run(app.fit_text_to_box, draw, label, photo_w, args.repeat)
+            print(f"{photo_w:>7} {label[:12]:<12} | {old['size']:>8} {old['tried']:>5} {old['ms']:>7.2f}"
+                  f" {'yes' if old['overflow'] else 'no':>3} | {new['size']:>8} {new['tried']:>5}"
+                  f" {new['ms']:>7.2f} {'yes' if new['overflow'] else 'no':>3}")
+
+
+if __name__ == "__main__":
+    main()
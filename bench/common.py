@@ -0,0 +1,13 @@
+"""Shared helpers for the scripts in bench/.
+
+The apps are loaded with bannerkit.apps.load_app, which imports them from the
+repo root so they find `fonts/`, `static/` and `outputs/` the same way they do
+under uvicorn.
+"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)  # bench scripts run as `python bench/<script>.py`
+
+from bannerkit.apps import APP_PATHS, load_app
@@ -0,0 +1,422 @@
+"""Render pipeline benchmark suite: latency, throughput and peak RSS as JSON.
+
+    python bench/run.py [--scenarios ...] [--megapixels 2 12] [--repeat 2] [--concurrency 8]
+                        [--pool process] [--out results.json]
+    python bench/run.py --compare before.json after.json
+
+A synthetic photo corpus (megapixels x aspect ratio x JPEG/PNG, each with a
+short and a very long label) is generated once from a fixed seed, so runs on
+different commits see identical inputs. Every scenario then runs in a fresh
+process: the compositing functions and fit_text_to_box are called directly on
+the decoded photos, and /generate and /make_banner are driven through the
+ASGI apps in-process (startup hooks included, render cache emptied between
+passes). The load_* scenarios keep --concurrency requests in flight while a
+probe task measures how late the event loop wakes up ("loop lag").
+
+Peak RSS is the high-water mark of the benchmark process plus any render pool
+workers, reset after warm-up (Linux only). Latencies are per call/request.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+from PIL import Image, ImageDraw
+
+from common import ROOT, load_app
+
+MEGAPIXELS = (2, 12, 24)
+ASPECTS = {"3:2": (3, 2), "2:3": (2, 3), "4:3": (4, 3), "16:9": (16, 9)}
+FORMATS = ("jpeg", "png")
+LABELS = {
+    "short": "PRICE DROP",
+    "long": "BUILDER INCENTIVE: $15,000 TOWARDS CLOSING COSTS OR RATE BUY DOWN ON ALL QUICK MOVE-IN HOMES",
+}
+SEED = 1234
+LAG_INTERVAL = 0.005  # seconds between event loop probes
+
+
+# --- Corpus ---
+
+def photo_size(mp, aspect):
+    aw, ah = ASPECTS[aspect]
+    unit = (mp * 1_000_000 / (aw * ah)) ** 0.5
+    return int(aw * unit), int(ah * unit)
+
+
+def synthetic_photo(size, seed):
+    # Gradients plus seeded noise: flat fills would compress and resample unrealistically well.
+    rng = random.Random(seed)
+    small = (max(1, size[0] // 4), max(1, size[1] // 4))
+    noise = Image.frombytes("L", small, rng.randbytes(small[0] * small[1])).resize(size, Image.BILINEAR)
+    radial = Image.radial_gradient("L").resize(size)
+    linear = Image.linear_gradient("L").resize(size)
+    return Image.merge("RGB", (radial, Image.blend(linear, noise, 0.3), Image.blend(radial, noise, 0.5)))
+
+
+def build_corpus(directory, megapixels):
+    """Write the photos under directory -> list of case dicts (one per photo and label)."""
+    cases = []
+    for mp in megapixels:
+        for aspect in ASPECTS:
+            img = synthetic_photo(photo_size(mp, aspect), SEED + mp * 100 + len(cases))
+            for fmt in FORMATS:
+                name = f"{mp}mp-{aspect.replace(':', 'x')}.{'jpg' if fmt == 'jpeg' else 'png'}"
+                path = os.path.join(directory, name)
+                img.save(path, "JPEG", quality=90) if fmt == "jpeg" else img.save(path, "PNG")
+                for label_kind, label in LABELS.items():
+                    cases.append({"photo": name, "path": path, "megapixels": mp, "aspect": aspect,
+                                  "format": fmt, "label_kind": label_kind, "label": label})
+    return cases
+
+
+# --- In-process ASGI client ---
+
+def multipart(fields: dict, files: dict):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content) in files.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: application/octet-stream\r\n\r\n'.encode() + content + b"\r\n")
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+async def asgi_post(app, path, fields, files):
+    """POST a multipart form straight into the ASGI app -> (status, seconds until the last body byte)."""
+    body, content_type = multipart(fields, files)
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+             "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+             "headers": [(b"host", b"bench"), (b"content-type", content_type.encode()),
+                         (b"content-length", str(len(body)).encode())],
+             "client": ("127.0.0.1", 0), "server": ("bench", 80)}
+    done = asyncio.Event()
+    sent = False
+    status, elapsed = None, None
+    t0 = time.perf_counter()
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status, elapsed
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body" and not message.get("more_body"):
+            elapsed = time.perf_counter() - t0  # background tasks run after this
+            done.set()
+
+    await app(scope, receive, send)
+    return status, elapsed
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    """Run the app's startup hooks on entry and its shutdown hooks on exit."""
+    inbox, outbox = asyncio.Queue(), asyncio.Queue()
+    task = asyncio.create_task(app({"type": "lifespan", "asgi": {"version": "3.0"}}, inbox.get, outbox.put))
+    await inbox.put({"type": "lifespan.startup"})
+    message = await outbox.get()
+    if message["type"] != "lifespan.startup.complete":
+        raise RuntimeError(message.get("message", "startup failed"))
+    try:
+        yield
+    finally:
+        await inbox.put({"type": "lifespan.shutdown"})
+        await outbox.get()
+        await task
+
+
+async def probe_loop_lag(lags, stop):
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        await asyncio.sleep(LAG_INTERVAL)
+        lags.append(time.perf_counter() - t0 - LAG_INTERVAL)
+
+
+# --- Measurement ---
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered)) - 1))]
+
+
+def summarize_ms(seconds):
+    if not seconds:
+        return None
+    ms = [s * 1000 for s in seconds]
+    return {"mean": round(sum(ms) / len(ms), 2), "p50": round(percentile(ms, 50), 2),
+            "p95": round(percentile(ms, 95), 2), "p99": round(percentile(ms, 99), 2), "max": round(max(ms), 2)}
+
+
+def pool_pids(app):
+    executor = app.render_pool.executor
+    return list(getattr(executor, "_processes", None) or {})
+
+
+def reset_peak_rss(pids):
+    for pid in pids:
+        with contextlib.suppress(OSError), open(f"/proc/{pid}/clear_refs", "w") as f:
+            f.write("5")
+
+
+def peak_rss_mb(pids):
+    total = 0
+    for pid in pids:
+        with contextlib.suppress(OSError), open(f"/proc/{pid}/status") as f:
+            total += next((int(line.split()[1]) for line in f if line.startswith("VmHWM:")), 0)
+    return round(total / 1024, 1) if total else None
+
+
+def clear_outputs(directory):
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+# --- Scenarios ---
+
+def decoded(app, cases):
+    """Each photo decoded as the endpoints would (long edge 2048), keyed by file name."""
+    photos = {}
+    for case in cases:
+        if case["photo"] not in photos:
+            with open(case["path"], "rb") as f:
+                photos[case["photo"]] = app.decode_image(f.read(), 2048, "RGB")[0]
+    return photos
+
+
+def fit_args(app, img, label):
+    # add_left_banner's default geometry for this photo.
+    banner_w = max(40, int(img.width * 0.22))
+    pad = int(banner_w * 0.06)
+    draw = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+    return draw, label, int(banner_w * 0.28), banner_w - 2 * pad, img.height - 2 * pad, 1.05
+
+
+FUNCTIONS = {
+    "fit_text_to_box": ("generate", lambda app, img, label: app.fit_text_to_box(*fit_args(app, img, label))),
+    "add_left_banner": ("generate", lambda app, img, label: app.add_left_banner(img, label)),
+    "add_left_strip": ("banner_bot", lambda app, img, label: app.add_left_strip(img, label)),
+    "add_bottom_ribbon": ("banner_bot", lambda app, img, label: app.add_bottom_ribbon(img, label)),
+}
+
+
+def run_function(name, cases, args):
+    app_name, fn = FUNCTIONS[name]
+    app = load_app(app_name)
+    photos = decoded(app, cases)
+    first = cases[0]
+    fn(app, photos[first["photo"]].copy(), first["label"])  # fonts, layer cache
+    reset_peak_rss(["self"])
+    times = []
+    t_start = time.perf_counter()
+    for _ in range(args.repeat):
+        for case in cases:
+            img = photos[case["photo"]].copy()  # the banner is drawn in place
+            t0 = time.perf_counter()
+            fn(app, img, case["label"])
+            times.append(time.perf_counter() - t0)
+    wall = time.perf_counter() - t_start  # includes the copies, so throughput uses the summed call times
+    return {"app": app_name, "calls": len(times), "errors": 0, "wall_s": round(wall, 2),
+            "throughput_per_s": round(len(times) / sum(times), 2), "latency_ms": summarize_ms(times),
+            "peak_rss_mb": peak_rss_mb(["self"])}
+
+
+def endpoint_request(name, case, n):
+    if name == "generate":
+        return "/generate", {"text": case["label"]}, {"photo": (case["photo"], case["content"])}
+    style = "left_strip" if n % 2 == 0 else "bottom_ribbon"
+    return "/make_banner", {"text": case["label"], "style": style}, {"file": (case["photo"], case["content"])}
+
+
+ENDPOINTS = {"generate": "generate", "make_banner": "banner_bot",
+             "load_generate": "generate", "load_make_banner": "banner_bot"}
+
+
+async def drive_endpoint(name, app, cases, concurrency, repeat, output_dir):
+    endpoint = name.removeprefix("load_")
+    times, errors = [], 0
+    lags, stop = [], asyncio.Event()
+    async with lifespan(app.app):
+        path, fields, files = endpoint_request(endpoint, cases[0], 0)
+        await asyncio.gather(*(asgi_post(app.app, path, fields, files) for _ in range(concurrency)))  # warm workers
+        clear_outputs(output_dir)
+        pids = ["self"] + pool_pids(app)
+        reset_peak_rss(pids)
+        probe = asyncio.create_task(probe_loop_lag(lags, stop))
+        t_start = time.perf_counter()
+        for _ in range(repeat):
+            queue = list(enumerate(cases))
+
+            async def client():
+                nonlocal errors
+                while queue:
+                    n, case = queue.pop(0)
+                    status, elapsed = await asgi_post(app.app, *endpoint_request(endpoint, case, n))
+                    if status == 200:
+                        times.append(elapsed)
+                    else:
+                        errors += 1
+
+            await asyncio.gather(*(client() for _ in range(concurrency)))
+            clear_outputs(output_dir)  # every pass renders from scratch
+        wall = time.perf_counter() - t_start
+        stop.set()
+        await probe
+        rss = peak_rss_mb(pids)
+    return {"app": ENDPOINTS[name], "concurrency": concurrency, "requests": len(times) + errors, "errors": errors,
+            "wall_s": round(wall, 2), "throughput_per_s": round(len(times) / wall, 2),
+            "latency_ms": summarize_ms(times), "loop_lag_ms": summarize_ms(lags), "peak_rss_mb": rss}
+
+
+def run_endpoint(name, cases, args):
+    output_dir = os.path.join(args.workdir, "outputs")
+    os.makedirs(output_dir, exist_ok=True)
+    os.environ.update(OUTPUT_DIR=output_dir, JOB_DIR=os.path.join(args.workdir, "jobs"), RENDER_POOL=args.pool,
+                      RATE_LIMIT_MP_PER_MIN="0", RATE_LIMIT_CONCURRENT="0",  # measure renders, not the limiter
+                      DECODE_CACHE_MB="0")  # or the decoded-photo cache: every pass decodes
+    if args.workers:
+        os.environ["RENDER_WORKERS"] = str(args.workers)
+    app = load_app(ENDPOINTS[name])
+    for case in cases:
+        with open(case["path"], "rb") as f:
+            case["content"] = f.read()
+    concurrency = args.concurrency if name.startswith("load_") else 1
+    return asyncio.run(drive_endpoint(name, app, cases, concurrency, args.repeat, output_dir))
+
+
+SCENARIOS = list(FUNCTIONS) + list(ENDPOINTS)
+
+
+def _scenario(name, cases, args, conn):
+    os.chdir(ROOT)
+    # Pool workers have to inherit the apps: load_app's module names aren't importable.
+    multiprocessing.set_start_method("fork", force=True)
+    runner = run_function if name in FUNCTIONS else run_endpoint
+    conn.send(runner(name, cases, args))
+    conn.close()
+
+
+def run_scenario(name, cases, args):
+    parent, child = multiprocessing.Pipe()
+    proc = multiprocessing.get_context("spawn").Process(target=_scenario, args=(name, cases, args, child))
+    proc.start()
+    child.close()  # so recv() sees EOF if the scenario process dies
+    try:
+        result = parent.recv()
+    except EOFError:
+        raise RuntimeError(f"{name} failed (exit code {proc.join() or proc.exitcode})")
+    proc.join()
+    return result
+
+
+# --- Report ---
+
+def environment(args):
+    def git(*cmd):
+        try:
+            return subprocess.run(["git", *cmd], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    return {"commit": git("rev-parse", "--short", "HEAD"), "dirty": bool(git("status", "--porcelain", "--", "*.py")),
+            "python": platform.python_version(), "pillow": Image.__version__, "cpus": os.cpu_count(),
+            "pool": args.pool, "workers": args.workers, "megapixels": args.megapixels, "repeat": args.repeat,
+            "concurrency": args.concurrency, "seed": SEED}
+
+
+METRICS = [("throughput_per_s", "thru/s"), ("latency_ms.p50", "p50 ms"), ("latency_ms.p95", "p95 ms"),
+           ("latency_ms.p99", "p99 ms"), ("loop_lag_ms.max", "lag max"), ("peak_rss_mb", "RSS MB")]
+
+
+def metric(result, path):
+    for key in path.split("."):
+        result = (result or {}).get(key)
+    return result
+
+
+def print_summary(results, out=sys.stderr):
+    print(f"{'scenario':<18} " + " ".join(f"{label:>9}" for _, label in METRICS), file=out)
+    for name, result in results.items():
+        cells = [metric(result, path) for path, _ in METRICS]
+        print(f"{name:<18} " + " ".join(f"{'-' if v is None else v:>9}" for v in cells), file=out)
+
+
+def compare(before_path, after_path):
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    print(f"{before['env']['commit']} -> {after['env']['commit']}")
+    print(f"{'scenario':<18} " + " ".join(f"{label:>16}" for _, label in METRICS))
+    for name in after["scenarios"]:
+        if name not in before["scenarios"]:
+            continue
+        cells = []
+        for path, _ in METRICS:
+            old, new = metric(before["scenarios"][name], path), metric(after["scenarios"][name], path)
+            if old is None or new is None or not old:
+                cells.append(f"{'-':>16}")
+                continue
+            change = (new - old) / old * 100
+            cells.append(f"{new:>8} {change:>+6.1f}%")
+        print(f"{name:<18} " + " ".join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+", default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument("--megapixels", type=int, nargs="+", default=[2, 12], choices=MEGAPIXELS)
+    parser.add_argument("--repeat", type=int, default=2, help="passes over the corpus per scenario")
+    parser.add_argument("--concurrency", type=int, default=8, help="requests in flight for load_* scenarios")
+    parser.add_argument("--pool", default="process", choices=["process", "thread"], help="RENDER_POOL")
+    parser.add_argument("--workers", type=int, default=None, help="RENDER_WORKERS (default: the apps' own)")
+    parser.add_argument("--out", help="write the JSON here instead of stdout")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="diff two result files")
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    with tempfile.TemporaryDirectory(prefix="banner-bench-") as workdir:
+        args.workdir = workdir
+        corpus_dir = os.path.join(workdir, "corpus")
+        os.makedirs(corpus_dir)
+        cases = build_corpus(corpus_dir, args.megapixels)
+        print(f"corpus: {len(cases)} cases ({len(cases) // len(LABELS)} photos)", file=sys.stderr)
+        results = {}
+        for name in args.scenarios:
+            print(f"running {name} ...", file=sys.stderr)
+            results[name] = run_scenario(name, cases, args)
+            shutil.rmtree(os.path.join(workdir, "outputs"), ignore_errors=True)
+            shutil.rmtree(os.path.join(workdir, "jobs"), ignore_errors=True)
+    print_summary(results)
+    report = json.dumps({"env": environment(args), "cases": len(cases), "scenarios": results}, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
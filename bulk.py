@@ -0,0 +1,165 @@
+"""Offline bulk rendering: banner every photo in a directory or CSV manifest on all cores.
+
+    python bulk.py make_banner PHOTOS --out DIR [--preset 1] [--brand coventry] [--text ...] [--format jpeg]
+    python bulk.py generate PHOTOS --out DIR [--text 'PRICE DROP'] [--color-preset gold] [--badge-text NEW]
+
+PHOTOS is a directory (searched recursively) or a CSV manifest with a `photo`
+column (paths relative to the CSV); any other columns named like the form
+fields (preset, brand, text, ... / color_preset, badge_text, ...) override the
+command-line options for that row. Rendering uses the apps' own decode,
+compose and encode functions.
+
+Outputs mirror the input tree as `<name>-<key><ext>`, where key is the render
+cache key (photo bytes + resolved settings), so a rerun skips every photo
+already rendered with the same settings. Progress goes to stderr about once a
+second and the summary gives images/second.
+"""
+import argparse
+import csv
+import multiprocessing
+import os
+import sys
+import time
+
+import bannerkit.apps
+
+APP_NAMES = {"generate": "generate", "make_banner": "banner_bot"}  # subcommand -> bannerkit.apps name
+FIELDS = {
+    "generate": ("text", "width_pct", "opacity", "bg_rgba", "text_rgba", "color_preset", "badge_text",
+                 "badge_corner", "format", "quality", "max_bytes"),
+    "make_banner": ("preset", "text", "style", "brand", "max_px", "format", "quality", "max_bytes"),
+}
+PHOTO_EXTS = {".jpg", ".jpeg", ".png", ".webp", ".tif", ".tiff", ".bmp", ".gif"}
+PROGRESS_INTERVAL = 1.0  # seconds
+
+_app = None  # the app module, loaded once per process
+
+
+def load_app(name: str):
+    """The app behind a subcommand, loaded once per process."""
+    global _app
+    if _app is None:
+        _app = bannerkit.apps.load_app(APP_NAMES[name])
+    return _app
+
+
+def _int(value):
+    return int(value) if str(value or "").strip() else None
+
+
+def resolve(name: str, fields: dict) -> dict:
+    """Form-style fields -> the app's resolved render settings; ValueError if they don't make sense."""
+    app = load_app(name)
+    if name == "generate":
+        return app.resolve_generate_params(enable_badge="on" if fields.get("badge_text") else "off", **fields)
+    spec = app.resolve_spec(_int(fields.get("preset")) or 0, fields.get("text", ""), fields.get("style") or "auto",
+                            fields.get("brand", ""), _int(fields.get("max_px")), fields.get("format", ""),
+                            _int(fields.get("quality")), _int(fields.get("max_bytes")))
+    if spec["style"] not in app.STYLES:
+        raise ValueError(f"unknown style {spec['style']!r}")
+    return spec
+
+
+def find_photos(source: str, out_dir: str):
+    """(photo path, output path without suffix, CSV overrides) for every photo under source."""
+    if os.path.isfile(source):
+        base = os.path.dirname(os.path.abspath(source))
+        with open(source, newline="") as f:
+            for row in csv.DictReader(f):
+                photo = row.pop("photo", "").strip()
+                if photo:
+                    yield (os.path.join(base, photo), os.path.join(out_dir, os.path.splitext(photo)[0]),
+                           {k: v for k, v in row.items() if v not in (None, "")})
+        return
+    out_dir_abs = os.path.abspath(out_dir)
+    for dirpath, dirnames, filenames in os.walk(source):
+        dirnames[:] = sorted(d for d in dirnames if os.path.abspath(os.path.join(dirpath, d)) != out_dir_abs)
+        for filename in sorted(filenames):
+            stem, ext = os.path.splitext(filename)
+            if ext.lower() in PHOTO_EXTS:
+                rel = os.path.relpath(os.path.join(dirpath, stem), source)
+                yield os.path.join(dirpath, filename), os.path.join(out_dir, rel), {}
+
+
+def init_worker(name: str):
+    app = load_app(name)
+    app.init_render_worker(app.layers.counts)  # preset layers, as in the server's render pool
+
+
+def render_one(task):
+    """Render one photo unless its output exists -> (photo, output path, status, error, ms)."""
+    name, photo, out_base, params = task
+    app = _app
+    t0 = time.perf_counter()
+    try:
+        with open(photo, "rb") as f:
+            raw = f.read()
+        out_path = f"{out_base}-{app.render_key(raw, params)[:16]}{app.OUTPUT_FORMATS[params['format']][1]}"
+        if os.path.exists(out_path):
+            return photo, out_path, "skipped", None, 0.0
+        render = app.render_generate if name == "generate" else app.render_make_banner
+        data = render(raw, params)[0]
+        os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+        tmp = f"{out_path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, out_path)  # an interrupted run never leaves a half-written output behind
+    except Exception as e:
+        return photo, None, "failed", str(e) or type(e).__name__, 0.0
+    return photo, out_path, "rendered", None, (time.perf_counter() - t0) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="app", required=True)
+    for name in FIELDS:
+        p = sub.add_parser(name, help=f"render like /{name}")
+        p.add_argument("photos", help="directory of photos, or a CSV manifest with a `photo` column")
+        p.add_argument("--out", required=True, help="output directory")
+        p.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+        for field in FIELDS[name]:
+            p.add_argument("--" + field.replace("_", "-"), dest=field,
+                           default="1" if field == "preset" else "", help=f"default `{field}` form field")
+    args = parser.parse_args()
+
+    defaults = {field: getattr(args, field) for field in FIELDS[args.app] if getattr(args, field) != ""}
+    tasks, failed = [], 0
+    for photo, out_base, overrides in find_photos(args.photos, args.out):
+        fields = {**defaults, **{k: v for k, v in overrides.items() if k in FIELDS[args.app]}}
+        try:
+            tasks.append((args.app, photo, out_base, resolve(args.app, fields)))
+        except (ValueError, TypeError) as e:
+            failed += 1
+            print(f"failed: {photo}: {e}", file=sys.stderr)
+
+    total = len(tasks) + failed
+    counts = {"rendered": 0, "skipped": 0, "failed": failed}
+    render_ms = 0.0
+    workers = max(1, min(args.workers, len(tasks) or 1))
+    end = "\r" if sys.stderr.isatty() else "\n"
+    t0 = last = time.perf_counter()
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(args.app,)) as pool:
+        for photo, _, status, error, ms in pool.imap_unordered(render_one, tasks):
+            counts[status] += 1
+            render_ms += ms
+            if error:
+                print(f"\nfailed: {photo}: {error}" if end == "\r" else f"failed: {photo}: {error}", file=sys.stderr)
+            now = time.perf_counter()
+            if now - last >= PROGRESS_INTERVAL:
+                last = now
+                done = sum(counts.values())
+                print(f"{done}/{total}  rendered {counts['rendered']}  skipped {counts['skipped']}  "
+                      f"failed {counts['failed']}  {counts['rendered'] / (now - t0):.2f} images/s",
+                      end=end, file=sys.stderr, flush=True)
+    elapsed = time.perf_counter() - t0
+    if end == "\r":
+        print(file=sys.stderr)
+    rate = counts["rendered"] / elapsed if elapsed else 0.0
+    per_image = render_ms / counts["rendered"] if counts["rendered"] else 0.0
+    print(f"{total} photos: rendered {counts['rendered']}, skipped {counts['skipped']}, failed {counts['failed']} "
+          f"in {elapsed:.1f}s with {workers} workers: {rate:.2f} images/s ({per_image:.0f} ms per image per worker)")
+    sys.exit(1 if counts["failed"] else 0)
+
+
+if __name__ == "__main__":
+    main()
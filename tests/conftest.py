@@ -0,0 +1,50 @@
+"""Both apps, loaded once per test session with their outputs and jobs in a temp directory.
+
+The settings are read when an app is imported, so they're set here before
+anything loads; renders run in a thread pool to keep the tests in one process.
+"""
+import io
+import os
+import sys
+import tempfile
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.update(OUTPUT_DIR=tempfile.mkdtemp(prefix="banner-tests-"), RENDER_POOL="thread", RENDER_WORKERS="2")
+for name in ("API_KEY", "INVITE_CODE", "JOB_DIR", "OUTPUT_STORE", "TRUSTED_PROXIES"):
+    os.environ.pop(name, None)
+
+from bannerkit.apps import load_app
+
+
+def jpeg(size=(300, 200), shade=0) -> bytes:
+    """A small gradient JPEG; a different shade makes different upload bytes."""
+    buf = io.BytesIO()
+    Image.radial_gradient("L").resize(size).point(lambda v: (v + shade) % 256).convert("RGB").save(buf, "JPEG")
+    return buf.getvalue()
+
+
+@pytest.fixture(scope="session")
+def generate_app():
+    return load_app("generate")
+
+
+@pytest.fixture(scope="session")
+def bot_app():
+    return load_app("banner_bot")
+
+
+@pytest.fixture(scope="module")
+def generate_client(generate_app):
+    with TestClient(generate_app.app) as client:
+        yield client
+
+
+@pytest.fixture(scope="module")
+def bot_client(bot_app):
+    with TestClient(bot_app.app) as client:
+        yield client
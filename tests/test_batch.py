@@ -0,0 +1,79 @@
+"""/generate_batch and /make_banners: spec validation, the render-queue bound and ZIP output."""
+import io
+import json
+import zipfile
+
+import pytest
+
+from conftest import jpeg
+
+
+def photos(field: str, count: int, shade: int = 0) -> list:
+    return [(field, (f"photo-{i}.jpg", jpeg(shade=shade + i), "image/jpeg")) for i in range(count)]
+
+
+@pytest.mark.parametrize("specs", ['[{"text": ["SALE"]}]', '[{"text": null}]', '[{"color_preset": {}}]',
+                                   '{"text": "SALE"}', '[1]', '"SALE"', '[{"no_such_field": "1"}]', "not json"])
+def test_generate_batch_refuses_malformed_specs_with_400(generate_client, specs):
+    response = generate_client.post("/generate_batch", files=photos("photos", 1), data={"specs": specs})
+    assert response.status_code == 400
+    assert "specs" in response.json()["error"]
+
+
+def test_generate_batch_takes_numbers_for_fields(generate_client):
+    response = generate_client.post("/generate_batch", files=photos("photos", 1),
+                                    data={"specs": '[{"text": 5, "width_pct": 30}]'})
+    assert response.status_code == 200
+    assert response.json()["photos"][0]["outputs"][0]["spec"]["message"] == "5"
+
+
+def test_make_banners_refuses_malformed_specs_with_400(bot_client):
+    response = bot_client.post("/make_banners", files=photos("files", 1), data={"specs": '[{"text": 5}]'})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("client_name, path, field", [("generate_client", "/generate_batch", "photos"),
+                                                      ("bot_client", "/make_banners", "files")])
+def test_batches_are_bounded_by_the_render_queue(request, monkeypatch, client_name, path, field):
+    client = request.getfixturevalue(client_name)
+    app = request.getfixturevalue("generate_app" if client_name == "generate_client" else "bot_app")
+    monkeypatch.setattr(app.render_pool, "queue_limit", 4)
+    specs = json.dumps([{"text": "A"}, {"text": "B"}] if field == "photos" else [{"preset": 1}, {"preset": 2}])
+    response = client.post(path, files=photos(field, 3), data={"specs": specs})  # 6 renders
+    assert response.status_code == 413
+    assert "Batch too large" in response.json()["error"]
+    monkeypatch.setattr(app.render_pool, "in_flight", 3)  # 2 renders fit the limit, not the queue right now
+    response = client.post(path, files=photos(field, 1), data={"specs": specs})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"]
+
+
+def test_generate_batch_zip_holds_every_output_and_the_manifest(generate_client):
+    response = generate_client.post("/generate_batch", files=photos("photos", 2, shade=60), data={"format": "zip"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/zip"
+    assert int(response.headers["content-length"]) == len(response.content)
+    with zipfile.ZipFile(io.BytesIO(response.content)) as zf:
+        names = zf.namelist()
+        manifest = json.loads(zf.read("manifest.json"))
+    outputs = [entry for photo in manifest["photos"] for entry in photo["outputs"]]
+    assert len(names) == len(outputs) + 1
+    assert len(outputs) == 2 * len(manifest["photos"][0]["outputs"])
+
+
+def test_make_banners_zip(bot_client):
+    response = bot_client.post("/make_banners", files=photos("files", 1, shade=70),
+                               data={"specs": '[{"preset": 1}, {"preset": 2}]'}, headers={"Accept": "application/zip"})
+    assert response.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(response.content)) as zf:
+        assert sorted(zf.namelist()) == ["01-photo-0/01-left_strip.png", "01-photo-0/02-bottom_ribbon.png",
+                                         "manifest.json"]
+
+
+def test_make_banners_repeat_reports_the_cached_outputs_sizes(bot_client):
+    data = {"specs": '[{"preset": 1}, {"preset": 2}]', "max_px": 240}
+    first, again = (bot_client.post("/make_banners", files=photos("files", 1, shade=80), data=data).json()
+                    for _ in range(2))
+    sizes = lambda manifest: [(o["width"], o["height"]) for o in manifest["photos"][0]["outputs"]]
+    assert [o["cached"] for o in again["photos"][0]["outputs"]] == [True, True]
+    assert sizes(again) == sizes(first) == [(240, 160), (240, 160)]
@@ -0,0 +1,49 @@
+"""Re-rendering by photo_hash from bannerkit.decoded.DecodedCache, including at another max_px."""
+from PIL import Image
+
+from bannerkit.decoded import DecodedCache
+from conftest import jpeg
+
+
+def entry(cache, photo_id, long_edge, source):
+    img = Image.new("RGB", (min(long_edge, source[0]), min(long_edge, source[1])))
+    cache.put(photo_id, long_edge, img, None, {"source": source, "decoded": img.size})
+    return img
+
+
+def test_find_prefers_the_exact_size_then_the_smallest_larger_copy():
+    cache = DecodedCache(64 * 1024 * 1024)
+    at_512 = entry(cache, "a", 512, (4000, 4000))
+    at_2048 = entry(cache, "a", 2048, (4000, 4000))
+    at_1024 = entry(cache, "a", 1024, (4000, 4000))
+    assert cache.find("a", 2048)[0] is at_2048
+    assert cache.find("a", 800)[0] is at_1024
+    assert cache.find("a", 4096) is None  # only reduced copies, all smaller
+    assert cache.find("a", 256)[0] is at_512
+    assert cache.long_edges("a") == [512, 1024, 2048]
+
+
+def test_find_uses_an_unreduced_copy_at_any_size():
+    cache = DecodedCache(64 * 1024 * 1024)
+    full = entry(cache, "small", 1024, (300, 200))
+    assert cache.find("small", 4096)[0] is full
+
+
+def post(client, **data):
+    return client.post("/make_banner", data={"preset": 1, **data})
+
+
+def test_photo_hash_at_a_smaller_max_px_reduces_the_kept_copy(bot_client):
+    first = bot_client.post("/make_banner", files={"file": ("p.jpg", jpeg((900, 600), shade=71), "image/jpeg")},
+                            data={"preset": 1, "max_px": 600, "format": "jpeg"})
+    assert first.status_code == 200 and first.json()["width"] == 600
+    photo_hash = first.json()["photo_hash"]
+
+    smaller = post(bot_client, photo_hash=photo_hash, max_px=300, format="jpeg")
+    assert smaller.status_code == 200
+    assert (smaller.json()["width"], smaller.json()["height"]) == (300, 200)
+    assert smaller.json()["decode"]["decode_ms"] == 0
+
+    larger = post(bot_client, photo_hash=photo_hash, max_px=800, format="jpeg")
+    assert larger.status_code == 404
+    assert "600" in larger.json()["error"] and "800" in larger.json()["error"]
@@ -0,0 +1,78 @@
+"""fit_text_to_box against a 1px linear descent with real advances, and against the old 2px descent."""
+import textwrap
+
+import pytest
+from PIL import Image, ImageDraw
+
+LABELS = [
+    "PRICE DROP",
+    "1/0 BUY DOWN STARTING @ 3.99%",
+    "BUILDER INCENTIVE: $15,000 TOWARDS CLOSING COSTS OR RATE BUY DOWN ON ALL QUICK MOVE-IN HOMES",
+]
+BOXES = [(w, h) for w in range(60, 150, 10) for h in range(200, 650, 50)]  # 81 text boxes
+START = 48
+
+
+@pytest.fixture(scope="module")
+def draw():
+    return ImageDraw.Draw(Image.new("RGB", (1, 1)))
+
+
+def lines_height(draw, font, lines, line_spacing):
+    heights = [draw.textbbox((0, 0), line, font=font)[3] for line in lines]
+    return sum(h + int(h * (line_spacing - 1)) for h in heights)
+
+
+def largest_fit(app, draw, text, start, box_w, box_h, line_spacing):
+    """Every size from start down, greedy-wrapped with real advances: the best fit there is."""
+    paragraphs = [raw.strip().split() for raw in text.split("\n")]
+    for size in range(start, 9, -1):
+        font = app.load_font(size)
+        lines = []
+        for words in paragraphs:
+            line = []
+            for word in words:
+                if line and font.getlength(" ".join(line + [word])) > box_w:
+                    lines.append(" ".join(line))
+                    line = []
+                line.append(word)
+            lines.append(" ".join(line))
+        if all(font.getlength(line) <= box_w for line in lines) and \
+                lines_height(draw, font, lines, line_spacing) <= box_h:
+            return size
+    return 10
+
+
+def legacy_fit(app, draw, text, start, box_w, box_h, line_spacing):
+    """The 2px descent fit_text_to_box replaced, with its char-width wrap guess -> (size, lines)."""
+    for size in range(start, 9, -2):
+        font = app.load_font(size)
+        max_chars = max(1, int(box_w / (size * 0.55)))
+        lines = [line for raw in text.split("\n") for line in textwrap.wrap(raw.strip(), width=max_chars) or [""]]
+        if lines_height(draw, font, lines, line_spacing) <= box_h:
+            return size, lines
+    return 10, textwrap.wrap(text, width=max(1, int(box_w / 6)))
+
+
+@pytest.mark.parametrize("text", LABELS)
+def test_finds_the_largest_size_that_fits(generate_app, draw, text):
+    misses = []
+    for box_w, box_h in BOXES:
+        font, lines = generate_app.fit_text_to_box(draw, text, START, box_w, box_h, 1.05)
+        best = largest_fit(generate_app, draw, text, START, box_w, box_h, 1.05)
+        if font.size != best:
+            misses.append(((box_w, box_h), font.size, best))
+        if font.size > 10:
+            assert all(font.getlength(line) <= box_w for line in lines)
+            assert lines_height(draw, font, lines, 1.05) <= box_h
+    assert misses == []
+
+
+@pytest.mark.parametrize("text", LABELS)
+def test_fits_as_large_as_the_old_descent_did(generate_app, draw, text):
+    for box_w, box_h in BOXES:
+        old_size, old_lines = legacy_fit(generate_app, draw, text, START, box_w, box_h, 1.05)
+        old_font = generate_app.load_font(old_size)
+        if any(old_font.getlength(line) > box_w for line in old_lines) or " ".join(old_lines).split() != text.split():
+            continue  # the old guess overflowed the box or split a word, so its size isn't a fit to match
+        assert generate_app.fit_text_to_box(draw, text, START, box_w, box_h, 1.05)[0].size >= old_size
@@ -0,0 +1,97 @@
+"""bannerkit.flight.SingleFlight: identical renders coalesced, errors shared, nothing left behind."""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from bannerkit.flight import SingleFlight
+from conftest import jpeg
+
+
+class FakePool:
+    """Stands in for an app's RenderPool.run: counts calls and finishes each one when released."""
+
+    def __init__(self):
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self, fn, *args, timings=None):
+        self.calls += 1
+        await self.release.wait()
+        return fn(*args)
+
+
+def test_identical_calls_share_one_render():
+    async def main():
+        pool = FakePool()
+        flight = SingleFlight(pool)
+        calls = [asyncio.ensure_future(flight("key", lambda x: x * 2, 21)) for _ in range(3)]
+        await asyncio.sleep(0)
+        assert flight.in_flight("key")
+        pool.release.set()
+        results = await asyncio.gather(*calls)
+        assert pool.calls == 1
+        assert results == [(42, False), (42, True), (42, True)]
+        assert not flight.in_flight("key")
+        assert flight.stats()["renders"] == 1 and flight.stats()["coalesced"] == 2
+    asyncio.run(main())
+
+
+def test_different_keys_render_separately():
+    async def main():
+        pool = FakePool()
+        pool.release.set()
+        flight = SingleFlight(pool)
+        results = await asyncio.gather(flight("a", str, 1), flight("b", str, 2))
+        assert pool.calls == 2
+        assert results == [("1", False), ("2", False)]
+    asyncio.run(main())
+
+
+def test_an_error_reaches_every_caller_and_is_not_kept():
+    def fail():
+        raise ValueError("bad photo")
+
+    async def main():
+        pool = FakePool()
+        flight = SingleFlight(pool)
+        calls = [asyncio.ensure_future(flight("key", fail)) for _ in range(2)]
+        await asyncio.sleep(0)
+        pool.release.set()
+        results = await asyncio.gather(*calls, return_exceptions=True)
+        assert [type(r) for r in results] == [ValueError, ValueError]
+        assert not flight.in_flight("key")
+        assert await flight("key", lambda: "ok") == ("ok", False)  # the next call renders again
+        assert pool.calls == 2
+    asyncio.run(main())
+
+
+def test_a_caller_going_away_does_not_cancel_the_render():
+    async def main():
+        pool = FakePool()
+        flight = SingleFlight(pool)
+        first = asyncio.ensure_future(flight("key", lambda: "done"))
+        second = asyncio.ensure_future(flight("key", lambda: "done"))
+        await asyncio.sleep(0)
+        first.cancel()  # e.g. the client that started it disconnected
+        await asyncio.sleep(0)
+        pool.release.set()
+        assert await second == ("done", True)
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        assert pool.calls == 1
+    asyncio.run(main())
+
+
+def test_simultaneous_make_banner_requests_render_once(bot_client, bot_app):
+    photo = jpeg((2000, 1333), shade=90)
+    before = bot_app.single_flight.stats()["renders"]
+    def post(_):
+        return bot_client.post("/make_banner", files={"file": ("a.jpg", photo, "image/jpeg")})
+
+    with ThreadPoolExecutor(4) as pool:
+        responses = list(pool.map(post, range(4)))
+    assert {r.status_code for r in responses} == {200}
+    assert len({r.json()["id"] for r in responses}) == 1
+    # Each of the others joined the render (coalesced) or arrived after it and hit the saved output.
+    assert bot_app.single_flight.stats()["renders"] == before + 1
@@ -0,0 +1,84 @@
+"""The /jobs queue: SQLite claim order, restart recovery and per-photo failures."""
+import io
+import time
+import types
+
+import pytest
+
+from conftest import jpeg
+
+
+@pytest.fixture
+def jobs(bot_app, tmp_path, monkeypatch):
+    """banner-bot with a job database of its own under tmp_path."""
+    monkeypatch.setattr(bot_app, "JOB_DIR", str(tmp_path))
+    monkeypatch.setattr(bot_app, "_jobs_db", None)
+    yield bot_app
+    if bot_app._jobs_db is not None:
+        bot_app._jobs_db.close()
+
+
+def spool(app, job_id: str, count: int):
+    uploads = [types.SimpleNamespace(file=io.BytesIO(jpeg(shade=i)), filename=f"{job_id}-{i}.jpg")
+               for i in range(count)]
+    app.spool_job(job_id, uploads, "", None)
+
+
+def test_claims_oldest_job_first_in_photo_order(jobs):
+    spool(jobs, "first", 2)
+    time.sleep(0.01)
+    spool(jobs, "second", 1)
+    claimed = [jobs.claim_job_photo()[:3] for _ in range(3)]
+    assert claimed == [("first", 0, "first-0.jpg"), ("first", 1, "first-1.jpg"), ("second", 0, "second-0.jpg")]
+    assert jobs.claim_job_photo() is None
+    assert jobs.load_job("first")["status"] == "running"
+
+
+def test_a_photo_is_claimed_once(jobs):
+    spool(jobs, "job", 1)
+    assert jobs.claim_job_photo() is not None
+    assert jobs.claim_job_photo() is None
+
+
+def test_recovery_requeues_photos_cut_off_mid_render(jobs):
+    spool(jobs, "job", 2)
+    job_id, idx = jobs.claim_job_photo()[:2]
+    jobs.finish_job_photo(job_id, idx, result={"filename": "job-0.jpg", "outputs": []})
+    jobs.claim_job_photo()  # the process dies while rendering this one
+    jobs.recover_jobs()
+    job = jobs.load_job("job")
+    assert [photo["status"] for photo in job["photos"]] == ["done", "queued"]
+    assert jobs.claim_job_photo()[:2] == ("job", 1)
+
+
+def test_recovery_drops_expired_jobs_and_their_inputs(jobs, tmp_path, monkeypatch):
+    spool(jobs, "old", 1)
+    monkeypatch.setattr(jobs, "OUTPUT_MAX_AGE", -1)
+    jobs.recover_jobs()
+    assert jobs.load_job("old") is None
+    assert not (tmp_path / "old").exists()
+
+
+def test_finished_job_reports_outputs_and_failures(bot_client):
+    files = [("files", ("good.jpg", jpeg(shade=40), "image/jpeg")),
+             ("files", ("broken.jpg", b"\xff\xd8\xff\xe0" + bytes(200), "image/jpeg"))]  # passes the sniffer only
+    response = bot_client.post("/jobs", files=files, data={"specs": '[{"preset": 1}, {"preset": 2}]'})
+    assert response.status_code == 202
+    job_id = response.json()["id"]
+    deadline = time.monotonic() + 30
+    job = bot_client.get(f"/jobs/{job_id}", params={"wait": 5}).json()
+    while job["status"] != "done" and time.monotonic() < deadline:
+        job = bot_client.get(f"/jobs/{job_id}", params={"wait": 5}).json()
+    assert (job["status"], job["done"], job["failed"], job["total"]) == ("done", 1, 1, 2)
+    good, broken = job["photos"]
+    assert [bot_client.get(output["url"]).status_code for output in good["outputs"]] == [200, 200]
+    assert broken == {"filename": "broken.jpg", "status": "error", "error": "Unsupported image"}
+
+
+def test_bad_specs_are_refused_before_queueing(bot_client):
+    response = bot_client.post("/jobs", files=[("files", ("a.jpg", jpeg(), "image/jpeg"))], data={"specs": "[1]"})
+    assert response.status_code == 400
+
+
+def test_unknown_job_is_404(bot_client):
+    assert bot_client.get("/jobs/0123456789abcdef").status_code == 404
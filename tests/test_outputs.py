@@ -0,0 +1,33 @@
+"""bannerkit.outputs: the shared store's misses and errors."""
+import pytest
+
+from bannerkit.outputs import OutputCache, S3Store
+
+boto3 = pytest.importorskip("boto3")
+Stubber = pytest.importorskip("botocore.stub").Stubber
+NAME = "0" * 32 + ".jpg"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    client = boto3.client("s3", region_name="us-east-1", aws_access_key_id="test", aws_secret_access_key="test")
+    monkeypatch.setattr(boto3, "client", lambda *args, **kwargs: client)
+    store = S3Store("s3://bucket/outputs")
+    with Stubber(client) as stub:
+        yield store, stub
+
+
+@pytest.mark.parametrize("code", ["NoSuchKey", "404", "NotFound"])
+def test_a_missing_key_is_a_miss(s3, code):
+    store, stub = s3
+    stub.add_client_error("get_object", service_error_code=code, http_status_code=404)
+    assert store.get(NAME) is None
+
+
+def test_other_errors_reach_the_cache_as_store_errors(s3, tmp_path):
+    store, stub = s3
+    stub.add_client_error("get_object", service_error_code="AccessDenied", http_status_code=403)
+    cache = OutputCache(str(tmp_path))
+    cache.store = store
+    assert cache.pull(NAME) is None
+    assert cache.counts["store_errors"] == 1
@@ -0,0 +1,111 @@
+"""banner-bot admission control: per-caller token buckets, render caps and who counts as a caller."""
+import ipaddress
+import itertools
+
+import pytest
+from starlette.requests import Request
+
+from conftest import jpeg
+
+PHOTO_MP = 3.0  # a 2000x1500 upload
+
+
+@pytest.fixture
+def limits(bot_app, monkeypatch):
+    """A 2MP bucket refilling at 1MP/min, so one photo empties it; no keys or invites configured."""
+    monkeypatch.setattr(bot_app, "RATE_LIMIT_BURST_MP", 2.0)
+    monkeypatch.setattr(bot_app, "RATE_LIMIT_MP_PER_MIN", 1.0)
+    monkeypatch.setattr(bot_app, "API_KEYS", set())
+    monkeypatch.setattr(bot_app, "INVITE_CODES", set())
+    monkeypatch.setattr(bot_app, "_trusted_proxies", [])
+    bot_app._buckets.clear()
+    yield bot_app
+    bot_app._buckets.clear()
+
+
+_shade = itertools.count()
+
+
+def post(client, headers=None, **data):
+    """A /make_banner upload nobody has sent before, so it renders (cache hits are free)."""
+    photo = jpeg((2000, 1500), shade=next(_shade))
+    return client.post("/make_banner", files={"file": ("a.jpg", photo, "image/jpeg")}, data=data, headers=headers)
+
+
+def request(client_host: str, forwarded_for: str = None) -> Request:
+    headers = [(b"x-forwarded-for", forwarded_for.encode())] if forwarded_for else []
+    return Request({"type": "http", "client": (client_host, 50000), "headers": headers})
+
+
+def test_bucket_refuses_with_retry_after_once_spent(limits, bot_client):
+    assert post(bot_client).status_code == 200
+    response = post(bot_client)
+    assert response.status_code == 429
+    assert response.json()["error"] == "Rate limit exceeded"
+    # In debt by 1MP after the 3MP photo, and 2MP more needed: 3 minutes at 1MP/min.
+    assert 170 <= int(response.headers["Retry-After"]) <= 180
+
+
+def test_bucket_refills_over_time(limits):
+    assert limits.admit("ip:1.2.3.4", PHOTO_MP) is None
+    assert limits.admit("ip:1.2.3.4", PHOTO_MP).status_code == 429
+    tokens, last = limits._buckets["ip:1.2.3.4"]
+    limits._buckets["ip:1.2.3.4"] = (tokens, last - 180)  # three minutes later
+    assert limits.admit("ip:1.2.3.4", PHOTO_MP) is None
+
+
+def test_concurrent_renders_are_capped_per_caller(limits, monkeypatch):
+    monkeypatch.setattr(limits, "RATE_LIMIT_CONCURRENT", 2)
+    with limits.caller_render("ip:1.2.3.4"), limits.caller_render("ip:1.2.3.4"):
+        refused = limits.admit("ip:1.2.3.4", 0.1)
+        assert refused.status_code == 429
+        assert limits.admit("ip:5.6.7.8", 0.1) is None  # other callers aren't held up
+        assert limits.admit("ip:1.2.3.4", 0.1, concurrent=False) is None  # jobs only pay the bucket
+    assert limits.admit("ip:1.2.3.4", 0.1) is None
+
+
+def test_made_up_api_keys_share_the_address_bucket(limits, bot_client):
+    # With API_KEY unset, X-API-Key isn't checked, so it can't buy a fresh bucket.
+    assert post(bot_client, headers={"X-API-Key": "one"}).status_code == 200
+    assert post(bot_client, headers={"X-API-Key": "two"}).status_code == 429
+
+
+def test_each_configured_api_key_has_its_own_bucket(limits, bot_client, monkeypatch):
+    monkeypatch.setattr(limits, "API_KEYS", {"key-a", "key-b"})
+    assert post(bot_client, headers={"X-API-Key": "key-a"}).status_code == 200
+    assert post(bot_client, headers={"X-API-Key": "key-b"}).status_code == 200
+    assert post(bot_client, headers={"X-API-Key": "key-a"}).status_code == 429
+    assert post(bot_client, headers={"X-API-Key": "key-c"}).status_code == 401
+
+
+def test_cache_hits_are_free(limits, bot_client):
+    photo = jpeg((2000, 1500), shade=250)
+    for cached in (False, True):
+        response = bot_client.post("/make_banner", files={"file": ("a.jpg", photo, "image/jpeg")})
+        assert response.status_code == 200
+        assert response.json()["cached"] is cached
+
+
+def test_form_callers_are_keyed_on_invite_and_address(limits, monkeypatch):
+    monkeypatch.setattr(limits, "INVITE_CODES", {"coach123", "team2"})
+    coach = limits.caller_id(request("1.2.3.4"), None, "coach123")
+    team = limits.caller_id(request("1.2.3.4"), None, "team2")
+    assert coach.startswith("invite:") and coach.endswith(":1.2.3.4")
+    assert coach != team
+    assert limits.caller_id(request("5.6.7.8"), None, "coach123") != coach
+    assert limits.caller_id(request("1.2.3.4"), None, "guess") == "ip:1.2.3.4"
+    assert "coach123" not in coach
+
+
+def test_forwarded_for_is_ignored_from_untrusted_peers(limits):
+    assert limits.client_address(request("203.0.113.9", "1.1.1.1")) == "203.0.113.9"
+
+
+def test_forwarded_for_is_read_back_through_trusted_proxies(limits, monkeypatch):
+    monkeypatch.setattr(limits, "_trusted_proxies", [ipaddress.ip_network("10.0.0.0/8")])
+    assert limits.client_address(request("10.0.0.2", "198.51.100.7")) == "198.51.100.7"
+    # A client can prepend whatever it likes; only the hop the proxy added counts.
+    assert limits.client_address(request("10.0.0.2", "1.1.1.1, 198.51.100.7")) == "198.51.100.7"
+    # Two proxies deep.
+    assert limits.client_address(request("10.0.0.2", "198.51.100.7, 10.0.0.9")) == "198.51.100.7"
+    assert limits.client_address(request("10.0.0.2")) == "10.0.0.2"
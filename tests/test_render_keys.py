@@ -0,0 +1,29 @@
+"""Render keys: the server settings that change output bytes are part of every key."""
+import bannerkit.imaging as imaging
+from bannerkit.imaging import settings_digest
+
+
+def test_encoder_settings_change_the_digest(monkeypatch):
+    base = settings_digest([], long_edge=2048)
+    monkeypatch.setattr(imaging, "JPEG_SUBSAMPLING", "4:4:4")
+    assert settings_digest([], long_edge=2048) != base
+    monkeypatch.setattr(imaging, "MIN_QUALITY", 60)
+    assert len({base, settings_digest([], long_edge=2048), settings_digest([], long_edge=1600)}) == 3
+
+
+def test_font_files_change_the_digest(tmp_path):
+    font = tmp_path / "Brand-Heavy.otf"
+    font.write_bytes(b"x" * 10)
+    before = settings_digest([str(font)])
+    font.write_bytes(b"x" * 20)  # the same face name, another file
+    assert settings_digest([str(font)]) != before
+    assert settings_digest([str(tmp_path / "Other-Bold.otf")]) != before
+
+
+def test_app_keys_depend_on_the_settings(generate_app, bot_app, monkeypatch):
+    raw = b"photo"
+    for mod, spec in ((generate_app, {"label": "SOLD"}), (bot_app, {"text": "SOLD", "max_px": 2048})):
+        key = mod.render_key(raw, spec)
+        assert mod.render_key(raw, spec) == key
+        monkeypatch.setattr(mod, "RENDER_SETTINGS", "other")
+        assert mod.render_key(raw, spec) != key
@@ -0,0 +1,94 @@
+"""Upload limits and sniffing (bannerkit.uploads) in front of both apps."""
+import struct
+import zlib
+
+import pytest
+
+from bannerkit import uploads
+from bannerkit.uploads import MultipartSniffer
+from conftest import jpeg
+
+ENDPOINTS = {"generate": ("/generate", "photo"), "bot": ("/make_banner", "file")}
+
+
+def png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def png_header(width: int, height: int) -> bytes:
+    """A PNG this size with no pixel data: enough for the sniffer, nothing to decode."""
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + png_chunk(b"IHDR", ihdr) + png_chunk(b"IDAT", b"") + png_chunk(b"IEND", b"")
+
+
+@pytest.fixture(params=sorted(ENDPOINTS))
+def upload(request):
+    """post(file bytes) against one app's render endpoint."""
+    client = request.getfixturevalue(f"{request.param}_client")
+    path, field = ENDPOINTS[request.param]
+    return lambda data, **kw: client.post(path, files={field: ("photo.jpg", data, "image/jpeg")}, **kw)
+
+
+def test_image_is_accepted(upload):
+    assert upload(jpeg()).status_code == 200
+
+
+def test_non_image_gets_415(upload):
+    response = upload(b"<html>not a photo</html>" * 10)
+    assert response.status_code == 415
+    assert response.json() == {"error": "Unsupported image"}
+
+
+def test_oversized_file_gets_413(upload, monkeypatch):
+    monkeypatch.setattr(uploads, "MAX_UPLOAD_BYTES", 100 * 1024)
+    response = upload(b"\xff\xd8\xff" + bytes(200 * 1024))
+    assert response.status_code == 413
+    assert "aren't accepted" in response.json()["error"]
+
+
+def test_oversized_request_gets_413_from_content_length(upload, monkeypatch):
+    monkeypatch.setattr(uploads, "MAX_REQUEST_BYTES", 1024)
+    assert upload(jpeg()).status_code == 413
+
+
+@pytest.mark.parametrize("side", [12000, 20000])  # over MAX_INPUT_MEGAPIXELS; over Pillow's bomb limit too
+def test_too_many_pixels_gets_413_from_the_header(upload, side):
+    response = upload(png_header(side, side))
+    assert response.status_code == 413
+    assert "pixels" in response.json()["error"]
+
+
+def test_rejections_carry_cors_headers(upload):
+    response = upload(b"nope" * 10, headers={"Origin": "https://www.canva.com"})
+    assert response.status_code == 415
+    assert response.headers["access-control-allow-origin"]
+
+
+def multipart(*parts) -> tuple:
+    boundary = b"XyZ"
+    body = b""
+    for name, filename, data in parts:
+        disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename else "")
+        body += b"--" + boundary + b"\r\nContent-Disposition: " + disposition.encode() + b"\r\n\r\n" + data + b"\r\n"
+    return boundary, body + b"--" + boundary + b"--\r\n"
+
+
+def feed(sniffer: MultipartSniffer, body: bytes, chunk: int):
+    for i in range(0, len(body), chunk):
+        rejected = sniffer.feed(body[i:i + chunk])
+        if rejected:
+            return rejected
+    return None
+
+
+@pytest.mark.parametrize("chunk", [1, 7, 4096])
+def test_sniffer_finds_files_across_chunk_boundaries(chunk):
+    boundary, body = multipart(("text", None, b"<html> is fine in a text field"), ("file", "a.jpg", jpeg()))
+    assert feed(MultipartSniffer(boundary), body, chunk) is None
+    boundary, body = multipart(("text", None, b"SALE"), ("file", "a.jpg", b"<html>" * 20))
+    assert feed(MultipartSniffer(boundary), body, chunk)[:2] == (415, "not_image")
+
+
+def test_sniffer_leaves_short_known_formats_to_the_decoder():
+    # A JPEG whose header doesn't fit in the sniffed bytes isn't refused here.
+    assert uploads.sniff_upload(b"\xff\xd8\xff\xe1" + bytes(100)) is None